@@ -0,0 +1,39 @@
+__author__ = "Michail Xyntarakis"
+__company__ = "Parsons Brinckerhoff"
+__email__ = "xyntarakis@pbworld.com"
+__license__ = "GPL"
+
+
+class AttributeStore(object):
+    """Base class of the slotted network elements. Holds the attributes
+    that are not slots of the element (e.g. the time varying attributes
+    read by the graph) in a dictionary that is created when the first
+    attribute is set. The stored attributes are read as regular ones"""
+
+    __slots__ = ('_attributes',)
+
+    def __getattr__(self, name):
+        #called only if the name is not a slot, property or method
+        if name == '_attributes':
+            raise AttributeError(name)
+        try:
+            return self._attributes[name]
+        except (KeyError, TypeError), e:
+            raise AttributeError("'%s' object has no attribute '%s'" %
+                                 (type(self).__name__, name))
+
+    def setAttribute(self, name, value):
+        """Set the value of the named attribute in the attribute store"""
+        if self._attributes is None:
+            self._attributes = {}
+        self._attributes[name] = value
+
+    def hasAttribute(self, name):
+        """Return True if the named attribute is in the attribute store"""
+        return self._attributes is not None and name in self._attributes
+
+    def deleteAttribute(self, name):
+
+        if not self.hasAttribute(name):
+            raise AttributeError(name)
+        del self._attributes[name]
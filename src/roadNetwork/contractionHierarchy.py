@@ -0,0 +1,323 @@
+__author__ = "Michail Xyntarakis"
+__company__ = "Parsons Brinckerhoff"
+__email__ = "xyntarakis@pbworld.com"
+__license__ = "GPL"
+
+from heapq import heappush, heappop, heapify
+
+import numpy as np
+
+from roadNetwork.csrGraph import INDEX_DTYPE, _getOffsets
+from roadNetwork.errors import GraphError
+from roadNetwork.shortestPaths import INFINITY, _getMovementAdjacency
+
+WITNESS_SETTLE_LIMIT = 100
+
+
+class ContractionHierarchy(object):
+    """A contraction hierarchy of the edges of a graph connected by its
+    movements so that only the turns of the graph are followed. Every
+    edge gets a rank and shortcut arcs, that stand for a path through
+    an edge of lower rank, are added so that a shortest path query only
+    needs to search upwards in rank from the source and from the target.
+
+    Arc i goes from edge arcTail[i] to edge arcHead[i] and costs
+    arcCost[i]: the cost of its head edge and the turn penalties plus
+    the cost of the edges in between if it is a shortcut. A shortcut
+    goes through edge arcMiddle[i] (-1 for the arcs of movements).
+    The cost of a path includes the cost of its first edge.
+
+    Building the hierarchy is slow and is meant to be done once per
+    network. Use save and load to keep it on disk"""
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, edgeIds, edgeCosts, rank, arcTail, arcHead, arcCost, arcMiddle):
+
+        self.edgeIds = [tuple(edgeId) for edgeId in edgeIds]
+        self.edgeIndex = dict((edgeId, i) for i, edgeId in enumerate(self.edgeIds))
+        self.numEdges = len(self.edgeIds)
+        self.edgeCosts = np.asarray(edgeCosts, np.float64)
+        self.rank = np.asarray(rank, INDEX_DTYPE)
+        self.arcTail = np.asarray(arcTail, INDEX_DTYPE)
+        self.arcHead = np.asarray(arcHead, INDEX_DTYPE)
+        self.arcCost = np.asarray(arcCost, np.float64)
+        self.arcMiddle = np.asarray(arcMiddle, INDEX_DTYPE)
+
+        #the upward arcs grouped by tail and the downward arcs by head
+        up = np.flatnonzero(self.rank[self.arcHead] > self.rank[self.arcTail])
+        up = up[np.argsort(self.arcTail[up], kind='mergesort')]
+        down = np.flatnonzero(self.rank[self.arcTail] > self.rank[self.arcHead])
+        down = down[np.argsort(self.arcHead[down], kind='mergesort')]
+
+        self._upOffsets = _getOffsets(self.arcTail[up], self.numEdges).tolist()
+        self._upArcs = up.tolist()
+        self._upHeads = self.arcHead[up].tolist()
+        self._upCosts = self.arcCost[up].tolist()
+        self._downOffsets = _getOffsets(self.arcHead[down], self.numEdges).tolist()
+        self._downArcs = down.tolist()
+        self._downTails = self.arcTail[down].tolist()
+        self._downCosts = self.arcCost[down].tolist()
+
+        self._arcIndex = None       # (tail, head) to arc
+        self.numSettled = 0         # the edges settled by the last query
+
+    @classmethod
+    def build(cls, csr, edgeCosts, movementPenalties=None, allowUTurns=True,
+              witnessSettleLimit=WITNESS_SETTLE_LIMIT):
+        """Contract the edges of the CSR snapshot. A movement costs as much
+        as its emanating edge plus its penalty. U-turns are left out if
+        allowUTurns is False. Witness searches that settle more than
+        witnessSettleLimit edges give up and add the shortcut"""
+
+        edgeCosts = np.asarray(edgeCosts, np.float64)
+        if len(edgeCosts) and edgeCosts.min() < 0:
+            raise GraphError("Contraction hierarchies require non negative costs")
+        offsets, heads, movements = _getMovementAdjacency(csr, allowUTurns)
+        costs = edgeCosts[csr.movementOutEdge]
+        if movementPenalties is not None:
+            costs = costs + movementPenalties
+
+        numEdges = csr.numEdges
+        outArcs = [{} for i in xrange(numEdges)]    # head to (cost, middle)
+        inArcs = [{} for i in xrange(numEdges)]     # tail to cost
+        for tail, head, cost in zip(csr.movementInEdge[movements].tolist(),
+                                    np.asarray(heads).tolist(), costs[movements].tolist()):
+            if tail != head:
+                outArcs[tail][head] = (cost, -1)
+                inArcs[head][tail] = cost
+
+        contraction = _Contraction(outArcs, inArcs, witnessSettleLimit)
+        rank, arcs = contraction.run()
+        arcs = np.array(arcs, np.float64).reshape(-1, 4)
+
+        return cls([edge.iid for edge in csr.edges], edgeCosts, rank,
+                   arcs[:, 0], arcs[:, 1], arcs[:, 2], arcs[:, 3])
+
+    def save(self, fileName):
+        """Write the hierarchy to a binary (.npz) file"""
+        arrays = {}
+        arrays['version'] = np.array(self.FORMAT_VERSION)
+        arrays['edgeIds'] = np.array(self.edgeIds, dtype=str).reshape(-1, 2)
+        arrays['edgeCosts'] = self.edgeCosts
+        arrays['rank'] = self.rank
+        arrays['arcTail'] = self.arcTail
+        arrays['arcHead'] = self.arcHead
+        arrays['arcCost'] = self.arcCost
+        arrays['arcMiddle'] = self.arcMiddle
+
+        outputStream = open(fileName, 'wb')
+        try:
+            np.savez(outputStream, **arrays)
+        finally:
+            outputStream.close()
+
+    @classmethod
+    def load(cls, fileName):
+        """Read a hierarchy written by save"""
+        arrays = np.load(fileName)
+        try:
+            if int(arrays['version']) != cls.FORMAT_VERSION:
+                raise GraphError("%s is not a contraction hierarchy of version %d" %
+                                 (fileName, cls.FORMAT_VERSION))
+            return cls(arrays['edgeIds'].tolist(), arrays['edgeCosts'], arrays['rank'],
+                       arrays['arcTail'], arrays['arcHead'], arrays['arcCost'],
+                       arrays['arcMiddle'])
+        finally:
+            arrays.close()
+
+    def getEdgeIndex(self, startVertexId, endVertexId):
+
+        try:
+            return self.edgeIndex[startVertexId, endVertexId]
+        except KeyError, e:
+            raise GraphError("Edge %s to %s not in the contraction hierarchy" %
+                             (startVertexId, endVertexId))
+
+    def _searchUpwards(self, labels, offsets, arcs, ends, costs,
+                       stallOffsets, stallEnds, stallCosts):
+        """Label the edges of higher rank reachable from the labelled
+        ones. Return the arc each labelled edge was reached by. An edge
+        is not expanded if an edge of higher rank reaches it with a
+        lower label through the arcs of the opposite direction (stall on
+        demand) since no shortest path goes through it"""
+        predecessors = {}
+        heap = [(label, edge) for edge, label in labels.iteritems()]
+        heapify(heap)
+        while heap:
+            label, edge = heappop(heap)
+            if label > labels[edge]:
+                continue
+            self.numSettled += 1
+            stalled = False
+            for i in xrange(stallOffsets[edge], stallOffsets[edge + 1]):
+                if labels.get(stallEnds[i], INFINITY) + stallCosts[i] < label:
+                    stalled = True
+                    break
+            if stalled:
+                continue
+            for i in xrange(offsets[edge], offsets[edge + 1]):
+                end = ends[i]
+                newLabel = label + costs[i]
+                if newLabel < labels.get(end, INFINITY):
+                    labels[end] = newLabel
+                    predecessors[end] = arcs[i]
+                    heappush(heap, (newLabel, end))
+        return predecessors
+
+    def getPath(self, sourceEdges, targetEdges):
+        """Return the cost and the edges of the shortest path that starts
+        from one of the source edges and ends at one of the target edges.
+        Raise GraphError if there is no such path"""
+        self.numSettled = 0
+        forwardLabels = dict((edge, self.edgeCosts[edge]) for edge in sourceEdges)
+        forwardArcs = self._searchUpwards(forwardLabels, self._upOffsets, self._upArcs,
+                                          self._upHeads, self._upCosts, self._downOffsets,
+                                          self._downTails, self._downCosts)
+        backwardLabels = dict.fromkeys(targetEdges, 0.0)
+        backwardArcs = self._searchUpwards(backwardLabels, self._downOffsets,
+                                           self._downArcs, self._downTails, self._downCosts,
+                                           self._upOffsets, self._upHeads, self._upCosts)
+
+        #the shortest path goes through the edge of highest rank on it
+        best = INFINITY
+        meeting = None
+        for edge, label in forwardLabels.iteritems():
+            if edge in backwardLabels and label + backwardLabels[edge] < best:
+                best = label + backwardLabels[edge]
+                meeting = edge
+
+        if meeting is None:
+            raise GraphError("There is no path from edges %s to edges %s" %
+                             (list(sourceEdges), list(targetEdges)))
+
+        upArcs = []
+        edge = meeting
+        while edge in forwardArcs:
+            arc = forwardArcs[edge]
+            upArcs.append(arc)
+            edge = self.arcTail[arc]
+        upArcs.reverse()
+        edges = [edge]
+        for arc in upArcs:
+            edges.extend(self._unpack(arc))
+        edge = meeting
+        while edge in backwardArcs:
+            arc = backwardArcs[edge]
+            edges.extend(self._unpack(arc))
+            edge = self.arcHead[arc]
+        return best, edges
+
+    def _unpack(self, arc):
+        """Return the edges after the tail of the arc up to and including
+        its head with the shortcuts replaced by the paths they stand for"""
+        if self._arcIndex is None:
+            self._arcIndex = dict(((tail, head), i) for i, (tail, head) in
+                                  enumerate(zip(self.arcTail.tolist(), self.arcHead.tolist())))
+        edges = []
+        stack = [arc]
+        while stack:
+            arc = stack.pop()
+            middle = self.arcMiddle[arc]
+            if middle < 0:
+                edges.append(self.arcHead[arc])
+            else:
+                tail = self.arcTail[arc]
+                head = self.arcHead[arc]
+                stack.append(self._arcIndex[middle, head])
+                stack.append(self._arcIndex[tail, middle])
+        return edges
+
+
+class _Contraction(object):
+    """Contracts the nodes of a graph in the order of their edge
+    difference (shortcuts added minus arcs removed) plus their level in
+    the hierarchy and records the arcs of the hierarchy"""
+
+    def __init__(self, outArcs, inArcs, witnessSettleLimit):
+
+        self._outArcs = outArcs
+        self._inArcs = inArcs
+        self._witnessSettleLimit = witnessSettleLimit
+        self._levels = [0] * len(outArcs)
+
+    def _getWitnessLabels(self, source, excluded, maxLabel):
+        """Return the labels of a Dijkstra from the source that does not
+        go through the excluded node and stops beyond maxLabel"""
+        labels = {source: 0.0}
+        heap = [(0.0, source)]
+        numSettled = 0
+        while heap:
+            label, node = heappop(heap)
+            if label > labels[node]:
+                continue
+            if label > maxLabel or numSettled >= self._witnessSettleLimit:
+                break
+            numSettled += 1
+            for head, (cost, middle) in self._outArcs[node].iteritems():
+                if head == excluded:
+                    continue
+                newLabel = label + cost
+                if newLabel < labels.get(head, INFINITY):
+                    labels[head] = newLabel
+                    heappush(heap, (newLabel, head))
+        return labels
+
+    def _getShortcuts(self, node):
+        """Return the (tail, head, cost) of the shortcuts needed if the
+        node is contracted"""
+        outArcs = self._outArcs[node]
+        if not outArcs:
+            return []
+        maxOutCost = max(cost for cost, middle in outArcs.itervalues())
+        shortcuts = []
+        for tail, inCost in self._inArcs[node].iteritems():
+            labels = self._getWitnessLabels(tail, node, inCost + maxOutCost)
+            for head, (outCost, middle) in outArcs.iteritems():
+                if head != tail and labels.get(head, INFINITY) > inCost + outCost:
+                    shortcuts.append((tail, head, inCost + outCost))
+        return shortcuts
+
+    def _getPriority(self, node):
+        """Return the priority of the node (lower is contracted first) and
+        the shortcuts its contraction needs"""
+        shortcuts = self._getShortcuts(node)
+        edgeDifference = len(shortcuts) - len(self._outArcs[node]) - len(self._inArcs[node])
+        return edgeDifference + self._levels[node], shortcuts
+
+    def run(self):
+        """Return the rank of every node and the (tail, head, cost,
+        middle) of the arcs of the hierarchy"""
+        numNodes = len(self._outArcs)
+        heap = [(self._getPriority(node)[0], node) for node in xrange(numNodes)]
+        heapify(heap)
+        rank = [-1] * numNodes
+        arcs = []
+        nextRank = 0
+        while heap:
+            priority, node = heappop(heap)
+            #lazy update: contract only if still the least important node
+            priority, shortcuts = self._getPriority(node)
+            if heap and priority > heap[0][0]:
+                heappush(heap, (priority, node))
+                continue
+
+            rank[node] = nextRank
+            nextRank += 1
+            level = self._levels[node] + 1
+            for head, (cost, middle) in self._outArcs[node].iteritems():
+                arcs.extend((node, head, cost, middle))
+                del self._inArcs[head][node]
+                self._levels[head] = max(self._levels[head], level)
+            for tail, cost in self._inArcs[node].iteritems():
+                arcs.extend((tail, node, cost, self._outArcs[tail][node][1]))
+                del self._outArcs[tail][node]
+                self._levels[tail] = max(self._levels[tail], level)
+            self._outArcs[node] = {}
+            self._inArcs[node] = {}
+
+            for tail, head, cost in shortcuts:
+                if cost < self._outArcs[tail].get(head, (INFINITY, -1))[0]:
+                    self._outArcs[tail][head] = (cost, node)
+                    self._inArcs[head][tail] = cost
+        return rank, arcs
@@ -0,0 +1,143 @@
+__author__ = "Michail Xyntarakis"
+__company__ = "Parsons Brinckerhoff"
+__email__ = "xyntarakis@pbworld.com"
+__license__ = "GPL"
+
+import numpy as np
+
+from roadNetwork.errors import GraphError
+
+INDEX_DTYPE = np.int32
+
+
+def _getOffsets(keys, numKeys):
+    """Return the offsets delimiting the groups of equal keys after the
+    input integer keys in the range [0, numKeys) are sorted"""
+    offsets = np.zeros(numKeys + 1, INDEX_DTYPE)
+    offsets[1:] = np.cumsum(np.bincount(keys, minlength=numKeys))
+    return offsets
+
+
+class CsrGraph(object):
+    """A compact snapshot of the topology of a graph in compressed sparse
+    row form. Vertices, edges and movements are identified by consecutive
+    integers (their position in the vertices, edges and movements lists).
+    The edges emanating from vertex v are outEdges[outOffsets[v]:
+    outOffsets[v + 1]] and the edges incident to it are inEdges[
+    inOffsets[v]:inOffsets[v + 1]]. The movements emanating from edge e
+    are the integers in the range movementOffsets[e]:movementOffsets[e + 1].
+
+    A snapshot is not updated when the graph changes. Use Graph.getCSR to
+    get a snapshot of the current topology and costs"""
+
+    def __init__(self, graph):
+
+        self.version = graph.getTopologyVersion()
+        self.costVersion = graph.getCostVersion()
+
+        self.vertices = list(graph.iterVertices())
+        self.vertexIndex = dict((vertex.id, i) for i, vertex in enumerate(self.vertices))
+        self.numVertices = len(self.vertices)
+
+        self.edges = list(graph.iterEdges())
+        self.edgeIndex = dict((edge.iid, i) for i, edge in enumerate(self.edges))
+        self.numEdges = len(self.edges)
+
+        self.edgeStart = np.array([self.vertexIndex[edge.startVertexId] for edge
+                                   in self.edges], INDEX_DTYPE)
+        self.edgeEnd = np.array([self.vertexIndex[edge.endVertexId] for edge
+                                 in self.edges], INDEX_DTYPE)
+
+        self.outEdges = np.argsort(self.edgeStart, kind='mergesort').astype(INDEX_DTYPE)
+        self.outOffsets = _getOffsets(self.edgeStart, self.numVertices)
+        self.inEdges = np.argsort(self.edgeEnd, kind='mergesort').astype(INDEX_DTYPE)
+        self.inOffsets = _getOffsets(self.edgeEnd, self.numVertices)
+
+        #the movements are grouped by their incident edge in the clockwise
+        #order they are stored in the edge
+        self.movements = [mov for edge in self.edges for mov in edge.iterOutMovements()]
+        self.numMovements = len(self.movements)
+        self.movementInEdge = np.array([self.edgeIndex[mov.inEdge.iid] for mov
+                                        in self.movements], INDEX_DTYPE)
+        self.movementOutEdge = np.array([self.edgeIndex[mov.outEdge.iid] for mov
+                                         in self.movements], INDEX_DTYPE)
+        self.movementDenseId = np.array([mov.getDenseId() for mov in self.movements],
+                                        INDEX_DTYPE)
+        self.movementOffsets = _getOffsets(self.movementInEdge, self.numEdges)
+        self.movementIsUTurn = self.edgeStart[self.movementInEdge] == \
+            self.edgeEnd[self.movementOutEdge]
+
+        self.updateEdgeAttributes()
+        self.updateMovementAttributes()
+
+    def updateEdgeAttributes(self):
+        """Copy the length, number of lanes and free flow speed of the
+        edges to the edge attribute arrays"""
+        self.lengthInFeet = np.array([edge.lengthInFeet for edge in self.edges], np.float64)
+        self.lengthInMiles = np.array([edge.getLengthInMiles() for edge in self.edges],
+                                      np.float64)
+        self.numLanes = np.array([edge.getNumLanes() for edge in self.edges], INDEX_DTYPE)
+        self.freeFlowSpeedInMPH = np.array([edge.getFreeFlowSpeedInMPH() for edge
+                                            in self.edges], np.float64)
+
+    def updateMovementAttributes(self):
+        """Copy the turn penalties of the movements to the movement
+        attribute arrays"""
+        self.movementPenalty = np.array([mov.getPenalty() for mov in self.movements],
+                                        np.float64)
+
+    def getFreeFlowTTsInMin(self):
+        """Return an array with the free flow travel time of each edge"""
+        return self.lengthInMiles / self.freeFlowSpeedInMPH * 60.0
+
+    def getTimeVaryingCosts(self):
+        """Return a (numMovements, numIntervals) array with the time
+        varying costs of the movements, the start time and the time
+        step of the intervals in minutes"""
+        if self.numMovements == 0:
+            raise GraphError("The graph does not have any movements")
+        for mov in self.movements:
+            if len(mov._timeVaryingCosts) == 0:
+                raise GraphError("Movement %s does not have time varying costs" % mov.iid_)
+        first = self.movements[0]
+        timeStep = first.getTimeVaryingCostTimeStep()
+        numIntervals = len(first._timeVaryingCosts)
+        for mov in self.movements:
+            if len(mov._timeVaryingCosts) != numIntervals or \
+                    mov.getTimeVaryingCostTimeStep() != timeStep or \
+                    mov.simStartTimeInMin != first.simStartTimeInMin:
+                raise GraphError("The time varying costs of movements %s and %s "
+                                 "are not defined over the same intervals" %
+                                 (first.iid_, mov.iid_))
+        costs = np.array([mov._timeVaryingCosts for mov in self.movements], np.float64)
+        return costs, first.simStartTimeInMin, timeStep
+
+    def getVertexIndex(self, vertexId):
+
+        try:
+            return self.vertexIndex[vertexId]
+        except KeyError, e:
+            raise GraphError("Vertex %s not in the graph" % vertexId)
+
+    def getEdgeIndex(self, startVertexId, endVertexId):
+
+        try:
+            return self.edgeIndex[startVertexId, endVertexId]
+        except KeyError, e:
+            raise GraphError("Edge %s to %s not in the graph" %
+                             (startVertexId, endVertexId))
+
+    def getOutEdges(self, vertex):
+        """Return the indices of the edges emanating from the vertex
+        with the input index"""
+        return self.outEdges[self.outOffsets[vertex]:self.outOffsets[vertex + 1]]
+
+    def getInEdges(self, vertex):
+        """Return the indices of the edges incident to the vertex with
+        the input index"""
+        return self.inEdges[self.inOffsets[vertex]:self.inOffsets[vertex + 1]]
+
+    def getOutMovements(self, edge):
+        """Return the range of the indices of the movements emanating
+        from the edge with the input index"""
+        return xrange(self.movementOffsets[edge], self.movementOffsets[edge + 1])
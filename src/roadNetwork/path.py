@@ -3,8 +3,15 @@ __company__ = "Parsons Brinckerhoff"
 __email__ = "xyntarakis@pbworld.com"
 __license__ = "GPL"
 
-from algorithms.shortestPaths import ShortestPaths
-from errors import GraphError
+import numpy as np
+
+from pbCore.utils.itertools2 import pairwise
+
+from roadNetwork.errors import GraphError, SimError
+from roadNetwork.movement import getSimTTsForRows
+from roadNetwork.shortestPaths import getFreeFlowVertexSearch, getLengthMovementSearch, \
+    getFreeFlowMovementSearch, getFreeFlowPointToPointSearch, TimeDependentSearch, \
+    getManyToMany
 
 class Path(object):
 
@@ -39,6 +46,19 @@ class Path(object):
         self._lengthInMiles = sum([edge.getLengthInMiles() for edge in self.iterEdges()])
 
         self._obsTTInMin = {}
+
+        #the movements between consecutive edges followed by the thru 
+        #turn of the last edge if it has one
+        self._movements = [edgeUp.getOutMovement(edgeDown.endVertexId) for
+                           edgeUp, edgeDown in pairwise(self._edges)]
+        if self._edges[-1].hasThruTurn():
+            self._movements.append(self._edges[-1].getThruTurn())
+        self._hasLastMovement = len(self._movements) == len(self._edges)
+
+        self._costVersion = None    # the graph cost version of the arrays below
+        self._resultRows = None     # the result rows of the movements
+        self._freeFlowTTs = None    # the free flow travel times of the movements
+        self._penalties = None      # the penalties of the movements
                       
     def __repr__(self):
         
@@ -98,24 +118,71 @@ class Path(object):
         time period using the """
         
         simTT = 0
-        if self.getNumEdges() > 1:
-            for upEdge, downEdge in pairwise(self.iterEdges()):
-                movement = upEdge.getOutMovement(downEdge.endVertexId)
-                movTT = movement.getSimTTInMin(startTimeInMin, endTimeInMin)            
-                simTT += movTT
-        else:
-            downEdge = self._edges[0]
+        for movement in self._movements:
+            simTT += movement.getSimTTInMin(startTimeInMin, endTimeInMin)
 
-        if downEdge.hasThruTurn():
-            finalMovement = downEdge.getThruTurn()
-            movTT = finalMovement.getSimTTInMin(startTimeInMin, endTimeInMin)
-            simTT += movTT
-        else:
-            edgeTT = downEdge.getSimTTInMin(startTimeInMin, endTimeInMin)
-            simTT += edgeTT        
+        if not self._hasLastMovement:
+            simTT += self._edges[-1].getSimTTInMin(startTimeInMin, endTimeInMin)
 
         return simTT
 
+    def _getGraph(self):
+        """Return the graph of the edges of the path or None if they do
+        not belong to one"""
+        return self._edges[0]._graph
+
+    def _updateResultArrays(self):
+        """Gather the result rows, the free flow travel times and the
+        penalties of the movements of the path if the costs or the
+        results of the graph changed since they were last gathered"""
+        costVersion = self._getGraph().getCostVersion()
+        if costVersion == self._costVersion:
+            return
+
+        self._resultRows, self._freeFlowTTs, self._penalties = \
+            _getMovementArrays(self._movements)
+        self._costVersion = costVersion
+
+    def _getMovementTotals(self, timeWindows):
+        """Return the simulated volumes and mean travel times of the
+        movements of the path (one row per movement) in each of the 
+        input time windows (one column per window)"""
+        if self._getGraph() is None:
+            return _getPrivateMovementTotals(self._movements, timeWindows)
+
+        self._updateResultArrays()
+        volumes, meanTTs, numInconsistent = getSimTTsForRows(
+            self._getGraph().getMovementResults(), self._resultRows,
+            self._freeFlowTTs, self._penalties, timeWindows)
+        _checkConsistency(self._movements, numInconsistent, timeWindows)
+        return volumes, meanTTs
+
+    def getSimTTsInMin(self, timeWindows):
+        """Return an array with the simulated travel time in minutes of 
+        the path in each of the input (startTimeInMin, endTimeInMin) time 
+        windows. It is the array version of getAverageSimTTInMin"""
+        volumes, meanTTs = self._getMovementTotals(timeWindows)
+        simTTs = meanTTs.sum(axis=0)
+        if not self._hasLastMovement:
+            simTTs += self._edges[-1].getSimTTsInMin(timeWindows)
+        return simTTs
+
+    def getSimSpeedsInMPH(self, timeWindows):
+        """Return an array with the simulated speed of the path in each
+        of the input (startTimeInMin, endTimeInMin) time windows"""
+        return self.getLengthInMiles() / (self.getSimTTsInMin(timeWindows) / 60.0)
+
+    def getSimVolumes(self, timeWindows):
+        """Return a (numEdges, numWindows) array with the simulated volume
+        of every edge of the path that stays on the path in each of the 
+        input (startTimeInMin, endTimeInMin) time windows. The volume of 
+        the last edge is the volume of its thru turn or, if it has none,
+        the volume of the edge"""
+        volumes, meanTTs = self._getMovementTotals(timeWindows)
+        if not self._hasLastMovement:
+            volumes = np.vstack((volumes, self._edges[-1].getSimVolumes(timeWindows)))
+        return volumes
+
     def getLengthInMiles(self):
 
         return self._lengthInMiles
@@ -133,32 +200,318 @@ class Path(object):
         """Set the observed travel time in minutes for the specified time period"""
         self._obsTTInMin[startTimeInMin, endTimeInMin] = obsTimeInMin
         
-def getSPBetweenEdges(net, pathName, listOfEdgeIds):
-    """Return a path that goes through all the input edges"""
+def _getMovementArrays(movements):
+    """Return three arrays with the result row, the free flow travel 
+    time and the penalty of each of the input movements"""
+    return (np.array([mov._resultRow for mov in movements], np.intp),
+            np.array([mov.inEdge.getFreeFlowTTInMin() for mov in movements],
+                     np.float64),
+            np.array([mov.getPenalty() for mov in movements], np.float64))
+
+def _getPrivateMovementTotals(movements, timeWindows):
+    """Return the simulated volumes and mean travel times of movements
+    that do not belong to a graph (one row per movement and one column
+    per window). Each keeps its results in a private store so they are
+    gathered one movement at a time"""
+    numWindows = len(timeWindows)
+    volumes = np.array([mov.getSimVolumes(timeWindows) for mov in movements], np.float64)
+    meanTTs = np.array([mov.getSimTTsInMin(timeWindows) for mov in movements], np.float64)
+    return volumes.reshape(-1, numWindows), meanTTs.reshape(-1, numWindows)
+
+def _checkConsistency(movements, numInconsistent, timeWindows):
+    """Raise a SimError if a movement has a time step with flow but
+    without travel time (or vice versa) in one of the time windows"""
+    if numInconsistent.any():
+        i, j = np.argwhere(numInconsistent)[0]
+        start, end = timeWindows[j]
+        raise SimError("Movement %s has a time step with flow but without "
+                       "travel time (or vice versa) in the time period from "
+                       "%d to %d" % (movements[i].iid, start, end))
+
+class PathSet(object):
+    """A set of paths of the same graph evaluated together. The paths 
+    are stored as a sparse path by movement incidence matrix in 
+    compressed sparse row form: the movements of path i are the columns
+    columns[offsets[i]:offsets[i + 1]] of the distinct movements of the
+    set. The travel times of all the paths in all the time windows are
+    the product of the incidence matrix with the travel times of the
+    distinct movements, which are computed once per window no matter 
+    how many paths share them"""
+
+    def __init__(self, paths):
+
+        self._paths = list(paths)
+        if not self._paths:
+            raise GraphError("A path set needs at least one path")
+        self._pathsByName = dict((path.getName(), i) for i, path in enumerate(self._paths))
+
+        self._movements = []
+        movementColumns = {}
+        columns = []
+        offsets = [0]
+        self._lastEdges = []            # the distinct last edges without a thru turn
+        lastEdgeColumns = {}
+        self._lastEdgePaths = []        # the paths ending at one of them
+        self._lastEdgeColumns = []
+        for i, path in enumerate(self._paths):
+            for movement in path._movements:
+                if movement not in movementColumns:
+                    movementColumns[movement] = len(self._movements)
+                    self._movements.append(movement)
+                columns.append(movementColumns[movement])
+            offsets.append(len(columns))
+
+            if not path._hasLastMovement:
+                edge = path.getLastEdge()
+                if edge not in lastEdgeColumns:
+                    lastEdgeColumns[edge] = len(self._lastEdges)
+                    self._lastEdges.append(edge)
+                self._lastEdgePaths.append(i)
+                self._lastEdgeColumns.append(lastEdgeColumns[edge])
+
+        self._columns = np.array(columns, np.intp)
+        self._offsets = np.array(offsets, np.intp)
+        self._lengthsInMiles = np.array([path.getLengthInMiles() for path in self._paths])
+
+        self._costVersion = None    # the graph cost version of the arrays below
+        self._resultRows = None
+        self._freeFlowTTs = None
+        self._penalties = None
+
+    def __len__(self):
+
+        return len(self._paths)
+
+    def iterPaths(self):
+        """Return an iterator to the paths in the order of the rows of
+        the returned arrays"""
+        return iter(self._paths)
+
+    def getPathIndex(self, pathName):
+        """Return the row of the path with the input name"""
+        try:
+            return self._pathsByName[pathName]
+        except KeyError, e:
+            raise GraphError("Path %s is not in the path set" % pathName)
+
+    def getNumMovements(self):
+        """Return the number of distinct movements of the paths"""
+        return len(self._movements)
+
+    def _getGraph(self):
+
+        return self._paths[0]._getGraph()
+
+    def _updateResultArrays(self):
+
+        costVersion = self._getGraph().getCostVersion()
+        if costVersion == self._costVersion:
+            return
+
+        self._resultRows, self._freeFlowTTs, self._penalties = \
+            _getMovementArrays(self._movements)
+        self._costVersion = costVersion
+
+    def _multiply(self, movementValues):
+        """Return the product of the incidence matrix with the input
+        (numMovements, numWindows) array"""
+        result = np.zeros((len(self._paths), movementValues.shape[1]))
+        entries = movementValues[self._columns]
+        nonEmpty = np.flatnonzero(self._offsets[:-1] < self._offsets[1:])
+        if len(nonEmpty):
+            result[nonEmpty] = np.add.reduceat(entries, self._offsets[nonEmpty], axis=0)
+        return result
+
+    def getSimTTsInMin(self, timeWindows):
+        """Return a (numPaths, numWindows) array with the simulated travel
+        time in minutes of every path in each of the input (startTimeInMin, 
+        endTimeInMin) time windows"""
+        if self._getGraph() is None:
+            volumes, meanTTs = _getPrivateMovementTotals(self._movements, timeWindows)
+        else:
+            self._updateResultArrays()
+            volumes, meanTTs, numInconsistent = getSimTTsForRows(
+                self._getGraph().getMovementResults(), self._resultRows,
+                self._freeFlowTTs, self._penalties, timeWindows)
+            _checkConsistency(self._movements, numInconsistent, timeWindows)
+
+        simTTs = self._multiply(meanTTs)
+        if self._lastEdges:
+            edgeTTs = np.array([edge.getSimTTsInMin(timeWindows) for edge in self._lastEdges])
+            simTTs[self._lastEdgePaths] += edgeTTs[self._lastEdgeColumns]
+        return simTTs
+
+    def getSimSpeedsInMPH(self, timeWindows):
+        """Return a (numPaths, numWindows) array with the simulated speed
+        of every path in each of the input time windows"""
+        simTTs = self.getSimTTsInMin(timeWindows)
+        return self._lengthsInMiles[:, np.newaxis] / (simTTs / 60.0)
+
+    def getObsTTsInMin(self, timeWindows):
+        """Return a (numPaths, numWindows) array with the observed travel
+        time of every path in each of the input time windows. Windows 
+        without an observation are NaN"""
+        windows = [tuple(window) for window in timeWindows]
+        return np.array([[path._obsTTInMin.get(window, np.nan) for window in windows]
+                         for path in self._paths], np.float64).reshape(-1, len(windows))
+
+    def getTTErrorsInMin(self, timeWindows):
+        """Return a (numPaths, numWindows) array with the simulated minus 
+        the observed travel time of every path in each of the input time 
+        windows. Windows without an observation are NaN"""
+        return self.getSimTTsInMin(timeWindows) - self.getObsTTsInMin(timeWindows)
+
+    def getSpeedErrorsInMPH(self, timeWindows):
+        """Return a (numPaths, numWindows) array with the simulated minus
+        the observed speed of every path in each of the input time
+        windows. Windows without an observation are NaN"""
+        obsSpeeds = self._lengthsInMiles[:, np.newaxis] / (self.getObsTTsInMin(timeWindows) / 60.0)
+        return self.getSimSpeedsInMPH(timeWindows) - obsSpeeds
+
+def _getEdge(net, edgeId):
+    """Return the edge with the input id. The id is either a (startVertexId,
+    endVertexId) pair or the two ids separated by white space"""
+    if isinstance(edgeId, basestring):
+        edgeId = edgeId.split()
+    return net.getEdge(*edgeId)
+
+def getSPBetweenEdges(net, pathName, listOfEdgeIds, allowUTurns=True, usePenalties=False):
+    """Return the shortest path in feet that goes through all the input
+    edges in the order they are given following the movements of the
+    network. If allowUTurns is False the path does not contain U-turns.
+    If usePenalties is True the path minimizes the free flow travel 
+    time plus the penalties of its movements (both in minutes) instead"""
 
     assert len(listOfEdgeIds) >= 2
 
-    edges = [net.getLink(edgeId) for edgeId in listOfEdgeIds]     
-    ShortestPaths.initializeMovementCostsWithLengthInFeet(net)
-    
-    path = []
-    i = 0
-    for edge1, edge2 in pairwise(edges):
-        ShortestPaths.labelCorrectingWithLabelsOnEdges(net, edge1)
-        subPath = ShortestPaths.getShortestPathBetweenEdges(edge1, edge2)
-        i += 1
-        if i > 1:
-            subPath.pop(0)
-        path.extend(subPath) 
-        
-    return Path(pathName, path)
-        
+    csr = net.getCSR()
+    trees = net.getShortestPathTrees()
+    edges = [_getEdge(net, edgeId) for edgeId in listOfEdgeIds]
+    edgeIndices = [csr.getEdgeIndex(*edge.iid) for edge in edges]
+
+    path = [edgeIndices[0]]
+    for edge1, edge2 in pairwise(edgeIndices):
+        if usePenalties:
+            tree = trees.getTree(edge1, getFreeFlowMovementSearch, allowUTurns)
+        else:
+            tree = trees.getTree(edge1, getLengthMovementSearch, allowUTurns)
+        if not tree.isReached(edge2):
+            raise GraphError("Edge %s is not reachable from edge %s" %
+                             (csr.edges[edge2].iid_, csr.edges[edge1].iid_))
+        path.extend(tree.getNodePath(edge2)[1:])
+
+    return Path(pathName, [csr.edges[i] for i in path])
+
 def getSPBetweenVertices(net, pathName, sourceVertexId, destVertexId):
+    """Return the free flow travel time shortest path between the two
+    vertices"""
+
+    csr = net.getCSR()
+    source = csr.getVertexIndex(sourceVertexId)
+    dest = csr.getVertexIndex(destVertexId)
+
+    tree = net.getShortestPathTrees().getTree(source, getFreeFlowVertexSearch)
+    if not tree.isReached(dest):
+        raise GraphError("Vertex %s is not reachable from vertex %s" %
+                         (destVertexId, sourceVertexId))
+    return Path(pathName, [csr.edges[i] for i in tree.getArcPath(dest)])
+
+def getPointToPointSP(net, pathName, sourceVertexId, destVertexId, bidirectional=False):
+    """Return the free flow travel time shortest path between the two
+    vertices found by A* or, if bidirectional is True, by bidirectional
+    Dijkstra. Only the vertices near the path are labelled"""
+
+    csr = net.getCSR()
+    source = csr.getVertexIndex(sourceVertexId)
+    dest = csr.getVertexIndex(destVertexId)
+    search = net.getShortestPathTrees().getSearch(getFreeFlowPointToPointSearch)
+    if bidirectional:
+        cost, edges = search.getBidirectionalPath(source, dest)
+    else:
+        cost, edges = search.getAStarPath(source, dest)
+    return Path(pathName, [csr.edges[i] for i in edges])
+
+def getCHSPBetweenVertices(net, pathName, hierarchy, sourceVertexId, destVertexId):
+    """Return the shortest path between the two vertices found by a query
+    of the input contraction hierarchy of the network"""
 
     sourceVertex = net.getVertex(sourceVertexId)
     destVertex = net.getVertex(destVertexId)
-    ShortestPaths.initializeEdgeCostsWithFFTT(net)
-    
-    ShortestPaths.labelCorrecting(net, sourceVertex)
-    path = ShortestPaths.getShortestPathAsListOfEdges(sourceVertex, destVertex)
-    return Path(pathName, path)
+    cost, edges = hierarchy.getPath(
+        [hierarchy.getEdgeIndex(*edge.iid) for edge in sourceVertex.iterOutEdges()],
+        [hierarchy.getEdgeIndex(*edge.iid) for edge in destVertex.iterInEdges()])
+    return Path(pathName, [net.getEdge(*hierarchy.edgeIds[i]) for i in edges])
+
+def getODTravelTimes(net, originIds, destinationIds, numProcesses=1):
+    """Return a (numOrigins, numDestinations) array with the free flow
+    travel time of the shortest path between every origin and destination
+    vertex (infinity if there is no path). If numProcesses is greater than
+    one the origins are distributed to a pool of worker processes"""
+
+    csr = net.getCSR()
+    search = getFreeFlowVertexSearch(csr)
+    return getManyToMany(search, [csr.getVertexIndex(vertexId) for vertexId in originIds],
+                         [csr.getVertexIndex(vertexId) for vertexId in destinationIds],
+                         numProcesses=numProcesses)
+
+def getSPsBetweenVertices(net, originIds, destinationIds, numProcesses=1):
+    """Return a dictionary from the (originId, destinationId) pairs to the
+    free flow travel time shortest path between them. Pairs without a
+    path or with the same origin and destination are left out. If
+    numProcesses is greater than one the origins are distributed to a
+    pool of worker processes"""
+
+    csr = net.getCSR()
+    search = getFreeFlowVertexSearch(csr)
+    costs, arcPaths = getManyToMany(search, 
+                                    [csr.getVertexIndex(vertexId) for vertexId in originIds],
+                                    [csr.getVertexIndex(vertexId) for vertexId in destinationIds],
+                                    withPaths=True, numProcesses=numProcesses)
+    paths = {}
+    arcPaths = iter(arcPaths)
+    for originId in originIds:
+        for destinationId in destinationIds:
+            arcPath = arcPaths.next()
+            if arcPath:
+                paths[originId, destinationId] = Path("%s %s" % (originId, destinationId),
+                                                      [csr.edges[i] for i in arcPath])
+    return paths
+
+def getSPFromDynamicTree(net, pathName, tree, destVertexId):
+    """Return the shortest path to the destination vertex in a dynamic
+    tree with vertex ids as nodes (see getFreeFlowDynamicTree)"""
+
+    vertexIds = tree.getNodePath(destVertexId)
+    return Path(pathName, [net.getEdge(startVertexId, endVertexId) for 
+                           startVertexId, endVertexId in pairwise(vertexIds)])
+
+def _getTimeDependentSearch(net, sourceEdgeId, allowUTurns):
+
+    csr = net.getCSR()
+    costs, startTimeInMin, timeStepInMin = csr.getTimeVaryingCosts()
+    search = TimeDependentSearch(csr, costs, startTimeInMin, timeStepInMin,
+                                 allowUTurns=allowUTurns)
+    return csr, search, csr.getEdgeIndex(*_getEdge(net, sourceEdgeId).iid)
+
+def getTDSPBetweenEdges(net, pathName, sourceEdgeId, destEdgeId, departureTimeInMin,
+                        allowUTurns=True):
+    """Return the shortest path from the source to the destination edge
+    when the source edge is entered at the input time using the time
+    varying costs of the movements"""
+
+    csr, search, source = _getTimeDependentSearch(net, sourceEdgeId, allowUTurns)
+    dest = csr.getEdgeIndex(*_getEdge(net, destEdgeId).iid)
+    search.run(source, departureTimeInMin, dest)
+    return Path(pathName, [csr.edges[i] for i in search.getNodePath(dest)])
+
+def getTDSPsBetweenEdges(net, pathName, sourceEdgeId, destEdgeId, departureTimesInMin,
+                         allowUTurns=True):
+    """Return the time dependent shortest paths from the source to the
+    destination edge for each of the input departure times. The trees of
+    all the departure times are computed in one sweep"""
+
+    csr, search, source = _getTimeDependentSearch(net, sourceEdgeId, allowUTurns)
+    dest = csr.getEdgeIndex(*_getEdge(net, destEdgeId).iid)
+    search.runAllDepartureTimes(source, departureTimesInMin)
+    return [Path(pathName, [csr.edges[i] for i in search.getNodePath(dest, departure)])
+            for departure in xrange(len(departureTimesInMin))]
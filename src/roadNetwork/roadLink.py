@@ -3,25 +3,37 @@ __company__ = "Parsons Brinckerhoff"
 __email__ = "xyntarakis@pbworld.com"
 __license__ = "GPL"
 
+from bisect import bisect_right
 from itertools import izip
 from math import fabs, atan, atan2, pi, sqrt, acos, sin, cos
 import logging
-from collections import defaultdict
 from math import sqrt
 
+import numpy as np
+
 from roadNetwork.point import Point
+from roadNetwork.attributeStore import AttributeStore
 from roadNetwork.movement import Movement
 from roadNetwork.errors import GraphError, SimError
+from roadNetwork.simResults import SimResults
 
 from pbCore.utils.itertools2 import pairwise
 
 
-class Edge(object):
+class Edge(AttributeStore):
+
+    __slots__ = ('iid', 'startVertexId', 'endVertexId', 'startVertex', 'endVertex',
+                 '_numLanes', '_shape', 'numLanes', '_outMovements', '_inMovements',
+                 '_outMovementKeys', '_inMovementKeys',
+                 '_outMovementsByVertexId', '_inMovementsByVertexId', '_obsCount',
+                 '_graph', '_simResults', '_resultRow', '_lengthInFeet', '_lengthInMiles',
+                 '_freeFlowSpeedInMPH', 'simStartTimeInMin', 'simEndTimeInMin',
+                 'simTimeStepInMin', '_geometry')
 
     def __init__(self, startVertex, endVertex, numLanes, shape=None):
 
+        self._attributes = None
         self.iid = (startVertex.id, endVertex.id)        
-        self.iid_ = "%s %s" % self.iid
 
         self.startVertexId = startVertex.id
         self.endVertexId = endVertex.id
@@ -36,14 +48,16 @@ class Edge(object):
         
         self._outMovements = []
         self._inMovements = []
+        self._outMovementKeys = []      # the turn keys of the movements above
+        self._inMovementKeys = []
+        self._outMovementsByVertexId = {}   # downstream vertex id to movement
+        self._inMovementsByVertexId = {}    # upstream vertex id to movement
         
-        #TODO: you need to offset the point 
-        self.midpoint2 = Point((self.startVertex.x + self.endVertex.x) / 2.0,
-                               (self.startVertex.y + self.endVertex.y)/ 2.0)
-
         self._obsCount = {}
-        self._simVolume = defaultdict(int)
-        self._simMeanTT = defaultdict(float)
+        self._graph = None          # the graph the edge belongs to
+        self._simResults = None     # the private result store outside a graph
+        self._resultRow = None      # the row of the edge in the result store
+        self._geometry = None       # cached orientation and direction 
 
         self.lengthInFeet = sqrt((self.endVertex.x - self.startVertex.x)**2 +
                                  (self.endVertex.y - self.startVertex.y)**2)
@@ -56,6 +70,56 @@ class Edge(object):
         self.simTimeStepInMin = None
 
 
+
+    @property
+    def lengthInFeet(self):
+
+        return self._lengthInFeet
+
+    @lengthInFeet.setter
+    def lengthInFeet(self, lengthInFeet):
+
+        self._lengthInFeet = lengthInFeet
+        self._costsChanged()
+
+    @property
+    def lengthInMiles(self):
+
+        return self._lengthInMiles
+
+    @lengthInMiles.setter
+    def lengthInMiles(self, lengthInMiles):
+
+        self._lengthInMiles = lengthInMiles
+        self._costsChanged()
+
+    @property
+    def freeFlowSpeedInMPH(self):
+
+        return self._freeFlowSpeedInMPH
+
+    @freeFlowSpeedInMPH.setter
+    def freeFlowSpeedInMPH(self, freeFlowSpeedInMPH):
+
+        self._freeFlowSpeedInMPH = freeFlowSpeedInMPH
+        self._costsChanged()
+
+    def _costsChanged(self):
+        """Let the graph know that a cost attribute of the edge or of
+        one of its movements changed"""
+        if self._graph is not None:
+            self._graph._costsChanged()
+
+    @property
+    def iid_(self):
+
+        return "%s %s" % self.iid
+
+    @property
+    def midpoint2(self):
+        #TODO: you need to offset the point 
+        return Point((self.startVertex.x + self.endVertex.x) / 2.0,
+                     (self.startVertex.y + self.endVertex.y)/ 2.0)
                         
     def __str__(self):
 
@@ -78,24 +142,37 @@ class Edge(object):
              raise GraphError("The number of lanes: %d of the new movement %s %s must be positive"
                                    % (newMovement.numLanes, self.iid_, newMovement.outVertexId))           
 
-        position = 0
-        for eMov in self.iterOutMovements():
-            if newMovement.outEdge.isClockwise(eMov.outEdge):
-                position += 1
+        #the emanating and the incident movements of an edge are sorted 
+        #from the leftmost to the rightmost turn
+        turnKey = newMovement._getTurnKey()
+        position = bisect_right(self._outMovementKeys, turnKey)
         self._outMovements.insert(position, newMovement)
+        self._outMovementKeys.insert(position, turnKey)
+        self._outMovementsByVertexId[newMovement.outVertexId] = newMovement
 
-        #all the incident movements are sorted anti clockwise
-        position = 0
-        for iMov in newMovement.outEdge.iterInMovements():
-            if self.isCounterClockwise(iMov.inEdge):
-                position += 1
-                
-        newMovement.outEdge._inMovements.insert(position, newMovement)
+        outEdge = newMovement.outEdge
+        position = bisect_right(outEdge._inMovementKeys, turnKey)
+        outEdge._inMovements.insert(position, newMovement)
+        outEdge._inMovementKeys.insert(position, turnKey)
+        outEdge._inMovementsByVertexId[self.startVertexId] = newMovement
 
         newMovement.simStartTimeInMin = self.simStartTimeInMin
         newMovement.simEndTimeInMin = self.simEndTimeInMin
         newMovement.simTimeStepInMin = self.simTimeStepInMin
 
+        if self._graph is not None:
+            self._graph._addMovement(newMovement)
+
+    def _sortMovements(self):
+        """Sort the emanating and incident movements from the leftmost to
+        the rightmost turn"""
+        for movements, keys in [(self._outMovements, self._outMovementKeys),
+                                (self._inMovements, self._inMovementKeys)]:
+            keyedMovements = sorted([(mov._getTurnKey(), i, mov) for i, mov in
+                                     enumerate(movements)])
+            movements[:] = [mov for key, i, mov in keyedMovements]
+            keys[:] = [key for key, i, mov in keyedMovements]
+
     def deleteOutMovement(self, movement):
         #TODO: what if I handle this at he vertex level???? 
         #I think it would be better to handle it at the vertex level 
@@ -106,23 +183,29 @@ class Edge(object):
 
         if not self.hasOutMovement(movement.outVertexId):
             raise GraphError("Movement %s does not exist" % movement.iid_)
+        if self._graph is not None:
+            self._graph._checkResultsWritable()
         
-        self._outMovements.remove(movement)
-        movement.outEdge._inMovements.remove(movement)
+        position = self._outMovements.index(movement)
+        del self._outMovements[position]
+        del self._outMovementKeys[position]
+        del self._outMovementsByVertexId[movement.outVertexId]
+        outEdge = movement.outEdge
+        position = outEdge._inMovements.index(movement)
+        del outEdge._inMovements[position]
+        del outEdge._inMovementKeys[position]
+        del outEdge._inMovementsByVertexId[self.startVertexId]
+
+        if self._graph is not None:
+            self._graph._deleteMovement(movement)
     
     def hasOutMovement(self, downstreamVertexId):
         
-        for eMov in self.iterOutMovements():
-            if eMov.outVertexId == downstreamVertexId:
-                return True
-        return False
+        return downstreamVertexId in self._outMovementsByVertexId
 
     def hasInMovement(self, upstreamVertexId):
 
-        for iMov in self.iterInMovements():
-            if iMov.inVertexId == upstreamVertexId:
-                return True
-        return False
+        return upstreamVertexId in self._inMovementsByVertexId
 
     def hasLeftTurn(self):
 
@@ -186,6 +269,10 @@ class Edge(object):
 
         return self.freeFlowSpeedInMPH
 
+    def getFreeFlowTTInMin(self):
+
+        return self.lengthInMiles / float(self.freeFlowSpeedInMPH) * 60
+
     def getLengthInMiles(self):
 
         return self.lengthInMiles
@@ -196,9 +283,10 @@ class Edge(object):
     
     def getOutMovement(self, downstreamVertexId):
 
-        for movement in self.iterOutMovements():
-            if movement.outVertexId == downstreamVertexId:
-                return movement
+        try:
+            return self._outMovementsByVertexId[downstreamVertexId]
+        except KeyError:
+            pass
         raise GraphError("Edge %s does not have an emanating movement towards %s"
                                % (self.iid_, downstreamVertexId))
 
@@ -295,13 +383,7 @@ class Edge(object):
         """Get the angle between the two edges measured
         clockwise. Rotate the other edge clockwise until it hits this one"""
 
-        dx1 = self.endVertex.x - self.startVertex.x 
-        dy1 = self.endVertex.y - self.startVertex.y 
-
-        dx2 = other.endVertex.x - other.startVertex.x 
-        dy2 = other.endVertex.y - other.startVertex.y 
-        
-        angle = (atan2(dy2, dx2) - atan2(dy1, dx1)) * 180 / pi
+        angle = (other._getGeometry()[1] - self._getGeometry()[1]) * 180 / pi
         if angle < 0:
             angle += 360
         return angle    
@@ -310,6 +392,24 @@ class Edge(object):
         """Returs the orientation of the link in degrees from the North
         measured clockwise. Only the endpoints are used in the calculation"""
 
+        return self._getGeometry()[0]
+
+    def _getGeometry(self):
+        """Return the orientation of the edge and the angle of its 
+        direction from the x axis in radians. Both are computed once and
+        cached until the coordinates of a vertex of the edge change"""
+        if self._geometry is None:
+            self._geometry = (self._computeOrientation(), 
+                              atan2(self.endVertex.y - self.startVertex.y,
+                                    self.endVertex.x - self.startVertex.x))
+        return self._geometry
+
+    def _invalidateGeometry(self):
+
+        self._geometry = None
+
+    def _computeOrientation(self):
+
         x1 = self.startVertex.x
         y1 = self.startVertex.y
         x2 = self.endVertex.x
@@ -359,6 +459,21 @@ class Edge(object):
                                                     self.simTimeStepInMin))
 
 
+    def _getEdgeResults(self):
+        """Return the store holding the results of the edges of the graph.
+        An edge that does not belong to a graph keeps its results in a
+        private store that is copied to the store of the graph that 
+        adopts the edge"""
+        if self._graph is not None:
+            return self._graph.getEdgeResults()
+        if self._simResults is None:
+            if self.simStartTimeInMin is None:
+                raise SimError("Edge %s is not in a graph and has no "
+                               "simulation period" % self.iid_)
+            self._simResults = SimResults(self.simStartTimeInMin, self.simEndTimeInMin,
+                                          self.simTimeStepInMin, capacity=1)
+        return self._simResults
+
     def _hasAllMovementCounts(self, startTimeInMin, endTimeInMin):
         """Return True if all the movements have counts"""
         count = self._aggregateAllMovementCounts(startTimeInMin, endTimeInMin)
@@ -403,12 +518,25 @@ class Edge(object):
         if self.getNumOutMovements() > 0:
             return sum([mov.getSimVolume(startTimeInMin, endTimeInMin) 
                         for mov in self.iterOutMovements()])
+        elif self._resultRow is None:
+            return 0
         else:
-            result = 0
-            for stTime, enTime in pairwise(range(startTimeInMin, endTimeInMin + 1, 
-                                                 self.simTimeStepInMin)):
-                result += self._simVolume[stTime, enTime]
-            return result
+            return self._getEdgeResults().getVolume(self._resultRow,
+                                                    startTimeInMin, endTimeInMin)
+
+    def getSimVolumes(self, timeWindows):
+        """Return an array with the volume on the link in each of the 
+        input (startTimeInMin, endTimeInMin) time windows"""
+        if self.getNumOutMovements() > 0:
+            return sum([mov.getSimVolumes(timeWindows) 
+                        for mov in self.iterOutMovements()])
+        elif self._resultRow is None:
+            self._getEdgeResults().getTimeStepRanges(timeWindows)
+            return np.zeros(len(timeWindows))
+        else:
+            volumes, totalTimes, numInconsistent = self._getEdgeResults().getTotalsForWindows(
+                (self._resultRow,), timeWindows)
+            return volumes[0]
 
     def getSimTTInMin(self, startTimeInMin, endTimeInMin):
         """Get the average travel time of the vehicles traversing the link"""
@@ -423,37 +551,50 @@ class Edge(object):
         if totalFlow == 0:
             return self.getFreeFlowTTInMin()
 
-        if not self._simMeanTT and not self._simVolume:
+        if self._resultRow is None:
             totalTime = sum([ mov.getSimTTInMin(start, end) * mov.getSimVolume(start, end)
                           for mov in self.iterOutMovements()])
             return totalTime / float(totalFlow)
-        elif self._simMeanTT and self._simVolume:
-            totalTime = 0
-            totalFlow = 0
-            for (stTime, enTime), flow in self._simVolume.iteritems():
-                if stTime >= startTimeInMin and enTime <= endTimeInMin:
-
-                    binTT = self._simMeanTT[(stTime, enTime)]
-
-                    if flow == 0 and binTT == 0:
-                        continue
-                    elif flow > 0 and binTT > 0:
-                        totalFlow += flow
-                        totalTime += binTT * flow
-                    else:                        
-                        raise SimMovementError("Movement %s has flow: %f and TT: %f "
-                                               "for time period from %d to %d"  % 
-                                               (self.iid, flow, binTT, 
-                                                startTimeInMin, endTimeInMin))
+        else:
+            totalFlow, totalTime, numInconsistent = self._getEdgeResults().getTotals(
+                self._resultRow, start, end)
+
+            if numInconsistent:
+                volumes = self._getEdgeResults().getVolumes(self._resultRow, start, end)
+                meanTTs = self._getEdgeResults().getMeanTTs(self._resultRow, start, end)
+                i = np.flatnonzero((volumes > 0) != (meanTTs > 0))[0]
+                raise SimError("Edge %s has flow: %f and TT: %f "
+                               "for time period from %d to %d"  % 
+                               (self.iid_, volumes[i], meanTTs[i], 
+                                startTimeInMin, endTimeInMin))
+
+            return totalTime / totalFlow
+
+    def getSimTTsInMin(self, timeWindows):
+        """Return an array with the average travel time of the vehicles
+        traversing the link in each of the input (startTimeInMin, 
+        endTimeInMin) time windows"""
+        volumes = self.getSimVolumes(timeWindows)
+
+        if self._resultRow is None:
+            totalTimes = sum([mov.getSimTTsInMin(timeWindows) * mov.getSimVolumes(timeWindows)
+                              for mov in self.iterOutMovements()])
+            totalFlows = volumes
+        else:
+            totalFlows, totalTimes, numInconsistent = self._getEdgeResults().getTotalsForWindows(
+                (self._resultRow,), timeWindows)
+            totalFlows, totalTimes, numInconsistent = \
+                totalFlows[0], totalTimes[0], numInconsistent[0]
 
-            return totalTime / float(totalFlow)
-            
-            if endTimeInMin - startTimeInMin != self.simTimeStepInMin:
-                raise SimError("Not implemeted yet")
+            inconsistent = np.flatnonzero((volumes > 0) & (numInconsistent > 0))
+            if len(inconsistent):
+                start, end = timeWindows[inconsistent[0]]
+                raise SimError("Edge %s has a time step with flow but without "
+                               "travel time (or vice versa) in the time period "
+                               "from %d to %d" % (self.iid_, start, end))
 
-            return self._simMeanTT[start, end]
-        else:
-            return self.lengthInMiles / float(self.freeFlowSpdInMPH) * 60
+        return np.where(volumes > 0, totalTimes / np.maximum(totalFlows, 1e-12),
+                        self.getFreeFlowTTInMin())
 
     def getSimSpeedInMPH(self, startTimeInMin, endTimeInMin):
 
@@ -648,7 +789,10 @@ class Edge(object):
             for emanatingMovement in self.iterOutMovements():
                 emanatingMovement.setSimVolume(startTimeInMin, endTimeInMin, volume)
         else:
-            self._simVolume[startTimeInMin, endTimeInMin] = volume
+            if self._resultRow is None:
+                self._resultRow = self._getEdgeResults().addRow()
+            self._getEdgeResults().setVolume(self._resultRow, startTimeInMin, volume)
+            self._costsChanged()
         
     def setSimTTInMin(self, startTimeInMin, endTimeInMin, averageTTInMin):
 
@@ -679,7 +823,8 @@ class Edge(object):
             if self.getSimVolume(startTimeInMin, endTimeInMin) == 0:
                 raise SimError('Cannot set the travel time on edge %s because it has zero flow' % self.iid_)
 
-            self._simMeanTT[startTimeInMin, endTimeInMin] = averageTTInMin
+            self._getEdgeResults().setMeanTT(self._resultRow, startTimeInMin, averageTTInMin)
+            self._costsChanged()
     
 
 class TurnType(object):
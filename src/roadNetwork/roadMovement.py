@@ -3,9 +3,11 @@ __company__ = "Parsons Brinckerhoff"
 __email__ = "xyntarakis@pbworld.com"
 __license__ = "GPL"
 
-from collections import defaultdict
+import numpy as np
 
+from roadNetwork.attributeStore import AttributeStore
 from roadNetwork.errors import GraphError, SimError
+from roadNetwork.simResults import SimResults
 
 from pbCore.utils.itertools2 import pairwise
 
@@ -15,20 +17,65 @@ class MovementType(object):
 
     UT, LT2, LT, TH, RT, RT2 = range(6)
 
-class Movement(object):
+def getTurnTypes(angles, isUTurn):
+    """Return an array with the MovementType of each movement given the
+    clockwise angles (see Edge.getAngleClockwise) from the incident to 
+    the emanating edges and a boolean array marking the U turns. It is 
+    the array version of Movement.getTurnType"""
+    angles = np.asarray(angles)
+    return np.select([isUTurn,
+                      (135 <= angles) & (angles < 180),
+                      (45 <= angles) & (angles < 135),
+                      (0 <= angles) & (angles < 45),
+                      (315 <= angles) & (angles < 360),
+                      (225 <= angles) & (angles < 315)],
+                     [MovementType.UT, MovementType.LT2, MovementType.LT, 
+                      MovementType.TH, MovementType.TH, MovementType.RT], 
+                     MovementType.RT2)
+
+def getSimTTsForRows(simResults, rows, freeFlowTTs, penalties, timeWindows):
+    """Return the simulated volumes, the mean travel times in minutes and
+    the number of inconsistent time steps (see SimResults.getTotals) of 
+    the movements stored in the input rows of the result store in each
+    of the input (startTimeInMin, endTimeInMin) time windows. Every 
+    returned array has one row per input row and one column per window.
+    It is the array version of Movement.getSimTTInMin given the free 
+    flow travel time and the penalty of every movement"""
+    volumes, totalTimes, numInconsistent = simResults.getTotalsForWindows(
+        rows, timeWindows)
+
+    freeFlowTTs = np.asarray(freeFlowTTs, np.float64).reshape(-1, 1)
+    penalties = np.asarray(penalties, np.float64).reshape(-1, 1)
+    meanTTs = np.where(volumes > 0, totalTimes / np.maximum(volumes, 1e-12),
+                       freeFlowTTs) + penalties
+
+    #the travel time of a single time step is returned as is 
+    start, end = simResults.getTimeStepRanges(timeWindows)
+    singleSteps = np.flatnonzero(end - start == 1)
+    if len(singleSteps):
+        rows = np.asarray(rows, np.intp).reshape(-1, 1)
+        stepTTs = simResults.meanTT[rows, start[singleSteps]]
+        singleTTs = meanTTs[:, singleSteps]
+        meanTTs[:, singleSteps] = np.where(stepTTs > 0, stepTTs, singleTTs)
+
+    return volumes, meanTTs, numInconsistent
+
+class Movement(AttributeStore):
     """Represents a movement between two subsequent network edges.
     Is defined/consists by one or more lane connections. 
     """
 
+    __slots__ = ('iid', 'inEdge', 'outEdge', 'numLanes', 'simTimeStepInMin',
+                 'simStartTimeInMin', 'simEndTimeInMin', '_simResults', '_resultRow',
+                 '_obsCount', '_timeVaryingCosts', '_penalty', '_timeStep',
+                 'baseTurnType')
+
     def __init__(self, inEdge, outEdge, numLanes):
 
+        self._attributes = None
         self.iid = (inEdge.startVertexId, 
                     inEdge.endVertexId, 
                     outEdge.endVertexId) 
-        self.iid_ = '%s %s %s' % (inEdge.startVertexId, 
-                                  inEdge.endVertexId, 
-                                  outEdge.endVertexId) 
-
          
         if (inEdge.endVertex != outEdge.startVertex):
             raise GraphError("Edge %s cannot have a movement towards edge %s" %
@@ -37,34 +84,78 @@ class Movement(object):
         self.inEdge = inEdge
         self.outEdge = outEdge         
 
-        self.inVertex = inEdge.startVertex
-        self.vertex = inEdge.endVertex
-        self.outVertex = outEdge.endVertex
-
-        self.inVertexId = self.inVertex.id
-        self.vertexId = self.vertex.id
-        self.outVertexId = self.outVertex.id
-
         self.numLanes = numLanes
 
         self.simTimeStepInMin = None
         self.simStartTimeInMin = None
         self.simEndTimeInMin = None
 
-        self._simVolume = defaultdict(int)   # indexed by timeperiod
+        self._simResults = None     # the result store of the graph or a private one
+        self._resultRow = None      # the row of the movement in the store
         self._obsCount = {}
-        self._simMeanTT = defaultdict(float)                   # indexed by timeperiod
         self._timeVaryingCosts = []
+        self._timeStep = None
         self._penalty = 0
         
              
         self.baseTurnType = self.getTurnType()
 
+    @property
+    def iid_(self):
+
+        return '%s %s %s' % self.iid
+
+    @property
+    def inVertex(self):
+
+        return self.inEdge.startVertex
+
+    @property
+    def vertex(self):
+
+        return self.inEdge.endVertex
+
+    @property
+    def outVertex(self):
+
+        return self.outEdge.endVertex
+
+    @property
+    def inVertexId(self):
+
+        return self.iid[0]
+
+    @property
+    def vertexId(self):
+
+        return self.iid[1]
+
+    @property
+    def outVertexId(self):
+
+        return self.iid[2]
+
     def __str__(self):
 
         return "%s %s %s %d" % (self.upVertexid, self.vertexBid,
                                 self.vertexCid, self.numLanes)
 
+    def getDenseId(self):
+        """Return the integer id of the movement in the graph it belongs
+        to. Dense ids are small consecutive integers (reused after a 
+        movement is deleted) that index the rows of the graph result 
+        store and any other array with one entry per movement"""
+        if self._resultRow is None:
+            raise GraphError("Movement %s does not belong to a graph" % self.iid_)
+        return self._resultRow
+
+    def _getTurnKey(self):
+        """Return the clockwise angle in degrees from the incident to the
+        emanating edge around the vertex. Sorting the movements of an 
+        edge by it orders them from the leftmost to the rightmost turn.
+        The incident edge points away from the vertex when reversed"""
+        return (self.outEdge.getOrientation() - self.inEdge.getOrientation() + 180) % 360
+
     def getTurnType(self):
         """Return the type of turn the movement corresponds to based 
         on the angle it forms"""
@@ -99,19 +190,19 @@ class Movement(object):
     
     def isRightTurn(self):
         """Return True if the movement is a right turn"""
-        if self._turnType == MovementType.RT or self._turnType == MovementType.RT2:
+        if self.baseTurnType == MovementType.RT or self.baseTurnType == MovementType.RT2:
             return True
         return False 
 
     def isLeftTurn(self):
         """Return True if the movmenet is a left turn"""
-        if self._turnType == MovementType.LT or self._turnType == MovementType.LT2:
+        if self.baseTurnType == MovementType.LT or self.baseTurnType == MovementType.LT2:
             return True
         return False 
 
     def isThruTurn(self):
         """Return True if the movement is a through movement"""
-        return True if self._turnType == MovementType.TH else False 
+        return True if self.baseTurnType == MovementType.TH else False 
                                     
     def isUTurn(self):
         """Return True if it is a UTurn and False otherwise"""
@@ -123,6 +214,20 @@ class Movement(object):
         raise GraphError('Not implemented yet')
         
 
+    def _getSimResults(self):
+        """Return the store holding the results of the movement. A
+        movement that does not belong to a graph keeps its results in a
+        private store that is copied to the store of the graph that 
+        adopts the movement"""
+        if self._simResults is None:
+            if self.simStartTimeInMin is None:
+                raise SimError("Movement %s is not in a graph and has no "
+                               "simulation period" % str(self.iid))
+            self._simResults = SimResults(self.simStartTimeInMin, self.simEndTimeInMin,
+                                          self.simTimeStepInMin, capacity=1)
+            self._resultRow = self._simResults.addRow()
+        return self._simResults
+
     def _checkInputTimeStep(self, startTimeInMin, endTimeInMin):
         """The input time step should always be equal to the sim time step"""
         if endTimeInMin - startTimeInMin != self.simTimeStepInMin:
@@ -162,12 +267,8 @@ class Movement(object):
         self._validateInputTimes(startTimeInMin, endTimeInMin)
         self._checkOutputTimeStep(startTimeInMin, endTimeInMin)
 
-        result = 0
-        for stTime, enTime in pairwise(range(startTimeInMin, endTimeInMin + 1, 
-                                             self.simTimeStepInMin)):
-            result += self._simVolume[stTime, enTime]
-
-        return result 
+        return self._getSimResults().getVolume(self._resultRow, startTimeInMin,
+                                          endTimeInMin)
 
     def getSimFlow(self, startTimeInMin, endTimeInMin):
         """Get the simulated flow for the specified time period 
@@ -183,32 +284,53 @@ class Movement(object):
         self._validateInputTimes(startTimeInMin, endTimeInMin)
         self._checkOutputTimeStep(startTimeInMin, endTimeInMin)
 
-        totalFlow = 0
-        totalTime = 0
-        
-        if (startTimeInMin, endTimeInMin) in self._simMeanTT:
-            return self._simMeanTT[startTimeInMin, endTimeInMin]
-
-        for (stTime, enTime), flow in self._simVolume.iteritems():
-            if stTime >= startTimeInMin and enTime <= endTimeInMin:
-                binTT = self._simMeanTT[(stTime, enTime)]
-
-                if binTT > 0 and flow > 0:
-                    totalFlow += flow
-                    totalTime += self._simMeanTT[(stTime, enTime)] * flow
-                elif binTT == 0 and flow == 0:
-                    continue
-                else:
-                    raise SimError("Movement %s has flow:%f and TT:%f "
-                                           "for time period from %d to %d"  % 
-                                           (self.iid, flow, binTT, 
-                                            startTimeInMin, endTimeInMin))
+        if endTimeInMin - startTimeInMin == self.simTimeStepInMin:
+            meanTT = self._getSimResults().getMeanTT(self._resultRow, startTimeInMin)
+            if meanTT > 0:
+                return meanTT
+
+        totalFlow, totalTime, numInconsistent = self._getSimResults().getTotals(
+            self._resultRow, startTimeInMin, endTimeInMin)
+
+        if numInconsistent:
+            volumes = self._getSimResults().getVolumes(self._resultRow,
+                                                  startTimeInMin, endTimeInMin)
+            meanTTs = self._getSimResults().getMeanTTs(self._resultRow,
+                                                  startTimeInMin, endTimeInMin)
+            i = np.flatnonzero((volumes > 0) != (meanTTs > 0))[0]
+            raise SimError("Movement %s has flow:%f and TT:%f "
+                                   "for time period from %d to %d"  % 
+                                   (self.iid, volumes[i], meanTTs[i], 
+                                    startTimeInMin, endTimeInMin))
 
         if totalFlow > 0:
             return totalTime / float(totalFlow) + self._penalty
         else:
-            return (self.inEdge.getLengthInMiles() / 
-                float(self.inEdge.getFreeFlowSpeedInMPH()) * 60 + self._penalty)
+            return self.inEdge.getFreeFlowTTInMin() + self._penalty
+
+    def getSimVolumes(self, timeWindows):
+        """Return an array with the simulated volume of the movement
+        in each of the input (startTimeInMin, endTimeInMin) time windows"""
+        volumes, totalTimes, numInconsistent = self._getSimResults().getTotalsForWindows(
+            (self._resultRow,), timeWindows)
+        return volumes[0]
+
+    def getSimTTsInMin(self, timeWindows):
+        """Return an array with the mean travel time in minutes of the
+        vehicles that entered the movement in each of the input
+        (startTimeInMin, endTimeInMin) time windows"""
+        freeFlowTT = self.inEdge.getFreeFlowTTInMin()
+        volumes, meanTTs, numInconsistent = getSimTTsForRows(
+            self._getSimResults(), (self._resultRow,), (freeFlowTT,), (self._penalty,),
+            timeWindows)
+
+        if numInconsistent[0].any():
+            start, end = timeWindows[np.flatnonzero(numInconsistent[0])[0]]
+            raise SimError("Movement %s has a time step with flow but without "
+                           "travel time (or vice versa) in the time period from "
+                           "%d to %d" % (self.iid, start, end))
+
+        return meanTTs[0]
 
     def getSimSpeedInMPH(self, startTimeInMin, endTimeInMin):
         """Return the travel time on the first edge of the movement in 
@@ -314,7 +436,8 @@ class Movement(object):
         self._validateInputTimes(startTimeInMin, endTimeInMin)
         self._checkInputTimeStep(startTimeInMin, endTimeInMin)
 
-        self._simVolume[startTimeInMin, endTimeInMin] = flow
+        self._getSimResults().setVolume(self._resultRow, startTimeInMin, flow)
+        self.inEdge._costsChanged()
 
     def setSimTTInMin(self, startTimeInMin, endTimeInMin, averageTTInMin):
         """Enter the simulated average travel time for the 
@@ -345,8 +468,19 @@ class Movement(object):
         if self.getSimFlow(startTimeInMin, endTimeInMin) == 0:
             raise SimError('Cannot set the travel time on a movement with zero flow')
 
-        self._simMeanTT[startTimeInMin, endTimeInMin] = averageTTInMin
+        self._getSimResults().setMeanTT(self._resultRow, startTimeInMin, averageTTInMin)
+        self.inEdge._costsChanged()
         
+    def getPenalty(self):
+        """Return the penalty in minutes added to the travel time of
+        the movement"""
+        return self._penalty
+
+    def setPenalty(self, penaltyInMin):
+
+        self._penalty = penaltyInMin
+        self.inEdge._costsChanged()
+
     def getTimeVaryingCostAt(self, timeInMin):
         """Return the cost (in min) for the time period begining at the 
         input time"""
@@ -366,6 +500,7 @@ class Movement(object):
         for cost in timeVaryingCosts:
             assert cost > 0
         self._timeVaryingCosts = timeVaryingCosts
+        self.inEdge._costsChanged()
     
         
         
@@ -4,18 +4,141 @@ __email__ = "xyntarakis@pbworld.com"
 __license__ = "GPL"
 
 import logging
+from math import sqrt
+import os
 import sys
+
+import numpy as np
+
 from itertools import chain, izip, imap
 from pbCore.utils.odict import OrderedDict
 from pbCore.utils.itertools2 import pairwise
 
 from roadNetwork.vertex import Vertex
 from roadNetwork.edge import Edge 
-from roadNetwork.movement import Movement 
+from roadNetwork.movement import Movement, getTurnTypes
 from roadNetwork.errors import GraphError, SimError
+from roadNetwork.simResults import SimResults
+from roadNetwork.csrGraph import CsrGraph
+from roadNetwork.shortestPaths import ShortestPathTreeCache
+from roadNetwork.spatialIndex import QuadTreeIndex, getDistanceToSegment
+from roadNetwork.simReader import iterChunks, iterParallelChunks, readIdsAndValues, \
+    hashFiles, LINES_PER_CHUNK
+
+def _joinIds(ids):
+    """Join the columns of a 2D array of ids into one string per row"""
+    keys = ids[:, 0]
+    for i in range(1, ids.shape[1]):
+        keys = np.char.add(np.char.add(keys, ' '), ids[:, i])
+    return keys
+
+def _checkUnique(keys, message):
+
+    uniqueKeys, counts = np.unique(keys, return_counts=True)
+    if (counts > 1).any():
+        raise GraphError(message % uniqueKeys[counts > 1][0])
 
 class Graph(object):
 
+    RESULTS_FORMAT_VERSION = 1
+
+    @classmethod
+    def fromArrays(cls, name, simStartTimeInMin, simEndTimeInMin, simTimeStepInMin,
+                   vertexIds, x, y, edgeIds, edgeNumLanes, movementIds=None,
+                   movementNumLanes=None):
+        """Build a graph from arrays of vertex ids and coordinates, edges
+        (one row with the start and end vertex ids per edge) and 
+        movements (one row with three vertex ids per movement). The input
+        is validated as a whole and the adjacent edges of each vertex and
+        the movements of each edge are sorted once instead of on every
+        insertion"""
+
+        vertexIds = np.asarray(vertexIds, dtype=str)
+        x = np.asarray(x, np.float64)
+        y = np.asarray(y, np.float64)
+        edgeIds = np.asarray(edgeIds, dtype=str).reshape(-1, 2)
+        edgeNumLanes = np.asarray(edgeNumLanes, np.int64)
+        if movementIds is None:
+            movementIds = []
+            movementNumLanes = []
+        movementIds = np.asarray(movementIds, dtype=str).reshape(-1, 3)
+        movementNumLanes = np.asarray(movementNumLanes, np.int64)
+
+        if not len(vertexIds) == len(x) == len(y):
+            raise GraphError("The vertex ids and coordinates do not have the same length")
+        if len(edgeIds) != len(edgeNumLanes) or len(movementIds) != len(movementNumLanes):
+            raise GraphError("The ids and the number of lanes do not have the same length")
+
+        edgeKeys = _joinIds(edgeIds)
+        _checkUnique(vertexIds, "Vertex %s already in the network")
+        _checkUnique(edgeKeys, "Edge %s already exists")
+        _checkUnique(_joinIds(movementIds), "Movement %s already exists")
+
+        missing = ~np.in1d(edgeIds, vertexIds).reshape(-1, 2)
+        if missing.any():
+            raise GraphError("Vertex %s not in the graph" % edgeIds[missing][0])
+        loops = edgeIds[:, 0] == edgeIds[:, 1]
+        if loops.any():
+            raise GraphError("Edge %s starts and ends at the same vertex" % edgeKeys[loops][0])
+        for columns in ([0, 1], [1, 2]):
+            missing = ~np.in1d(_joinIds(movementIds[:, columns]), edgeKeys)
+            if missing.any():
+                raise GraphError("Edge %s to %s not in the graph" % 
+                                 tuple(movementIds[missing][0, columns]))
+        for keys, numLanes in ((edgeKeys, edgeNumLanes), 
+                               (_joinIds(movementIds), movementNumLanes)):
+            if (numLanes <= 0).any():
+                raise GraphError("The number of lanes of %s must be positive" % 
+                                 keys[numLanes <= 0][0])
+
+        graph = cls(name, simStartTimeInMin, simEndTimeInMin, simTimeStepInMin)
+
+        adjacentEdges = OrderedDict()
+        for vertexId, vertexX, vertexY in izip(vertexIds.tolist(), x.tolist(), y.tolist()):
+            vertex = Vertex(vertexId, vertexX, vertexY)
+            graph._vertices[vertexId] = vertex
+            graph._indexVertex(vertex)
+            adjacentEdges[vertexId] = []
+        if len(vertexIds):
+            graph._maxVertexId = max(imap(int, vertexIds.tolist()))
+
+        for (startVertexId, endVertexId), numLanes in izip(edgeIds.tolist(), 
+                                                          edgeNumLanes.tolist()):
+            edge = Edge(graph._vertices[startVertexId], graph._vertices[endVertexId], 
+                        numLanes)
+            edge.simStartTimeInMin = simStartTimeInMin
+            edge.simEndTimeInMin = simEndTimeInMin
+            edge.simTimeStepInMin = simTimeStepInMin
+            edge._graph = graph
+            graph._edges[startVertexId, endVertexId] = edge
+            graph._edgeIndex.insert(edge, *graph._getEdgeBBox(edge))
+            adjacentEdges[startVertexId].append(edge)
+            adjacentEdges[endVertexId].append(edge)
+
+        for vertexId, edges in adjacentEdges.iteritems():
+            graph._vertices[vertexId]._setEdges(edges)
+
+        for (nodeAid, nodeBid, nodeCid), numLanes in izip(movementIds.tolist(),
+                                                          movementNumLanes.tolist()):
+            inEdge = graph._edges[nodeAid, nodeBid]
+            outEdge = graph._edges[nodeBid, nodeCid]
+            movement = Movement(inEdge, outEdge, numLanes)
+            movement.simStartTimeInMin = simStartTimeInMin
+            movement.simEndTimeInMin = simEndTimeInMin
+            movement.simTimeStepInMin = simTimeStepInMin
+
+            inEdge._outMovements.append(movement)
+            inEdge._outMovementsByVertexId[nodeCid] = movement
+            outEdge._inMovements.append(movement)
+            outEdge._inMovementsByVertexId[nodeAid] = movement
+            graph._addMovement(movement)
+
+        for edge in graph.iterEdges():
+            edge._sortMovements()
+        graph._topologyVersion += 1
+
+        return graph
+
     def __init__(self, name, simStartTimeInMin,
                  simEndTimeInMin, simTimeStepInMin):
 
@@ -27,12 +150,32 @@ class Graph(object):
         self._vertices = OrderedDict()
         self._edges = OrderedDict()
         self._maxVertexId = 0
+        self._movements = {}            # (a, b, c) vertex ids to movement
+        self._movementsByDenseId = []   # movement dense id to movement
+        self._topologyVersion = 0       # incremented on every topology change
+        self._costVersion = 0           # incremented on every cost change
+        self._csr = None
+        self._shortestPathTrees = None
+        self._vertexIndex = QuadTreeIndex()
+        self._edgeIndex = QuadTreeIndex()
+
+        self._movementResults = SimResults(simStartTimeInMin, simEndTimeInMin,
+                                           simTimeStepInMin)
+        self._edgeResults = SimResults(simStartTimeInMin, simEndTimeInMin,
+                                       simTimeStepInMin)
+        self._resultSourceFileNames = []
+        self._resultsDirectory = None
+        self._resultsMode = None
+        self._timeVaryingEdgeAttributes = []
+        self._timeVaryingMovementAttributes = []
         
     def addVertex(self, newVertex):
 
         if newVertex.id in self._vertices:
             raise GraphError("Vertex %s already in the network" % newVertex.id)
         self._vertices[newVertex.id] = newVertex
+        self._indexVertex(newVertex)
+        self._topologyVersion += 1
         if int(newVertex.id) > self._maxVertexId:
             self._maxVertexId = int(newVertex.id) 
         
@@ -44,6 +187,14 @@ class Graph(object):
         if self.hasEdge(startVertex.id, endVertex.id):
             raise GraphError("Edge %s already exists" % newEdge.iid_)
 
+        privateResults = newEdge._simResults
+        if privateResults is not None and \
+                (privateResults.simStartTimeInMin, privateResults.simEndTimeInMin,
+                 privateResults.simTimeStepInMin) != \
+                (self.simStartTimeInMin, self.simEndTimeInMin, self.simTimeStepInMin):
+            raise SimError("The results of edge %s are not for the "
+                           "simulation period of graph %s" % (newEdge.iid_, self.name))
+
         startVertex.addOutEdge(newEdge)
         endVertex.addInEdge(newEdge)
 
@@ -51,10 +202,28 @@ class Graph(object):
         newEdge.simEndTimeInMin = self.simEndTimeInMin
         newEdge.simTimeStepInMin = self.simTimeStepInMin
 
+        #the results the edge kept before it joined the graph are copied
+        if privateResults is not None:
+            privateRow = newEdge._resultRow
+            newEdge._simResults = None
+            newEdge._resultRow = None
+            if privateRow is not None:
+                newEdge._resultRow = self._edgeResults.addRow()
+                self._edgeResults.setVolumesAndMeanTTs(
+                    [newEdge._resultRow], privateResults.volume[[privateRow]],
+                    privateResults.meanTT[[privateRow]])
+
+        newEdge._graph = self
+        for eMov in newEdge.iterOutMovements():
+            self._addMovement(eMov)
+
         self._edges[startVertex.id, endVertex.id] = newEdge
+        self._edgeIndex.insert(newEdge, *self._getEdgeBBox(newEdge))
+        self._topologyVersion += 1
 
     def deleteEdge(self, edgeToDelete):
         
+        self._checkResultsWritable()
         movsToDelete1 = [mov for mov in edgeToDelete.iterOutMovements()] 
         movsToDelete2 = [mov for mov in edgeToDelete.iterInMovements()]
 
@@ -67,7 +236,14 @@ class Graph(object):
         edgeToDelete.startVertex._deleteOutEdge(edgeToDelete)
         edgeToDelete.endVertex._deleteInEdge(edgeToDelete)
 
+        if edgeToDelete._resultRow is not None:
+            self._edgeResults.deleteRow(edgeToDelete._resultRow)
+            edgeToDelete._resultRow = None
+        edgeToDelete._graph = None
+
         del self._edges[edgeToDelete.startVertexId, edgeToDelete.endVertexId]
+        self._edgeIndex.delete(edgeToDelete)
+        self._topologyVersion += 1
 
     def deleteVertex(self, vertexToDelete):
 
@@ -78,7 +254,72 @@ class Graph(object):
             self.deleteEdge(edge) 
 
         del self._vertices[vertexToDelete.id] 
+        self._vertexIndex.delete(vertexToDelete)
+        vertexToDelete._graph = None
+        self._topologyVersion += 1
                              
+    def _indexVertex(self, vertex):
+
+        vertex._graph = self
+        self._vertexIndex.insert(vertex, vertex.x, vertex.y, vertex.x, vertex.y)
+
+    def _getEdgeBBox(self, edge):
+
+        return (min(edge.startVertex.x, edge.endVertex.x), 
+                min(edge.startVertex.y, edge.endVertex.y),
+                max(edge.startVertex.x, edge.endVertex.x), 
+                max(edge.startVertex.y, edge.endVertex.y))
+
+    def _updateSpatialIndex(self, vertex):
+        """Move the vertex and its adjacent edges in the spatial indexes
+        after the coordinates of the vertex changed"""
+        self._vertexIndex.delete(vertex)
+        self._vertexIndex.insert(vertex, vertex.x, vertex.y, vertex.x, vertex.y)
+        for edge in vertex.iterEdges():
+            self._edgeIndex.delete(edge)
+            self._edgeIndex.insert(edge, *self._getEdgeBBox(edge))
+
+    def _getVertexDistance(self, x, y):
+
+        return lambda vertex: sqrt((vertex.x - x) ** 2 + (vertex.y - y) ** 2)
+
+    def _getEdgeDistance(self, x, y):
+
+        return lambda edge: getDistanceToSegment(x, y, edge.startVertex.x, 
+                                                 edge.startVertex.y, edge.endVertex.x,
+                                                 edge.endVertex.y)
+
+    def getNearestVertices(self, x, y, k=1):
+        """Return the k vertices nearest to point (x, y) sorted by 
+        distance"""
+        return [vertex for distance, vertex in 
+                self._vertexIndex.getNearest(x, y, k, self._getVertexDistance(x, y))]
+
+    def getNearestEdges(self, x, y, k=1):
+        """Return the k edges nearest to point (x, y) sorted by distance"""
+        return [edge for distance, edge in 
+                self._edgeIndex.getNearest(x, y, k, self._getEdgeDistance(x, y))]
+
+    def getVerticesWithinDistance(self, x, y, distance):
+        """Return the vertices within the input distance from point (x, y)
+        sorted by distance"""
+        return [vertex for vertexDistance, vertex in self._vertexIndex.getWithinDistance(
+                x, y, distance, self._getVertexDistance(x, y))]
+
+    def getEdgesWithinDistance(self, x, y, distance):
+        """Return the edges within the input distance from point (x, y)
+        sorted by distance"""
+        return [edge for edgeDistance, edge in self._edgeIndex.getWithinDistance(
+                x, y, distance, self._getEdgeDistance(x, y))]
+
+    def getVerticesInBBox(self, minX, minY, maxX, maxY):
+        """Return the vertices in the input bounding box"""
+        return list(self._vertexIndex.iterItemsInBBox(minX, minY, maxX, maxY))
+
+    def getEdgesInBBox(self, minX, minY, maxX, maxY):
+        """Return the edges whose bounding box intersects the input one"""
+        return list(self._edgeIndex.iterItemsInBBox(minX, minY, maxX, maxY))
+
     def iterVertices(self):
         
         return self._vertices.itervalues()
@@ -110,6 +351,146 @@ class Graph(object):
             raise GraphError("Edge %s to %s not in the graph" % 
                                    (startVertexId, endVertexId))
 
+    def hasMovement(self, nodeAid, nodeBid, nodeCid):
+
+        return (nodeAid, nodeBid, nodeCid) in self._movements
+
+    def getMovement(self, nodeAid, nodeBid, nodeCid):
+        """Return the movement from vertex nodeAid through vertex nodeBid 
+        to vertex nodeCid"""
+        try:
+            return self._movements[nodeAid, nodeBid, nodeCid]
+        except KeyError, e:
+            raise GraphError("Movement %s %s %s not in the graph" % 
+                             (nodeAid, nodeBid, nodeCid))
+
+    def getMovementByDenseId(self, denseId):
+        """Return the movement with the input dense id. See 
+        Movement.getDenseId"""
+        try:
+            movement = self._movementsByDenseId[denseId]
+        except IndexError, e:
+            movement = None
+        if movement is None:
+            raise GraphError("There is no movement with dense id %d" % denseId)
+        return movement
+
+    def getNumMovements(self):
+
+        return len(self._movements)
+
+    def getTopologyVersion(self):
+        """Return a counter that changes every time a vertex, edge or
+        movement is added or deleted"""
+        return self._topologyVersion
+
+    def getCostVersion(self):
+        """Return a value that changes every time the topology, the vertex
+        coordinates or a cost of the edges or movements (length, free flow
+        speed, turn penalty, time varying costs or simulated results) 
+        changes"""
+        return self._topologyVersion, self._costVersion
+
+    def _checkResultsWritable(self):
+        """Raise a SimError if the results are mapped to read only files"""
+        if self._resultsMode == 'r':
+            raise SimError("The results of graph %s are mapped to read only "
+                           "files in %s" % (self.name, self._resultsDirectory))
+
+    def _costsChanged(self):
+
+        self._costVersion += 1
+
+    def getCSR(self):
+        """Return a compressed sparse row snapshot of the graph. The 
+        snapshot is rebuilt only if the topology has changed since the 
+        last call and its attribute arrays are updated only if the costs
+        have changed"""
+        if self._csr is None or self._csr.version != self._topologyVersion:
+            self._csr = CsrGraph(self)
+        elif self._csr.costVersion != self.getCostVersion():
+            self._csr.updateEdgeAttributes()
+            self._csr.updateMovementAttributes()
+            self._csr.costVersion = self.getCostVersion()
+        return self._csr
+
+    def getShortestPathTrees(self):
+        """Return the cache of the shortest path trees of the graph"""
+        if self._shortestPathTrees is None:
+            self._shortestPathTrees = ShortestPathTreeCache(self)
+        return self._shortestPathTrees
+
+    def classifyTurnTypes(self):
+        """Recompute the base turn type of every movement from the vertex
+        coordinates in one vectorized pass. Return the turn types as an
+        array indexed by the movement index of the CSR snapshot"""
+        csr = self.getCSR()
+        x = np.array([vertex.x for vertex in csr.vertices], np.float64)
+        y = np.array([vertex.y for vertex in csr.vertices], np.float64)
+
+        directions = np.arctan2(y[csr.edgeEnd] - y[csr.edgeStart], 
+                                x[csr.edgeEnd] - x[csr.edgeStart])
+        angles = (directions[csr.movementOutEdge] - 
+                  directions[csr.movementInEdge]) * 180 / np.pi
+        angles[angles < 0] += 360
+        turnTypes = getTurnTypes(angles, csr.movementIsUTurn)
+        for movement, turnType in izip(csr.movements, turnTypes.tolist()):
+            movement.baseTurnType = turnType
+        return turnTypes
+
+    def getMovementResults(self):
+        """Return the store holding the simulated volumes and travel 
+        times of all the movements of the graph"""
+        return self._movementResults
+
+    def getEdgeResults(self):
+        """Return the store holding the simulated volumes and travel 
+        times of the edges without emanating movements"""
+        return self._edgeResults
+
+    def _addMovement(self, movement):
+        """Index the movement and reserve a row for its results. The
+        row is the dense id of the movement. The results the movement
+        kept before it joined the graph are copied to the row"""
+        if movement._simResults is not self._movementResults:
+            privateResults = movement._simResults
+            privateRow = movement._resultRow
+            if privateResults is not None and \
+                    (privateResults.simStartTimeInMin, privateResults.simEndTimeInMin,
+                     privateResults.simTimeStepInMin) != \
+                    (self.simStartTimeInMin, self.simEndTimeInMin, self.simTimeStepInMin):
+                raise SimError("The results of movement %s are not for the "
+                               "simulation period of graph %s" % 
+                               (str(movement.iid), self.name))
+            movement._simResults = self._movementResults
+            movement._resultRow = self._movementResults.addRow()
+            if privateResults is not None:
+                self._movementResults.setVolumesAndMeanTTs(
+                    [movement._resultRow], privateResults.volume[[privateRow]],
+                    privateResults.meanTT[[privateRow]])
+        self._movements[movement.iid] = movement
+        self._indexDenseId(movement)
+        self._topologyVersion += 1
+
+    def _deleteMovement(self, movement):
+        """Remove the movement from the index and release the row 
+        holding its results"""
+        if movement._simResults is self._movementResults:
+            self._movementResults.deleteRow(movement._resultRow)
+            self._movementsByDenseId[movement._resultRow] = None
+            movement._simResults = None
+            movement._resultRow = None
+        del self._movements[movement.iid]
+        self._topologyVersion += 1
+
+    def _indexDenseId(self, movement):
+
+        denseId = movement._resultRow
+        if denseId >= len(self._movementsByDenseId):
+            self._movementsByDenseId.extend([None] * (denseId + 1 - 
+                                                      len(self._movementsByDenseId)))
+        self._movementsByDenseId[denseId] = movement
+
     def getNumVertices(self):
 
         return len(self._vertices)
@@ -164,24 +545,66 @@ class Graph(object):
             
         return newEdge1, newEdge2
 
-    def _createTimeVaryingEdgeAttribute(self, attributeName):
-
+    def _checkTimeVaryingEdgeAttribute(self, attributeName):
+        """Raise a GraphError if an edge already has the attribute"""
         for edge in self.iterEdges():
             if hasattr(edge, attributeName):
                 raise GraphError('Edge %s already has a an attribute named %s' % 
                                    (edge.iid_, attributeName))
-            setattr(edge, attributeName, {})
-
-    def _createTimeVaryingMovementAttribute(self, attributeName):
 
+    def _checkTimeVaryingMovementAttribute(self, attributeName):
+        """Raise a GraphError if a movement already has the attribute"""
         for edge in self.iterEdges():
             for eMov in edge.iterOutMovements():
                 if hasattr(eMov, attributeName):
                     raise GraphError("Movement %s aready has an attribute named %s" % 
                                        (eMov.iid_, attributeName))
-                setattr(eMov, attributeName, {})
+
+    def _createTimeVaryingEdgeAttribute(self, attributeName):
+
+        self._checkTimeVaryingEdgeAttribute(attributeName)
+        for edge in self.iterEdges():
+            edge.setAttribute(attributeName, {})
+        self._timeVaryingEdgeAttributes.append(attributeName)
+
+    def _createTimeVaryingMovementAttribute(self, attributeName):
+
+        self._checkTimeVaryingMovementAttribute(attributeName)
+        for edge in self.iterEdges():
+            for eMov in edge.iterOutMovements():
+                eMov.setAttribute(attributeName, {})
+        self._timeVaryingMovementAttributes.append(attributeName)
             
-    def readTimeVaryingEdgeAttribute(self, fileName, attrName, startTimeInMin, endTimeInMin, timeStepInMin, hasHeader=True):
+    def _readTimeVaryingValues(self, fileName, numIdFields, hasHeader, numProcesses,
+                               startTimeInMin, endTimeInMin, timeStepInMin):
+        """Parse the comma separated ids and values of a time varying 
+        attribute file. Raise a GraphError if a line does not have one
+        value per time interval"""
+
+        numTimeIntervals = len(range(startTimeInMin, endTimeInMin, timeStepInMin))
+        message = ('The number of time intervals from %d to %d using time step %d'
+                   ' are not the same as the number of columns in %s' %
+                   (startTimeInMin, endTimeInMin, timeStepInMin, fileName))
+        try:
+            ids, values = readIdsAndValues(fileName, numIdFields, ",", hasHeader,
+                                           numProcesses)
+        except SimError, e:
+            raise GraphError("%s. %s" % (message, str(e)))
+        self._resultSourceFileNames.append(fileName)
+
+        if ids and values.shape[1] != numTimeIntervals:
+            raise GraphError(message)
+        return ids, values
+
+    def readTimeVaryingEdgeAttribute(self, fileName, attrName, startTimeInMin, endTimeInMin, timeStepInMin, hasHeader=True, numProcesses=1):
+        """Reads a list of comma separated values from each line in the input 
+        fileName (that starts with the two vertex ids of an edge) and 
+        assigns each value to the corresponding time interval specified by
+        the time arguments. If numProcesses is greater than one the file
+        is parsed in parallel
+
+        the edge attribute can be accessed as edge.attrName[startInMin, endInMin]
+        """
 
         assert self.simStartTimeInMin <= startTimeInMin < self.simEndTimeInMin
         assert self.simStartTimeInMin < endTimeInMin <= self.simEndTimeInMin
@@ -189,40 +612,25 @@ class Graph(object):
 
         self._createTimeVaryingEdgeAttribute(attrName)
 
-        numTimeIntervals = len(range(startTimeInMin, endTimeInMin, timeStepInMin))
+        timePeriods = list(pairwise(range(startTimeInMin, endTimeInMin + 1, timeStepInMin)))
+        ids, values = self._readTimeVaryingValues(fileName, 2, hasHeader, numProcesses,
+                                                  startTimeInMin, endTimeInMin, timeStepInMin)
 
-        inputStream = open(fileName, 'r')
-        if hasHeader:
-            inputStream.next() # this is the header 
-        
-        for line in inputStream:
-            fields = line.strip().split(",")
-            nodeAid, nodeBid = fields[:2]
+        for (nodeAid, nodeBid), edgeValues in izip(ids, values.tolist()):
 
             try:
                 edge = self.getEdge(nodeAid, nodeBid)
-            except Graph, e:
+            except GraphError, e:
                 logging.error(str(e))
                 continue
 
-            attrValue = {}
-            i = 2
-
-            if len(fields[2:]) != numTimeIntervals:
-                raise Graph('The number of time intervals from %d to %d using time step %d'
-                                ' are not the same as the number of columns in %s' %
-                                (startTimeInMin, endTimeInMin, timeStepInMin, fileName))
+            edge.setAttribute(attrName, dict(izip(timePeriods, edgeValues)))
 
-            for start, end in pairwise(range(startTimeInMin, endTimeInMin + 1, timeStepInMin)):
-                attrValue[start, end] = float(fields[i])
-                i += 1
-            setattr(edge, attrName, attrValue)
-        inputStream.close()            
-
-    def readTimeVaryingMovementAttribute(self, fileName, attrName, startTimeInMin, endTimeInMin, timeStepInMin, hasHeader=True):
+    def readTimeVaryingMovementAttribute(self, fileName, attrName, startTimeInMin, endTimeInMin, timeStepInMin, hasHeader=True, numProcesses=1):
         """Reads a list of values from each line in the input fileName and assigns
         each value to the corresponding time interval specified
-        by the last three input arguments
+        by the last three input arguments. If numProcesses is greater than
+        one the file is parsed in parallel
 
         the movement attribute can be accesse as mov.attrName[startInMin, endInMin]
 
@@ -234,54 +642,31 @@ class Graph(object):
 
         self._createTimeVaryingMovementAttribute(attrName)
 
-        inputStream = open(fileName, 'r')
-        if hasHeader:
-            inputStream.next()
-
-        numTimeIntervals = len(range(startTimeInMin, endTimeInMin, timeStepInMin))
-
-        for line in inputStream:
-
-            fields = line.strip().split(",")
-            nodeAid, nodeBid, nodeCid = fields[0].split()
+        timePeriods = list(pairwise(range(startTimeInMin, endTimeInMin + 1, timeStepInMin)))
+        ids, values = self._readTimeVaryingValues(fileName, 1, hasHeader, numProcesses,
+                                                  startTimeInMin, endTimeInMin, timeStepInMin)
 
-            if len(fields[1:]) != numTimeIntervals:
-                raise GraphError('The number of time intervals from %d to %d using time step %d'
-                                ' are not the same as the number of columns in %s' %
-                                (startTimeInMin, endTimeInMin, timeStepInMin, fileName))
+        nonZero = values.any(axis=1) if ids else []
 
-            attrValue = {}
-            i = 1
-            allValuesAreZero = True
-            for start, end in pairwise(range(startTimeInMin, endTimeInMin + 1, timeStepInMin)):
-                singleValue = float(fields[i])
-                if singleValue != 0:
-                    allValuesAreZero = False
-                attrValue[start, end] = singleValue
-                i += 1
+        for (movementId,), movementValues, hasValues in izip(ids, values.tolist(), nonZero):
 
-            if allValuesAreZero:
+            if not hasValues:
                 continue
 
+            nodeAid, nodeBid, nodeCid = movementId.split()
             try:
-                edge = self.getEdge(nodeAid, nodeBid)
-                movement = edge.getOutMovement(nodeCid)
+                movement = self.getMovement(nodeAid, nodeBid, nodeCid)
 
                 if movement.isUTurn():
                     continue
                 
-            except BaseNetworkError, e:
+            except GraphError, e:
                 if nodeCid == nodeAid:
                     continue
                 logging.error(str(e))
                 continue
-            except DynameqError, e:
-                logging.error(str(e))
-                continue
 
-            setattr(movement, attrName, attrValue)
-            
-        inputStream.close()
+            movement.setAttribute(attrName, dict(izip(timePeriods, movementValues)))
 
     def readMovementVolumesAndTTs(self, movementFlowFileName, movementTimeFileName):
         """Read the movement travel times (in seconds) add assign them 
@@ -289,6 +674,7 @@ class Graph(object):
 
         inputStream1 = open(movementFlowFileName, 'r')
         inputStream2 = open(movementTimeFileName, 'r')
+        self._resultSourceFileNames.extend([movementFlowFileName, movementTimeFileName])
 
         numMovementsRead = 0
 
@@ -312,8 +698,8 @@ class Graph(object):
                                                 nodeBid, nodeAid, nodeCid))
 
             try:
-                edge = self.getEdge(nodeAid, nodeBid)
-                movement = edge.getOutMovement(nodeCid)
+                movement = self.getMovement(nodeAid, nodeBid, nodeCid)
+                edge = movement.inEdge
             except GraphError, e:
                 if nodeAid == nodeCid:
                     continue
@@ -321,12 +707,19 @@ class Graph(object):
                 logging.error(str(e))
                 continue
 
-            simFlows = imap(int, flowFields[3:])
+            simFlows = imap(float, flowFields[3:])
             simTTs = imap(float, timeFields[3:])
             timePeriodStart = self.simStartTimeInMin
                     
             for simFlow, simTT in izip(simFlows, simTTs):
 
+                #flows are vehicle counts written as whole numbers
+                if simFlow != int(simFlow):
+                    raise SimError('Movement %s has the fractional flow %f in the '
+                                   'time period begining %d' %
+                                   (str(movement.iid), simFlow, timePeriodStart))
+                simFlow = int(simFlow)
+
                 if simFlow == 0 and simTT > 0:
                     raise SimError('Movement %s has zero flow in the '
                                    'time period begining %d and a '
@@ -362,4 +755,364 @@ class Graph(object):
 
         inputStream1.close()
         inputStream2.close()
+        self._costsChanged()
+
+    def readMovementVolumesAndTTsInBulk(self, movementFlowFileName, movementTimeFileName,
+                                        linesPerChunk=LINES_PER_CHUNK, numProcesses=1):
+        """Read the movement volumes and travel times the same way
+        readMovementVolumesAndTTs does. The files are parsed in chunks
+        of linesPerChunk lines into arrays that are validated and 
+        written into the movement result store in one operation per chunk. 
+        If numProcesses is greater than one the chunks are parsed in 
+        parallel by a pool of numProcesses worker processes"""
+
+        self._resultSourceFileNames.extend([movementFlowFileName, movementTimeFileName])
+
+        if numProcesses > 1:
+            chunks = iterParallelChunks([movementFlowFileName, movementTimeFileName], 3,
+                                        linesPerChunk=linesPerChunk,
+                                        numProcesses=numProcesses)
+        else:
+            chunks = izip(iterChunks(movementFlowFileName, 3, linesPerChunk=linesPerChunk),
+                          iterChunks(movementTimeFileName, 3, linesPerChunk=linesPerChunk))
+
+        for (flowIds, simFlows), (timeIds, simTTs) in chunks:
+            self._setMovementVolumesAndTTs(flowIds, simFlows, timeIds, simTTs,
+                                           movementFlowFileName, movementTimeFileName)
+
+    def _setMovementVolumesAndTTs(self, flowIds, simFlows, timeIds, simTTs,
+                                  movementFlowFileName, movementTimeFileName):
+        """Validate a chunk of parsed movement volumes and travel times 
+        and write it into the movement result store"""
+
+        numTimeSteps = self._movementResults.numTimeSteps
+
+        if flowIds != timeIds:
+            for (nodeAid, nodeBid, nodeCid), timeId in izip(flowIds, timeIds):
+                if (nodeAid, nodeBid, nodeCid) != timeId:
+                    break
+            raise SimError('The files %s and %s are not in sync. '
+                                  'Movement through %s from %s to %s in the first file is not '
+                                  'in the same line position in the second '
+                                  'file' % (movementFlowFileName,
+                                            movementTimeFileName,
+                                            nodeBid, nodeAid, nodeCid))
+        if simFlows.shape != simTTs.shape:
+            raise SimError('The files %s and %s do not have the same number '
+                           'of time periods' % (movementFlowFileName,
+                                                movementTimeFileName))
+
+        lines = []
+        rows = []
+        for i, (nodeAid, nodeBid, nodeCid) in enumerate(flowIds):
+            movement = self._movements.get((nodeAid, nodeBid, nodeCid))
+            if movement is None:
+                if nodeAid != nodeCid:
+                    logging.error("Movement %s %s %s is not in the graph" % 
+                                  (nodeAid, nodeBid, nodeCid))
+                continue
+            lines.append(i)
+            rows.append(movement._resultRow)
+
+        if not rows:
+            return
+
+        simFlows = simFlows[lines, :numTimeSteps]
+        simTTs = simTTs[lines, :numTimeSteps]
+
+        errors = np.argwhere(simFlows != np.floor(simFlows))
+        if len(errors):
+            line, period = errors[0]
+            raise SimError('Movement %s has the fractional flow %f in the '
+                           'time period begining %d' %
+                           (str(flowIds[lines[line]]), simFlows[line, period],
+                            self.simStartTimeInMin + period * self.simTimeStepInMin))
+        simFlows = simFlows.astype(int)
+
+        errors = np.argwhere(((simFlows == 0) & (simTTs > 0)) | 
+                             (simFlows < 0) | (simTTs < 0))
+        if len(errors):
+            line, period = errors[0]
+            raise SimError('Movement %s has flow %d and travel time %f in the '
+                           'time period begining %d' % 
+                           (str(flowIds[lines[line]]), simFlows[line, period],
+                            simTTs[line, period], 
+                            self.simStartTimeInMin + period * self.simTimeStepInMin))
+
+        for line, period in np.argwhere((simFlows > 0) & (simTTs == 0)):
+            logging.error('Movement %s has positive flow in '
+                          'the time period begining %d and a '
+                          'zero travel time' % 
+                          (str(flowIds[lines[line]]), 
+                           self.simStartTimeInMin + period * self.simTimeStepInMin))
+        simTTs = np.where((simFlows > 0) & (simTTs == 0), 0.01, simTTs)
+
+        #time periods without flow and time keep their existing values
+        empty = (simFlows == 0) & (simTTs == 0)
+        numColumns = simFlows.shape[1]
+        movementResults = self._movementResults
+        simFlows = np.where(empty, movementResults.volume[rows, :numColumns], simFlows)
+        simTTs = np.where(empty, movementResults.meanTT[rows, :numColumns], simTTs)
+
+        movementResults.setVolumesAndMeanTTs(rows, simFlows, simTTs)
+        self._costsChanged()
+
+    def _getTimeVaryingAttributeArrays(self, elements, attrName):
+        """Return the ids of the elements that have values for the
+        input time varying attribute, the time periods of the values and
+        a 2D array with the values (NaN if missing)"""
+        elements = [element for element in elements if getattr(element, attrName)]
+        timePeriods = sorted(set(period for element in elements 
+                                 for period in getattr(element, attrName)))
+        columns = dict((period, i) for i, period in enumerate(timePeriods))
+
+        values = np.empty((len(elements), len(timePeriods)))
+        values.fill(np.nan)
+        for i, element in enumerate(elements):
+            for period, value in getattr(element, attrName).iteritems():
+                values[i, columns[period]] = value
+
+        return ([element.iid for element in elements], 
+                np.array(timePeriods, np.int64).reshape(-1, 2), values)
+
+    def saveResults(self, fileName, sourceFileNames=None):
+        """Save the simulated movement and edge volumes and travel times
+        and all the time varying attributes to a binary (.npz) file that
+        can be read back with loadResults. The file is keyed by a hash 
+        of the source files (by default all the files read by the graph)"""
+
+        if sourceFileNames is None:
+            sourceFileNames = self._resultSourceFileNames
+
+        movements = [mov for edge in self.iterEdges() for mov in edge.iterOutMovements()]
+        movementRows = [mov._resultRow for mov in movements]
+        edges = [edge for edge in self.iterEdges() if edge._resultRow is not None]
+        edgeRows = [edge._resultRow for edge in edges]
+
+        arrays = {}
+        arrays['version'] = np.array(self.RESULTS_FORMAT_VERSION)
+        arrays['simTimes'] = np.array([self.simStartTimeInMin, self.simEndTimeInMin,
+                                       self.simTimeStepInMin])
+        arrays['sourceFileNames'] = np.array(sourceFileNames, dtype=str)
+        arrays['sourceHash'] = np.array(hashFiles(sourceFileNames))
+
+        arrays['movementIds'] = np.array([mov.iid for mov in movements], dtype=str).reshape(-1, 3)
+        arrays['movementVolume'] = self._movementResults.volume[movementRows]
+        arrays['movementMeanTT'] = self._movementResults.meanTT[movementRows]
+        arrays['edgeIds'] = np.array([edge.iid for edge in edges], dtype=str).reshape(-1, 2)
+        arrays['edgeVolume'] = self._edgeResults.volume[edgeRows]
+        arrays['edgeMeanTT'] = self._edgeResults.meanTT[edgeRows]
+
+        arrays['edgeAttributes'] = np.array(self._timeVaryingEdgeAttributes, dtype=str)
+        for i, attrName in enumerate(self._timeVaryingEdgeAttributes):
+            ids, timePeriods, values = self._getTimeVaryingAttributeArrays(
+                self.iterEdges(), attrName)
+            arrays['edgeAttribute%dIds' % i] = np.array(ids, dtype=str).reshape(-1, 2)
+            arrays['edgeAttribute%dPeriods' % i] = timePeriods
+            arrays['edgeAttribute%dValues' % i] = values
+
+        arrays['movementAttributes'] = np.array(self._timeVaryingMovementAttributes, dtype=str)
+        for i, attrName in enumerate(self._timeVaryingMovementAttributes):
+            ids, timePeriods, values = self._getTimeVaryingAttributeArrays(
+                movements, attrName)
+            arrays['movementAttribute%dIds' % i] = np.array(ids, dtype=str).reshape(-1, 3)
+            arrays['movementAttribute%dPeriods' % i] = timePeriods
+            arrays['movementAttribute%dValues' % i] = values
+
+        outputStream = open(fileName, 'wb')
+        try:
+            np.savez(outputStream, **arrays)
+        finally:
+            outputStream.close()
+
+    def loadResults(self, fileName, sourceFileNames=None):
+        """Load the results saved by saveResults. The results are loaded
+        only if they were produced from files with contents identical to
+        the input source files (by default the source files recorded in
+        the results file). Return True if the results were loaded and 
+        False if the file is missing, was written by a different version
+        or is stale. Raise a GraphError before anything is loaded if a
+        time varying attribute of the file already exists"""
+
+        try:
+            arrays = np.load(fileName)
+        except IOError:
+            return False
 
+        try:
+            if int(arrays['version']) != self.RESULTS_FORMAT_VERSION:
+                logging.warning("Results file %s has version %d instead of %d" % 
+                                (fileName, int(arrays['version']), 
+                                 self.RESULTS_FORMAT_VERSION))
+                return False
+
+            if sourceFileNames is None:
+                sourceFileNames = arrays['sourceFileNames'].tolist()
+            try:
+                if str(arrays['sourceHash']) != hashFiles(sourceFileNames):
+                    return False
+            except IOError:
+                logging.warning("The source files of results file %s cannot be "
+                                "read" % fileName)
+                return False
+
+            if arrays['simTimes'].tolist() != [self.simStartTimeInMin, self.simEndTimeInMin,
+                                               self.simTimeStepInMin]:
+                raise SimError("The results in %s are not for the simulation "
+                               "period and time step of the graph" % fileName)
+
+            for attrName in arrays['edgeAttributes'].tolist():
+                self._checkTimeVaryingEdgeAttribute(attrName)
+            for attrName in arrays['movementAttributes'].tolist():
+                self._checkTimeVaryingMovementAttribute(attrName)
+
+            movementIds = [tuple(iid) for iid in arrays['movementIds'].tolist()]
+            movements = self._getElementsByIid(movementIds, self._movements)
+            found = [i for i, mov in enumerate(movements) if mov is not None]
+            self._movementResults.setVolumesAndMeanTTs(
+                [movements[i]._resultRow for i in found],
+                arrays['movementVolume'][found], arrays['movementMeanTT'][found])
+
+            edgeIds = [tuple(iid) for iid in arrays['edgeIds'].tolist()]
+            edges = self._getElementsByIid(edgeIds, self._edges)
+            found = [i for i, edge in enumerate(edges) if edge is not None]
+            for i in found:
+                if edges[i]._resultRow is None:
+                    edges[i]._resultRow = self._edgeResults.addRow()
+            self._edgeResults.setVolumesAndMeanTTs(
+                [edges[i]._resultRow for i in found],
+                arrays['edgeVolume'][found], arrays['edgeMeanTT'][found])
+
+            for prefix, createAttribute, elementsByIid in [
+                ('edgeAttribute', self._createTimeVaryingEdgeAttribute, self._edges),
+                ('movementAttribute', self._createTimeVaryingMovementAttribute, 
+                 self._movements)]:
+
+                for i, attrName in enumerate(arrays[prefix + 's'].tolist()):
+                    createAttribute(attrName)
+                    ids = [tuple(iid) for iid in arrays['%s%dIds' % (prefix, i)].tolist()]
+                    timePeriods = [tuple(period) for period in 
+                                   arrays['%s%dPeriods' % (prefix, i)].tolist()]
+                    values = arrays['%s%dValues' % (prefix, i)]
+                    elements = self._getElementsByIid(ids, elementsByIid)
+                    for element, elementValues in izip(elements, values.tolist()):
+                        if element is None:
+                            continue
+                        element.setAttribute(attrName, 
+                                             dict((period, value) for period, value in 
+                                                  izip(timePeriods, elementValues) 
+                                                  if value == value))
+
+            self._resultSourceFileNames = arrays['sourceFileNames'].tolist()
+        finally:
+            arrays.close()
+
+        self._costsChanged()
+        return True
+
+    def openResults(self, directory, mode='r'):
+        """Back the simulated movement and edge volumes and travel times
+        by memory mapped files in the input directory so that only the 
+        accessed results are paged in. With mode 'w+' the current 
+        results are written to new files. With modes 'r' (read only), 
+        'r+' (read and write) and 'c' (copy on write) the results of 
+        files written before are mapped to the movements and edges of 
+        the graph by their ids. Changes are written to the files by
+        flushResults. Only files opened with mode 'r+' grow, so the 
+        movements missing from the files are an error in modes 'r' 
+        and 'c'"""
+
+        stores = [('movements', self._movementResults, list(self._iterMovements())),
+                  ('edges', self._edgeResults, list(self.iterEdges()))]
+
+        if mode == 'w+':
+            self._resultsDirectory = directory
+            self._resultsMode = mode
+            for name, store, elements in stores:
+                store.mapToFiles(os.path.join(directory, name), mode)
+            self._saveResultIds()
+            return
+
+        storeIds = []
+        for name, store, elements in stores:
+            storeDirectory = os.path.join(directory, name)
+            if not os.path.isfile(os.path.join(storeDirectory, 'ids.npy')):
+                raise SimError("There are no results in %s" % storeDirectory)
+            ids = np.load(os.path.join(storeDirectory, 'ids.npy')).tolist()
+            storeIds.append(ids)
+            if name != 'movements' or mode == 'r+':
+                continue
+            idSet = set(ids)
+            missing = [element.iid_ for element in elements if element.iid_ not in idSet]
+            if missing:
+                raise SimError("Movements %s have no results in %s. Open the "
+                               "results with mode 'r+' to add them" % 
+                               (", ".join(missing), storeDirectory))
+
+        self._resultsDirectory = directory
+        self._resultsMode = mode
+
+        for (name, store, elements), ids in zip(stores, storeIds):
+            storeDirectory = os.path.join(directory, name)
+            store.mapToFiles(storeDirectory, mode)
+            if len(ids) != len(store):
+                raise SimError("The results in %s have %d rows instead of %d" %
+                               (storeDirectory, len(store), len(ids)))
+
+            #the movements missing from the files get new empty rows 
+            #past the rows of the files, which grow in place
+            rows = dict((iid, row) for row, iid in enumerate(ids) if iid)
+            for element in elements:
+                row = rows.get(element.iid_)
+                if row is None and name == 'movements':
+                    logging.warning("Movement %s has no results in %s" % 
+                                    (element.iid_, storeDirectory))
+                    row = store.addRow()
+                element._resultRow = row
+            store.releaseUnusedRows([element._resultRow for element in elements
+                                     if element._resultRow is not None])
+
+        self._movementsByDenseId = []
+        for movement in self._movements.itervalues():
+            self._indexDenseId(movement)
+        self._topologyVersion += 1
+        self._costsChanged()
+
+    def flushResults(self):
+        """Write the changed results to the files opened by openResults"""
+
+        if self._resultsDirectory is None:
+            raise SimError("The results of graph %s are not backed by files" %
+                           self.name)
+        if self._resultsMode in ('w+', 'r+'):
+            self._saveResultIds()
+            self._movementResults.flush()
+            self._edgeResults.flush()
+
+    def _saveResultIds(self):
+        """Save the ids of the elements stored in each row of the result
+        files opened by openResults"""
+
+        for name, store, elements in [
+            ('movements', self._movementResults, self._iterMovements()),
+            ('edges', self._edgeResults, self.iterEdges())]:
+
+            ids = [''] * len(store)
+            for element in elements:
+                if element._resultRow is not None:
+                    ids[element._resultRow] = element.iid_
+            np.save(os.path.join(self._resultsDirectory, name, 'ids.npy'),
+                    np.array(ids, dtype=str))
+
+    def _iterMovements(self):
+        """Return an iterator to all the movements of the graph"""
+        return (mov for edge in self.iterEdges() for mov in edge.iterOutMovements())
+
+    def _getElementsByIid(self, iids, elementsByIid):
+        """Return a list with the element (None if not found) with each 
+        of the input iids in the input index"""
+        result = [elementsByIid.get(iid) for iid in iids]
+        for iid, element in izip(iids, result):
+            if element is None:
+                logging.error("Element %s is not in the graph" % " ".join(iid))
+        return result
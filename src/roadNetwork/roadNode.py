@@ -3,26 +3,130 @@ __company__ = "Parsons Brinckerhoff"
 __email__ = "xyntarakis@pbworld.com"
 __license__ = "GPL"
 
+from bisect import bisect_right
 import logging
-from itertools import imap,chain
+from itertools import imap, izip, chain
 from math import fabs, atan, atan2, pi, sqrt, acos, sin, cos
 import random
 import sys
 
+from roadNetwork.attributeStore import AttributeStore
 from roadNetwork.edge import Edge
 from roadNetwork.errors import GraphError
 
-class Vertex(object):
+INCIDENT, EMANATING = range(2)
+
+def _bisectCyclic(bearings, bearing, clockwise=True):
+    """Return the position the input bearing should be inserted in the
+    input list of bearings (in degrees) that are sorted clockwise (or 
+    counterclockwise) starting from the first one. The bearing is 
+    inserted after any equal bearings"""
+    if not bearings:
+        return 0
+    first = bearings[0]
+    direction = 1 if clockwise else -1
+    key = (direction * (bearing - first)) % 360
+    low, high = 1, len(bearings)
+    while low < high:
+        middle = (low + high) // 2
+        if key < (direction * (bearings[middle] - first)) % 360:
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+def _findEdge(edges, keys, edge, position):
+    """Return the index of the edge in the input list searching backwards
+    from the input position over the edges with the same key"""
+    for i in xrange(position, -1, -1):
+        if edges[i] is edge:
+            return i
+        if keys[i] != keys[position]:
+            break
+    return edges.index(edge)
+
+class Vertex(AttributeStore):
+
+    __slots__ = ('id', '_x', '_y', '_emanatingEdges', '_incidentEdges',
+                 '_edgesClockwise', '_outBearings', '_inBearings', 
+                 '_clockwiseKeys', '_outEdgesByVertexId', '_inEdgesByVertexId',
+                 '_graph')
 
     def __init__(self, id_, x, y):
         
+        self._attributes = None
         self.id = id_
-        self.iid = self.id
-        self.x = x
-        self.y = y        
+        self._x = x
+        self._y = y        
         self._emanatingEdges = []
         self._incidentEdges = []
         self._edgesClockwise = []
+        #the bearings of the edges in the lists above (keys for the 
+        #clockwise list) so that they are not recomputed
+        self._outBearings = []
+        self._inBearings = []
+        self._clockwiseKeys = []
+        self._outEdgesByVertexId = {}   # successor vertex id to edge
+        self._inEdgesByVertexId = {}    # predecessor vertex id to edge
+        self._graph = None              # the graph the vertex belongs to
+
+    @property
+    def iid(self):
+
+        return self.id
+
+    @property
+    def x(self):
+
+        return self._x
+
+    @x.setter
+    def x(self, x):
+
+        self._x = x
+        self._updateGeometry()
+
+    @property
+    def y(self):
+
+        return self._y
+
+    @y.setter
+    def y(self, y):
+
+        self._y = y
+        self._updateGeometry()
+
+    def _updateGeometry(self):
+        """Update the cached geometry of the adjacent edges, the order 
+        of the edges around this and the adjacent vertices and the turn
+        types of the movements through them after the vertex moved"""
+        for edge in self.iterEdges():
+            edge._invalidateGeometry()
+        if self._graph is not None:
+            self._graph._updateSpatialIndex(self)
+            self._graph._costsChanged()
+
+        vertices = [self] + list(self.iterAdjacentVertices())
+        for vertex in vertices:
+            vertex._updateBearings()
+        for vertex in vertices:
+            for edge in vertex.iterInEdges():
+                edge._sortMovements()
+                for mov in edge.iterOutMovements():
+                    mov.baseTurnType = mov.getTurnType()
+
+    def _updateBearings(self):
+        """Recompute the bearings of the adjacent edges and restore the
+        order of the edge lists keeping the rotation of the cyclic ones"""
+        outEdges = [(self.getOrientation(edge.midpoint2), edge) for edge in 
+                    self._emanatingEdges]
+        inEdges = [(self.getOrientation(edge.midpoint2), edge) for edge in 
+                   self._incidentEdges]
+        clockwise = [((self.getOrientation(edge.midpoint2), direction), edge) for 
+                     (bearing, direction), edge in izip(self._clockwiseKeys, 
+                                                         self._edgesClockwise)]
+        self._sortAdjacentEdges(outEdges, inEdges, clockwise)
                         
     def __str__(self):
 
@@ -35,19 +139,17 @@ class Vertex(object):
         if not edge.startVertex.id == self.id:
             raise GraphError("Edge %s does not start from vertex %s" % (edge.iid_, self.id))
 
-        if edge in self._emanatingEdges:
+        if edge.endVertexId in self._outEdgesByVertexId:
             raise GraphError("Edge %s already emanates from the vertex %s" % 
                             (edge.iid_, self.id))
             
-        #identify the position to insert the edge
-        position = 0
-        for i, emanatingEdge in enumerate(self.iterOutEdges()):
-            if edge.isClockwise(emanatingEdge):
-                position = i + 1
+        #the emanating edges are kept in clockwise order 
+        bearing = self.getOrientation(edge.midpoint2)
+        position = _bisectCyclic(self._outBearings, bearing)
         self._emanatingEdges.insert(position, edge)
-        self._edgesClockwise = sorted(chain(self._incidentEdges, 
-                                            self._emanatingEdges),
-                          key = lambda e: self.getOrientation(e.midpoint2))
+        self._outBearings.insert(position, bearing)
+        self._outEdgesByVertexId[edge.endVertexId] = edge
+        self._insertClockwise(edge, (bearing, EMANATING))
 
     def addInEdge(self, edge):
         """Add the incident instance of Edge (or subclass) to the list
@@ -56,49 +158,117 @@ class Vertex(object):
         if not edge.endVertex.id == self.id:
             raise GraphError("Edge %s does not end to vertex %s" % (edge.iid_, self.id))
 
-        if edge in self._incidentEdges:
+        if edge.startVertexId in self._inEdgesByVertexId:
             raise GraphError("Edge %s is laready incident to vertex %s" % 
                             (edge.iid, self.id))
 
-        
-        position = 0
-        for i, incidentEdge in enumerate(self.iterInEdges()):
-            if edge.isCounterClockwise(incidentEdge):
-                position = i + 1
-
+        #the incident edges are kept in counter clockwise order
+        bearing = self.getOrientation(edge.midpoint2)
+        position = _bisectCyclic(self._inBearings, bearing, clockwise=False)
         self._incidentEdges.insert(position, edge)
-        self._edgesClockwise = sorted(chain(self._incidentEdges, 
-                                            self._emanatingEdges),
-                          key = lambda e: self.getOrientation(e.midpoint2))
-
+        self._inBearings.insert(position, bearing)
+        self._inEdgesByVertexId[edge.startVertexId] = edge
+        self._insertClockwise(edge, (bearing, INCIDENT))
+
+    def _insertClockwise(self, edge, key):
+        """Insert the edge in the list of all the adjacent edges sorted 
+        clockwise. Incident edges precede emanating edges with the same
+        bearing"""
+        position = bisect_right(self._clockwiseKeys, key)
+        self._edgesClockwise.insert(position, edge)
+        self._clockwiseKeys.insert(position, key)
+
+    def _deleteClockwise(self, edge, key):
+
+        position = _findEdge(self._edgesClockwise, self._clockwiseKeys, edge,
+                             bisect_right(self._clockwiseKeys, key) - 1)
+        del self._edgesClockwise[position]
+        del self._clockwiseKeys[position]
+
+    def _setEdges(self, edges):
+        """Replace the adjacent edges of the vertex with the input ones.
+        The edges are expected in the order they would have been added 
+        one by one and every list is sorted once"""
+        outEdges = []
+        inEdges = []
+        clockwise = []
+        for edge in edges:
+            bearing = self.getOrientation(edge.midpoint2)
+            if edge.startVertex is self:
+                outEdges.append((bearing, edge))
+                clockwise.append(((bearing, EMANATING), edge))
+            else:
+                inEdges.append((bearing, edge))
+                clockwise.append(((bearing, INCIDENT), edge))
+
+        #the cyclic lists start from the first edge added 
+        self._sortAdjacentEdges(outEdges, inEdges, clockwise)
+        self._outEdgesByVertexId = dict((edge.endVertexId, edge) for edge 
+                                        in self._emanatingEdges)
+        self._inEdgesByVertexId = dict((edge.startVertexId, edge) for edge 
+                                       in self._incidentEdges)
+
+    def _sortAdjacentEdges(self, outEdges, inEdges, clockwise):
+        """Sort the (bearing, edge) pairs of the emanating and incident 
+        edges cyclically starting from the first pair and the (key, edge)
+        pairs of all the adjacent edges by key. The sorted lists replace
+        the edge lists of the vertex"""
+        if outEdges:
+            first = outEdges[0][0]
+            outEdges.sort(key=lambda item: (item[0] - first) % 360)
+        if inEdges:
+            first = inEdges[0][0]
+            inEdges.sort(key=lambda item: (first - item[0]) % 360)
+        clockwise.sort(key=lambda item: item[0])
+
+        self._emanatingEdges = [edge for bearing, edge in outEdges]
+        self._outBearings = [bearing for bearing, edge in outEdges]
+        self._incidentEdges = [edge for bearing, edge in inEdges]
+        self._inBearings = [bearing for bearing, edge in inEdges]
+        self._edgesClockwise = [edge for key, edge in clockwise]
+        self._clockwiseKeys = [key for key, edge in clockwise]
 
     def _sortEdges(self):
         """Sorts the edges clockwise"""
-        self._edgesClockwise = sorted(chain(self._incidentEdges, 
-                                            self._emanatingEdges),
-                          key = lambda e: self.getOrientation(e.midpoint2))        
+        edges = [(bearing, INCIDENT, edge) for bearing, edge in 
+                 zip(self._inBearings, self._incidentEdges)]
+        edges.extend((bearing, EMANATING, edge) for bearing, edge in 
+                     zip(self._outBearings, self._emanatingEdges))
+        edges.sort(key=lambda item: item[:2])
+        self._edgesClockwise = [edge for bearing, direction, edge in edges]
+        self._clockwiseKeys = [(bearing, direction) for bearing, direction, edge in edges]
                    
     def _deleteOutEdge(self, edge):
         
         #raise Exception("Not implemented yet")
-        if edge not in self._emanatingEdges:
+        if self._outEdgesByVertexId.get(edge.endVertexId) is not edge:
             raise GraphError("Link %s does not emanate from node %s" %
                             (edge.iid, self.id))
 
-        self._emanatingEdges.remove(edge)
-        self._sortEdges()
+        bearing = self.getOrientation(edge.midpoint2)
+        position = _findEdge(self._emanatingEdges, self._outBearings, edge,
+                             _bisectCyclic(self._outBearings, bearing) - 1)
+        del self._emanatingEdges[position]
+        del self._outBearings[position]
+        del self._outEdgesByVertexId[edge.endVertexId]
+        self._deleteClockwise(edge, (bearing, EMANATING))
 
     def _deleteInEdge(self, edge):
 
         #raise Exception("Not implemented yet")
         assert isinstance(edge, Edge)
 
-        if edge not in self._incidentEdges:
+        if self._inEdgesByVertexId.get(edge.startVertexId) is not edge:
             raise GraphError("Edge %s is not incident to node %s" %
                             (edge.iid, self.id))
         
-        self._incidentEdges.remove(edge)
-        self._sortEdges()
+        bearing = self.getOrientation(edge.midpoint2)
+        position = _findEdge(self._incidentEdges, self._inBearings, edge,
+                             _bisectCyclic(self._inBearings, bearing, clockwise=False) - 1)
+        del self._incidentEdges[position]
+        del self._inBearings[position]
+        del self._inEdgesByVertexId[edge.startVertexId]
+        self._deleteClockwise(edge, (bearing, INCIDENT))
     
     def getCardinality(self):
 
@@ -209,17 +379,18 @@ class Vertex(object):
         
     def getOutEdge(self, vertexId):
         
-        for edge in self.iterOutEdges():
-            if edge.endVertexId == vertexId:
-                return edge
-        
+        try:
+            return self._outEdgesByVertexId[vertexId]
+        except KeyError, e:
+            pass
         raise GraphError("Vertex %s is not connected to vertex %s" % (self.id ,vertexId))
 
     def getInEdge(self, vertexId):
                                
-        for edge in self.iterInEdges():
-            if edge.startVertexId == vertexId:
-                return edge 
+        try:
+            return self._inEdgesByVertexId[vertexId]
+        except KeyError, e:
+            pass
         raise GraphError("Vertex %s is not connected to vertex %s" % (vertexId, self.id))
 
     def getMovement(self, upVertexId, downVertexId):
@@ -234,18 +405,16 @@ class Vertex(object):
         
     def hasOutEdge(self, vertexId):
 
-        return vertexId in [edge.endVertex.id for edge in self.iterOutEdges()]
+        return vertexId in self._outEdgesByVertexId
 
     def hasInEdge(self, vertexId):
 
-        return vertexId in [edge.startVertexId for edge in self.iterInEdges()]
+        return vertexId in self._inEdgesByVertexId
 
     def hasMovement(self, upVertexId, downVertexId):
         
-        for mov in self.iterMovements():
-            if mov.startVertexId == upVertexId and mov.vertexCid == downVertexId:
-                return True
-        return False 
+        iEdge = self._inEdgesByVertexId.get(upVertexId)
+        return iEdge is not None and iEdge.hasOutMovement(downVertexId)
 
     def iterMovements(self):
 
@@ -324,11 +493,11 @@ class Vertex(object):
 
     def isIncoming(self, edge):
 
-        return True if edge in self._incidentEdges else False
+        return self._inEdgesByVertexId.get(edge.startVertexId) is edge
 
     def isOutgoing(self, edge):
 
-        return True if edge in self._emanatingEdges else False 
+        return self._outEdgesByVertexId.get(edge.endVertexId) is edge
     
     def getOrientation(self, point):
 
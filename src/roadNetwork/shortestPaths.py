@@ -0,0 +1,978 @@
+__author__ = "Michail Xyntarakis"
+__company__ = "Parsons Brinckerhoff"
+__email__ = "xyntarakis@pbworld.com"
+__license__ = "GPL"
+
+from collections import deque
+from heapq import heappush, heappop
+from math import sqrt
+from multiprocessing import Pool
+
+import numpy as np
+
+from pbCore.utils.odict import OrderedDict
+
+from roadNetwork.csrGraph import _getOffsets
+from roadNetwork.errors import GraphError
+
+INFINITY = float('inf')
+DEFAULT_CACHE_SIZE = 32
+
+
+def _tracePredecessors(source, target, predecessors, tails):
+    """Return the positions of the arcs from the source to the target
+    following the predecessor arcs back from the target"""
+    positions = []
+    node = target
+    while node != source:
+        position = predecessors[node]
+        positions.append(position)
+        node = tails[position]
+    positions.reverse()
+    return positions
+
+
+class ShortestPathTree(object):
+    """The labels and predecessor arcs of a complete search from one
+    source. Unlike a search a tree is not changed by later searches"""
+
+    def __init__(self, source, labels, predecessors, heads, tails, arcIds):
+
+        self.source = source
+        self._labels = labels
+        self._predecessors = predecessors
+        self._heads = heads
+        self._tails = tails
+        self._arcIds = arcIds
+
+    def isReached(self, node):
+
+        return self._labels[node] < INFINITY
+
+    def getLabel(self, node):
+
+        return self._labels[node]
+
+    def _getArcPositions(self, target):
+
+        if not self.isReached(target):
+            raise GraphError("Node %d is not reachable from node %d" % 
+                             (target, self.source))
+        return _tracePredecessors(self.source, target, self._predecessors, self._tails)
+
+    def getArcPath(self, target):
+        """Return the ids of the arcs on the shortest path from the
+        source to the target"""
+        arcIds = self._arcIds
+        return [arcIds[i] for i in self._getArcPositions(target)]
+
+    def getNodePath(self, target):
+        """Return the nodes on the shortest path from the source to the
+        target including both"""
+        heads = self._heads
+        return [self.source] + [heads[i] for i in self._getArcPositions(target)]
+
+
+class DijkstraSearch(object):
+    """Binary heap Dijkstra over a graph in compressed sparse row form.
+    The arcs emanating from node n are the ones in the range offsets[n]:
+    offsets[n + 1]. Arc i ends at node heads[i], costs costs[i] and is
+    identified by arcIds[i] (its position if arcIds is None).
+
+    The label arrays are allocated once. Each search resets only the
+    labels the previous one touched, so many searches on the same
+    search object cost as much as the part of the graph they explore"""
+
+    def __init__(self, offsets, heads, costs, arcIds=None):
+
+        costs = np.asarray(costs, np.float64)
+        if len(costs) and costs.min() < 0:
+            raise GraphError("Dijkstra requires non negative arc costs")
+        offsets = np.asarray(offsets)
+
+        self.numNodes = len(offsets) - 1
+        #python lists are much faster than arrays to index one at a time
+        self._offsets = offsets.tolist()
+        self._heads = np.asarray(heads).tolist()
+        self._costs = costs.tolist()
+        self._tails = np.repeat(np.arange(self.numNodes), np.diff(offsets)).tolist()
+        if arcIds is None:
+            self._arcIds = range(len(self._heads))
+        else:
+            self._arcIds = np.asarray(arcIds).tolist()
+
+        self._labels = [INFINITY] * self.numNodes
+        self._predecessors = [-1] * self.numNodes    # the arc position
+        self._settled = [False] * self.numNodes
+        self._touched = []
+
+        self.source = None
+        self._isComplete = False    # True if the last search was not stopped
+
+    def _reset(self):
+
+        labels = self._labels
+        predecessors = self._predecessors
+        settled = self._settled
+        for node in self._touched:
+            labels[node] = INFINITY
+            predecessors[node] = -1
+            settled[node] = False
+        self._touched = []
+
+    def run(self, source, target=None, targets=None):
+        """Label the nodes reachable from the source. If a target (or a
+        list of targets) is given the search stops as soon as the target
+        (all the targets) is settled and only the labels of the settled
+        nodes are final"""
+        if not 0 <= source < self.numNodes:
+            raise GraphError("Node %d is not in the search graph" % source)
+        self._reset()
+
+        remaining = None
+        if target is not None:
+            remaining = set([target])
+        elif targets is not None:
+            remaining = set(targets)
+
+        offsets = self._offsets
+        heads = self._heads
+        costs = self._costs
+        labels = self._labels
+        predecessors = self._predecessors
+        settled = self._settled
+        touched = self._touched
+
+        push = heappush
+        pop = heappop
+
+        self._isComplete = False
+        labels[source] = 0.0
+        touched.append(source)
+        heap = [(0.0, source)]
+        while heap:
+            label, node = pop(heap)
+            if settled[node]:
+                continue
+            settled[node] = True
+            if remaining is not None and node in remaining:
+                remaining.discard(node)
+                if not remaining:
+                    break
+            for i in xrange(offsets[node], offsets[node + 1]):
+                head = heads[i]
+                newLabel = label + costs[i]
+                oldLabel = labels[head]
+                if newLabel < oldLabel:
+                    if oldLabel == INFINITY:
+                        touched.append(head)
+                    labels[head] = newLabel
+                    predecessors[head] = i
+                    push(heap, (newLabel, head))
+        else:
+            self._isComplete = True
+
+        self.source = source
+
+    def isSettled(self, node):
+
+        return self._settled[node]
+
+    def getLabel(self, node):
+        """Return the cost of the shortest path from the source to the
+        node or infinity if the node has not been reached"""
+        return self._labels[node]
+
+    def getLabels(self):
+        """Return an array with the label of every node"""
+        return np.array(self._labels, np.float64)
+
+    def _getArcPositions(self, target):
+
+        if self.source is None:
+            raise GraphError("The search has not been run")
+        if not self._settled[target]:
+            raise GraphError("Node %d has not been settled by the search from "
+                             "node %d" % (target, self.source))
+        return _tracePredecessors(self.source, target, self._predecessors, self._tails)
+
+    def getArcPath(self, target):
+        """Return the ids of the arcs on the shortest path from the
+        source to the target"""
+        arcIds = self._arcIds
+        return [arcIds[i] for i in self._getArcPositions(target)]
+
+    def getNodePath(self, target):
+        """Return the nodes on the shortest path from the source to the
+        target including both"""
+        heads = self._heads
+        return [self.source] + [heads[i] for i in self._getArcPositions(target)]
+
+    def getTree(self):
+        """Return a copy of the labels of the last search as a tree. The
+        search must have labelled all the reachable nodes"""
+        if self.source is None or not self._isComplete:
+            raise GraphError("The last search was stopped before labelling "
+                             "all the nodes")
+        return ShortestPathTree(self.source, list(self._labels), list(self._predecessors),
+                                self._heads, self._tails, self._arcIds)
+
+
+def getVertexSearch(csr, edgeCosts):
+    """Return a search whose nodes are the vertices and arcs the edges
+    of the input CSR snapshot. edgeCosts has one entry per edge"""
+    edgeCosts = np.asarray(edgeCosts, np.float64)
+    return DijkstraSearch(csr.outOffsets, csr.edgeEnd[csr.outEdges],
+                          edgeCosts[csr.outEdges], csr.outEdges)
+
+
+_workerSearch = None
+
+
+def _initWorker(search):
+    """Keep the search of the worker process. The search is sent once
+    to every worker instead of once per origin"""
+    global _workerSearch
+    _workerSearch = search
+
+
+def _searchFromOrigin(args):
+    """Return the labels of the destinations and optionally the arcs
+    of the paths to them. Executed by the worker processes of
+    getManyToMany"""
+    origin, destinations, withPaths = args
+    return _labelDestinations(_workerSearch, origin, destinations, withPaths)
+
+
+def _labelDestinations(search, origin, destinations, withPaths):
+
+    search.run(origin, targets=destinations)
+    costs = [search.getLabel(dest) for dest in destinations]
+    paths = None
+    if withPaths:
+        paths = [search.getArcPath(dest) if search.isSettled(dest) else None
+                 for dest in destinations]
+    return costs, paths
+
+
+def getManyToMany(search, origins, destinations, withPaths=False, numProcesses=1):
+    """Return a (numOrigins, numDestinations) array with the cost of the
+    shortest path between every origin and destination node (infinity if
+    there is no path) and, if withPaths is True, a list with the list of
+    arc ids of each of those paths (None if there is no path) in row major
+    order. One tree is built per distinct origin. If numProcesses is
+    greater than one the origins are distributed to a pool of worker
+    processes each holding a copy of the search"""
+
+    origins = list(origins)
+    destinations = list(destinations)
+    distinctOrigins = sorted(set(origins))
+    tasks = [(origin, destinations, withPaths) for origin in distinctOrigins]
+
+    if numProcesses > 1 and len(tasks) > 1:
+        pool = Pool(numProcesses, _initWorker, (search,))
+        try:
+            results = pool.map(_searchFromOrigin, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [_labelDestinations(search, *task) for task in tasks]
+
+    resultsByOrigin = dict(zip(distinctOrigins, results))
+    costs = np.array([resultsByOrigin[origin][0] for origin in origins], np.float64)
+    costs = costs.reshape(len(origins), len(destinations))
+    if not withPaths:
+        return costs
+    paths = [path for origin in origins for path in resultsByOrigin[origin][1]]
+    return costs, paths
+
+
+def _getMovementAdjacency(csr, allowUTurns):
+    """Return the offsets, heads and ids of the movements grouped by
+    their incident edge without the U-turns if they are not allowed"""
+    if allowUTurns:
+        return csr.movementOffsets, csr.movementOutEdge, np.arange(csr.numMovements)
+    #the movements stay grouped by incident edge after the U-turns are removed
+    movements = np.flatnonzero(~csr.movementIsUTurn)
+    offsets = _getOffsets(csr.movementInEdge[movements], csr.numEdges)
+    return offsets, csr.movementOutEdge[movements], movements
+
+
+def getMovementSearch(csr, edgeCosts, movementPenalties=None, allowUTurns=True):
+    """Return a search whose nodes are the edges and arcs the movements
+    of the input CSR snapshot. A movement costs as much as its emanating
+    edge plus its penalty so the label of an edge is the cost of the path
+    after the source edge up to and including the labelled one. If
+    allowUTurns is False the U-turn movements are not followed"""
+    edgeCosts = np.asarray(edgeCosts, np.float64)
+    costs = edgeCosts[csr.movementOutEdge]
+    if movementPenalties is not None:
+        costs = costs + movementPenalties
+    offsets, heads, movements = _getMovementAdjacency(csr, allowUTurns)
+    return DijkstraSearch(offsets, heads, costs[movements], movements)
+
+
+def getFreeFlowVertexSearch(csr):
+    """Return a vertex search with the free flow travel times as costs"""
+    return getVertexSearch(csr, csr.getFreeFlowTTsInMin())
+
+
+def getLengthMovementSearch(csr, allowUTurns=True):
+    """Return a movement search with the edge lengths in feet as costs"""
+    return getMovementSearch(csr, csr.lengthInFeet, allowUTurns=allowUTurns)
+
+
+def getFreeFlowMovementSearch(csr, allowUTurns=True, usePenalties=True):
+    """Return a movement search with the free flow travel times in 
+    minutes as costs. If usePenalties is True the penalty in minutes 
+    of every movement is added to its cost"""
+    return getMovementSearch(csr, csr.getFreeFlowTTsInMin(),
+                             csr.movementPenalty if usePenalties else None,
+                             allowUTurns)
+
+
+class PointToPointSearch(object):
+    """Shortest paths between two vertices of a CSR snapshot by A* or by
+    bidirectional Dijkstra. Both stop as soon as the path is known and
+    label only the vertices near it.
+
+    The A* heuristic of a vertex is its straight line distance from the
+    target in feet times the least cost per foot of straight line
+    distance over all the edges. It never overestimates and is
+    consistent for any non negative costs. For free flow travel times
+    the least cost per foot is that of the fastest edge"""
+
+    def __init__(self, csr, edgeCosts):
+
+        edgeCosts = np.asarray(edgeCosts, np.float64)
+        if len(edgeCosts) and edgeCosts.min() < 0:
+            raise GraphError("Shortest path searches require non negative edge costs")
+
+        self.numNodes = csr.numVertices
+        self._x = [vertex.x for vertex in csr.vertices]
+        self._y = [vertex.y for vertex in csr.vertices]
+
+        x = np.array(self._x, np.float64)
+        y = np.array(self._y, np.float64)
+        distances = np.hypot(x[csr.edgeEnd] - x[csr.edgeStart],
+                             y[csr.edgeEnd] - y[csr.edgeStart])
+        positive = distances > 0
+        self.costPerFoot = (edgeCosts[positive] / distances[positive]).min() \
+            if positive.any() else 0.0
+
+        self._offsets = csr.outOffsets.tolist()
+        self._edges = csr.outEdges.tolist()
+        self._heads = csr.edgeEnd[csr.outEdges].tolist()
+        self._costs = edgeCosts[csr.outEdges].tolist()
+        self._tails = np.repeat(np.arange(self.numNodes), np.diff(csr.outOffsets)).tolist()
+
+        #the backward arcs go from the end to the start of the edges
+        self._inOffsets = csr.inOffsets.tolist()
+        self._inEdges = csr.inEdges.tolist()
+        self._inHeads = csr.edgeStart[csr.inEdges].tolist()
+        self._inCosts = edgeCosts[csr.inEdges].tolist()
+        self._inTails = np.repeat(np.arange(self.numNodes), np.diff(csr.inOffsets)).tolist()
+
+        self._labels = [INFINITY] * self.numNodes
+        self._predecessors = [-1] * self.numNodes
+        self._inLabels = [INFINITY] * self.numNodes
+        self._inPredecessors = [-1] * self.numNodes
+        self._touched = []
+
+        self.numSettled = 0         # the vertices settled by the last search
+
+    def _reset(self):
+
+        for node in self._touched:
+            self._labels[node] = INFINITY
+            self._predecessors[node] = -1
+            self._inLabels[node] = INFINITY
+            self._inPredecessors[node] = -1
+        self._touched = []
+        self.numSettled = 0
+
+    def _checkNodes(self, source, target):
+
+        for node in (source, target):
+            if not 0 <= node < self.numNodes:
+                raise GraphError("Node %d is not in the search graph" % node)
+
+    def _getForwardEdges(self, node):
+
+        edges = self._edges
+        return [edges[i] for i in _tracePredecessors(self.source, node,
+                                                     self._predecessors, self._tails)]
+
+    def getAStarPath(self, source, target):
+        """Return the cost and the edge indices of the shortest path from
+        the source to the target vertex found by A*. Raise GraphError if
+        there is no path"""
+        self._checkNodes(source, target)
+        self._reset()
+        self.source = source
+
+        offsets = self._offsets
+        heads = self._heads
+        costs = self._costs
+        labels = self._labels
+        predecessors = self._predecessors
+        touched = self._touched
+        x = self._x
+        y = self._y
+        targetX = x[target]
+        targetY = y[target]
+        costPerFoot = self.costPerFoot
+
+        labels[source] = 0.0
+        touched.append(source)
+        heap = [(0.0, 0.0, source)]
+        while heap:
+            estimate, label, node = heappop(heap)
+            if label > labels[node]:
+                continue
+            self.numSettled += 1
+            if node == target:
+                return label, self._getForwardEdges(target)
+            for i in xrange(offsets[node], offsets[node + 1]):
+                head = heads[i]
+                newLabel = label + costs[i]
+                oldLabel = labels[head]
+                if newLabel < oldLabel:
+                    if oldLabel == INFINITY:
+                        touched.append(head)
+                    labels[head] = newLabel
+                    predecessors[head] = i
+                    heuristic = costPerFoot * sqrt((x[head] - targetX) ** 2 +
+                                                   (y[head] - targetY) ** 2)
+                    heappush(heap, (newLabel + heuristic, newLabel, head))
+
+        raise GraphError("Node %d is not reachable from node %d" % (target, source))
+
+    def getBidirectionalPath(self, source, target):
+        """Return the cost and the edge indices of the shortest path from
+        the source to the target vertex found by searching forward from
+        the source and backward from the target until the two searches
+        meet. Raise GraphError if there is no path"""
+        self._checkNodes(source, target)
+        self._reset()
+        self.source = source
+
+        touched = self._touched
+        sides = [(self._offsets, self._heads, self._costs, self._labels,
+                  self._predecessors, self._inLabels),
+                 (self._inOffsets, self._inHeads, self._inCosts, self._inLabels,
+                  self._inPredecessors, self._labels)]
+
+        self._labels[source] = 0.0
+        self._inLabels[target] = 0.0
+        touched.extend([source, target])
+        heaps = [[(0.0, source)], [(0.0, target)]]
+
+        best = 0.0 if source == target else INFINITY
+        meeting = source
+        while heaps[0] and heaps[1]:
+            if heaps[0][0][0] + heaps[1][0][0] >= best:
+                break
+            #expand the side with the smaller label
+            side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+            offsets, heads, costs, labels, predecessors, otherLabels = sides[side]
+            heap = heaps[side]
+
+            label, node = heappop(heap)
+            if label > labels[node]:
+                continue
+            self.numSettled += 1
+            for i in xrange(offsets[node], offsets[node + 1]):
+                head = heads[i]
+                newLabel = label + costs[i]
+                if newLabel < labels[head]:
+                    touched.append(head)
+                    labels[head] = newLabel
+                    predecessors[head] = i
+                    heappush(heap, (newLabel, head))
+                    if newLabel + otherLabels[head] < best:
+                        best = newLabel + otherLabels[head]
+                        meeting = head
+
+        if best == INFINITY:
+            raise GraphError("Node %d is not reachable from node %d" % (target, source))
+
+        edges = self._getForwardEdges(meeting)
+        node = meeting
+        while node != target:
+            i = self._inPredecessors[node]
+            edges.append(self._inEdges[i])
+            node = self._inTails[i]
+        return best, edges
+
+
+def getFreeFlowPointToPointSearch(csr):
+    """Return a point to point search with the free flow travel times
+    as costs"""
+    return PointToPointSearch(csr, csr.getFreeFlowTTsInMin())
+
+
+class ShortestPathTreeCache(object):
+    """Least recently used cache of the shortest path trees of a graph
+    keyed by the source, the cost function and the cost version of the
+    graph. A cost function takes a CSR snapshot (and optionally more
+    arguments) and returns a search over it (e.g. getFreeFlowVertexSearch).
+    All the trees are discarded when the cost version of the graph changes"""
+
+    def __init__(self, graph, maxTrees=DEFAULT_CACHE_SIZE):
+
+        if maxTrees < 1:
+            raise GraphError("The cache should hold at least one tree")
+        self._graph = graph
+        self.maxTrees = maxTrees
+        self._trees = OrderedDict()     # from the least to the most recently used
+        self._searches = {}             # (cost function, args) to search
+        self._costVersion = None
+        self.numHits = 0
+        self.numMisses = 0
+
+    def __len__(self):
+
+        return len(self._trees)
+
+    def clear(self):
+
+        self._trees.clear()
+        self._searches.clear()
+
+    def _checkCostVersion(self):
+
+        costVersion = self._graph.getCostVersion()
+        if costVersion != self._costVersion:
+            self.clear()
+            self._costVersion = costVersion
+        return costVersion
+
+    def getSearch(self, costFunction, *args):
+        """Return the search costFunction(csr, *args) returns for the
+        current snapshot of the graph. The search is built once per cost
+        version"""
+        self._checkCostVersion()
+        search = self._searches.get((costFunction, args))
+        if search is None:
+            search = costFunction(self._graph.getCSR(), *args)
+            self._searches[costFunction, args] = search
+        return search
+
+    def getTree(self, source, costFunction, *args):
+        """Return the tree of the source node in the search returned by
+        costFunction(csr, *args)"""
+        costVersion = self._checkCostVersion()
+
+        key = (source, costFunction, args, costVersion)
+        if key in self._trees:
+            self.numHits += 1
+            tree = self._trees.pop(key)
+            self._trees[key] = tree
+            return tree
+
+        self.numMisses += 1
+        search = self.getSearch(costFunction, *args)
+        search.run(source)
+        tree = search.getTree()
+        self._trees[key] = tree
+        while len(self._trees) > self.maxTrees:
+            del self._trees[iter(self._trees).next()]
+        return tree
+
+
+class DynamicShortestPathTree(object):
+    """A shortest path tree from one source that is repaired instead of
+    recomputed when arcs are added, deleted or change cost. Nodes can be
+    any hashable ids (e.g. vertex ids) so that the tree survives changes
+    of the graph topology. Changes are recorded by setArcCost, deleteArc
+    and deleteNode and applied by update. Only the nodes whose label
+    depends on a changed arc are relabelled"""
+
+    def __init__(self, source, arcs):
+
+        self.source = source
+        self._outArcs = {source: {}}    # tail to head to cost
+        self._inArcs = {source: {}}     # head to tail to cost
+        self._labels = {}
+        self._predecessors = {}         # node to the tail of its tree arc
+        self._children = {}             # node to the heads of its tree arcs
+        self._increased = set()         # tree arcs that became more expensive
+        self._decreased = set()         # arcs that became cheaper
+
+        for tail, head, cost in arcs:
+            self._addNode(tail)
+            self._addNode(head)
+            self._checkCost(cost)
+            self._outArcs[tail][head] = cost
+            self._inArcs[head][tail] = cost
+
+        self._labels[source] = 0.0
+        self._propagate([(0.0, source)])
+
+    def _addNode(self, node):
+
+        if node not in self._outArcs:
+            self._outArcs[node] = {}
+            self._inArcs[node] = {}
+
+    def _checkCost(self, cost):
+
+        if cost < 0:
+            raise GraphError("Shortest path trees require non negative arc costs")
+
+    def hasArc(self, tail, head):
+
+        return tail in self._outArcs and head in self._outArcs[tail]
+
+    def setArcCost(self, tail, head, cost):
+        """Add the arc or change its cost"""
+        self._checkCost(cost)
+        self._addNode(tail)
+        self._addNode(head)
+        oldCost = self._outArcs[tail].get(head, INFINITY)
+        self._outArcs[tail][head] = cost
+        self._inArcs[head][tail] = cost
+        if cost < oldCost:
+            self._decreased.add((tail, head))
+        elif cost > oldCost and self._predecessors.get(head) == tail:
+            self._increased.add(head)
+
+    def deleteArc(self, tail, head):
+
+        if not self.hasArc(tail, head):
+            raise GraphError("There is no arc from %s to %s" % (tail, head))
+        del self._outArcs[tail][head]
+        del self._inArcs[head][tail]
+        self._decreased.discard((tail, head))
+        if self._predecessors.get(head) == tail:
+            self._increased.add(head)
+
+    def deleteNode(self, node):
+        """Delete the node and all its arcs"""
+        if node == self.source:
+            raise GraphError("The source of the tree cannot be deleted")
+        if node not in self._outArcs:
+            raise GraphError("Node %s is not in the tree" % str(node))
+        for head in self._outArcs[node].keys():
+            self.deleteArc(node, head)
+        for tail in self._inArcs[node].keys():
+            self.deleteArc(tail, node)
+        self._increased.discard(node)
+        self._detach(node)
+        for child in self._children.pop(node, ()):
+            del self._predecessors[child]
+        self._labels.pop(node, None)
+        del self._outArcs[node]
+        del self._inArcs[node]
+
+    def _detach(self, node):
+        """Remove the tree arc of the node"""
+        predecessor = self._predecessors.pop(node, None)
+        if predecessor is not None:
+            self._children[predecessor].discard(node)
+
+    def _setPredecessor(self, node, predecessor):
+
+        self._detach(node)
+        self._predecessors[node] = predecessor
+        self._children.setdefault(predecessor, set()).add(node)
+
+    def update(self):
+        """Repair the tree after the recorded changes. Return the set of
+        nodes whose label or tree arc was reset"""
+        labels = self._labels
+
+        #the subtrees below more expensive tree arcs lose their labels
+        affected = set()
+        stack = list(self._increased)
+        while stack:
+            node = stack.pop()
+            if node in affected:
+                continue
+            affected.add(node)
+            stack.extend(self._children.get(node, ()))
+        for node in affected:
+            labels.pop(node, None)
+            self._detach(node)
+
+        #and are labelled again from their unaffected predecessors
+        heap = []
+        for node in affected:
+            best = INFINITY
+            bestTail = None
+            for tail, cost in self._inArcs[node].iteritems():
+                label = labels.get(tail, INFINITY) + cost
+                if label < best:
+                    best = label
+                    bestTail = tail
+            if bestTail is not None:
+                labels[node] = best
+                self._setPredecessor(node, bestTail)
+                heap.append((best, node))
+
+        for tail, head in self._decreased:
+            label = labels.get(tail, INFINITY) + self._outArcs[tail][head]
+            if label < labels.get(head, INFINITY):
+                labels[head] = label
+                self._setPredecessor(head, tail)
+                heap.append((label, head))
+                affected.add(head)
+
+        self._increased.clear()
+        self._decreased.clear()
+        heap.sort()
+        affected.update(self._propagate(heap))
+        return affected
+
+    def _propagate(self, heap):
+        """Run Dijkstra from the labelled nodes in the heap and return
+        the nodes that were relabelled"""
+        labels = self._labels
+        outArcs = self._outArcs
+        relabelled = set()
+        while heap:
+            label, node = heappop(heap)
+            if label > labels[node]:
+                continue
+            for head, cost in outArcs[node].iteritems():
+                newLabel = label + cost
+                if newLabel < labels.get(head, INFINITY):
+                    labels[head] = newLabel
+                    self._setPredecessor(head, node)
+                    relabelled.add(head)
+                    heappush(heap, (newLabel, head))
+        return relabelled
+
+    def isReached(self, node):
+
+        return node in self._labels
+
+    def getLabel(self, node):
+        """Return the cost of the shortest path from the source to the
+        node or infinity if the node is not reachable"""
+        return self._labels.get(node, INFINITY)
+
+    def getNodePath(self, target):
+        """Return the nodes on the shortest path from the source to the
+        target including both"""
+        if self._increased or self._decreased:
+            raise GraphError("The tree has changes that have not been applied")
+        if target not in self._labels:
+            raise GraphError("Node %s is not reachable from node %s" %
+                             (str(target), str(self.source)))
+        nodes = [target]
+        while nodes[-1] != self.source:
+            nodes.append(self._predecessors[nodes[-1]])
+        nodes.reverse()
+        return nodes
+
+
+def getFreeFlowDynamicTree(graph, sourceVertexId):
+    """Return a dynamic tree of the free flow travel time shortest paths
+    from the source vertex with the vertex ids as nodes"""
+    csr = graph.getCSR()
+    if sourceVertexId not in csr.vertexIndex:
+        raise GraphError("Vertex %s not in the graph" % sourceVertexId)
+    return DynamicShortestPathTree(sourceVertexId,
+        ((edge.startVertexId, edge.endVertexId, cost) for edge, cost in
+         zip(csr.edges, csr.getFreeFlowTTsInMin().tolist())))
+
+
+def updateFreeFlowDynamicTree(tree, graph, edgeIds):
+    """Repair the tree after the edges with the input (startVertexId,
+    endVertexId) ids were added, deleted or changed in the graph. Return
+    the set of the vertex ids whose shortest path changed"""
+    for startVertexId, endVertexId in edgeIds:
+        if graph.hasEdge(startVertexId, endVertexId):
+            edge = graph.getEdge(startVertexId, endVertexId)
+            tree.setArcCost(startVertexId, endVertexId, edge.getFreeFlowTTInMin())
+        elif tree.hasArc(startVertexId, endVertexId):
+            tree.deleteArc(startVertexId, endVertexId)
+    return tree.update()
+
+
+class TimeDependentSearch(object):
+    """Time dependent label setting over the edges and movements of a
+    CSR snapshot. costs[m, k] is the time in minutes needed to go from
+    the start of the incident edge of movement m to the start of its
+    emanating edge when departing in interval k. Interval k starts at
+    startTimeInMin + k * timeStepInMin and the last interval extends
+    to infinity. The label of an edge is the earliest time it can be
+    entered.
+
+    Vehicles may wait at the start of an edge so that departing later
+    never arrives earlier (the FIFO property). Label setting is then
+    exact for a single departure time. All the departure times of one
+    origin are labelled together by a label correcting sweep over
+    vectors of arrival times"""
+
+    def __init__(self, csr, costs, startTimeInMin, timeStepInMin, allowUTurns=True):
+
+        costs = np.asarray(costs, np.float64)
+        if costs.shape[0] != csr.numMovements:
+            raise GraphError("There should be one row of costs per movement")
+        if costs.size and costs.min() < 0:
+            raise GraphError("Time dependent costs cannot be negative")
+
+        offsets, heads, movements = _getMovementAdjacency(csr, allowUTurns)
+        self.numNodes = csr.numEdges
+        self.startTimeInMin = startTimeInMin
+        self.timeStepInMin = float(timeStepInMin)
+        self.numIntervals = costs.shape[1]
+
+        #earliest arrival when waiting for one of the later intervals
+        departures = startTimeInMin + np.arange(self.numIntervals) * self.timeStepInMin
+        arrivals = departures + costs[movements]
+        waitArrivals = np.empty_like(arrivals)
+        waitArrivals[:, -1] = INFINITY
+        if self.numIntervals > 1:
+            waitArrivals[:, :-1] = np.minimum.accumulate(
+                arrivals[:, :0:-1], axis=1)[:, ::-1]
+
+        self._offsets = np.asarray(offsets)
+        self._heads = np.asarray(heads)
+        self._movements = np.asarray(movements)
+        self._tails = np.repeat(np.arange(self.numNodes), np.diff(offsets))
+        self._costs = costs[movements]
+        self._waitArrivals = waitArrivals
+
+        self.source = None
+        self._labels = None
+        self._predecessors = None       # arc positions
+        self._departureTimes = None
+
+    def _getInterval(self, timeInMin):
+
+        interval = int((timeInMin - self.startTimeInMin) // self.timeStepInMin)
+        return min(max(interval, 0), self.numIntervals - 1)
+
+    def getArrivalTimes(self, arc, timesInMin):
+        """Return the times the emanating edge of the arc in the input
+        position is entered if its incident edge is entered at the
+        input times"""
+        reached = np.isfinite(timesInMin)
+        times = np.where(reached, timesInMin, self.startTimeInMin)
+        intervals = np.floor((times - self.startTimeInMin) /
+                             self.timeStepInMin).astype(int)
+        np.clip(intervals, 0, self.numIntervals - 1, intervals)
+        arrivals = np.minimum(times + self._costs[arc, intervals],
+                              self._waitArrivals[arc, intervals])
+        arrivals[~reached] = INFINITY
+        return arrivals
+
+    def run(self, source, departureTimeInMin, target=None):
+        """Label the edges reachable from the source edge entered at the
+        input time. If a target is given the search stops as soon as
+        the target is settled"""
+        if not 0 <= source < self.numNodes:
+            raise GraphError("Node %d is not in the search graph" % source)
+
+        offsets = self._offsets.tolist()
+        heads = self._heads.tolist()
+        labels = [INFINITY] * self.numNodes
+        predecessors = [-1] * self.numNodes
+        settled = [False] * self.numNodes
+
+        labels[source] = departureTimeInMin
+        heap = [(departureTimeInMin, source)]
+        while heap:
+            label, node = heappop(heap)
+            if settled[node]:
+                continue
+            settled[node] = True
+            if node == target:
+                break
+            interval = self._getInterval(label)
+            for i in xrange(offsets[node], offsets[node + 1]):
+                head = heads[i]
+                newLabel = min(label + self._costs[i, interval],
+                               self._waitArrivals[i, interval])
+                if newLabel < labels[head]:
+                    labels[head] = newLabel
+                    predecessors[head] = i
+                    heappush(heap, (newLabel, head))
+
+        self.source = source
+        self._departureTimes = np.array([departureTimeInMin], np.float64)
+        self._labels = np.array(labels, np.float64)[:, np.newaxis]
+        self._predecessors = np.array(predecessors)[:, np.newaxis]
+        self._settled = np.array(settled)
+
+    def runAllDepartureTimes(self, source, departureTimesInMin):
+        """Label the edges reachable from the source edge for each of
+        the input departure times in a single sweep"""
+        if not 0 <= source < self.numNodes:
+            raise GraphError("Node %d is not in the search graph" % source)
+
+        departureTimes = np.asarray(departureTimesInMin, np.float64)
+        offsets = self._offsets.tolist()
+        heads = self._heads.tolist()
+        labels = np.empty((self.numNodes, len(departureTimes)), np.float64)
+        labels.fill(INFINITY)
+        predecessors = np.empty(labels.shape, int)
+        predecessors.fill(-1)
+
+        labels[source] = departureTimes
+        queue = deque([source])
+        inQueue = np.zeros(self.numNodes, bool)
+        inQueue[source] = True
+        while queue:
+            node = queue.popleft()
+            inQueue[node] = False
+            nodeLabels = labels[node]
+            for i in xrange(offsets[node], offsets[node + 1]):
+                head = heads[i]
+                newLabels = self.getArrivalTimes(i, nodeLabels)
+                improved = newLabels < labels[head]
+                if improved.any():
+                    labels[head, improved] = newLabels[improved]
+                    predecessors[head, improved] = i
+                    if not inQueue[head]:
+                        inQueue[head] = True
+                        queue.append(head)
+
+        self.source = source
+        self._departureTimes = departureTimes
+        self._labels = labels
+        self._predecessors = predecessors
+        self._settled = np.isfinite(labels).any(axis=1)
+
+    def getLabels(self):
+        """Return a (numEdges, numDepartureTimes) array with the time
+        each edge is entered for each departure time of the last run"""
+        return self._labels
+
+    def getArrivalTimeInMin(self, target, departure=0):
+        """Return the time the target is entered for the departure time
+        with the input position"""
+        return self._labels[target, departure]
+
+    def _getArcPositions(self, target, departure):
+
+        if self.source is None:
+            raise GraphError("The search has not been run")
+        if not self._settled[target] or self._labels[target, departure] == INFINITY:
+            raise GraphError("Node %d has not been settled by the search from "
+                             "node %d" % (target, self.source))
+        positions = []
+        node = target
+        while node != self.source:
+            position = self._predecessors[node, departure]
+            positions.append(position)
+            node = self._tails[position]
+        positions.reverse()
+        return positions
+
+    def getArcPath(self, target, departure=0):
+        """Return the movements on the time dependent shortest path from
+        the source to the target for the departure time with the input
+        position"""
+        return [self._movements[i] for i in self._getArcPositions(target, departure)]
+
+    def getNodePath(self, target, departure=0):
+        """Return the edges on the time dependent shortest path from the
+        source to the target including both"""
+        return [self.source] + [self._heads[i] for i in
+                                self._getArcPositions(target, departure)]
@@ -0,0 +1,216 @@
+__author__ = "Michail Xyntarakis"
+__company__ = "Parsons Brinckerhoff"
+__email__ = "xyntarakis@pbworld.com"
+__license__ = "GPL"
+
+from collections import deque
+import hashlib
+from itertools import islice, izip
+from multiprocessing import Pool
+import os
+
+import numpy as np
+
+from roadNetwork.errors import SimError
+
+LINES_PER_CHUNK = 100000
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def parseLines(lines, numIdFields, separator=None):
+    """Parse lines that start with numIdFields identifiers followed by
+    the same number of numeric values. Return the identifiers as a list
+    of tuples and the values as a 2D array with one row per line"""
+
+    ids = []
+    valueFields = []
+    for line in lines:
+        fields = line.strip().split(separator, numIdFields)
+        if len(fields) <= numIdFields:
+            if not line.strip():
+                continue
+            raise SimError("Line '%s' does not contain any values" % line.strip())
+        ids.append(tuple(fields[:numIdFields]))
+        valueFields.append(fields[numIdFields])
+
+    if not ids:
+        return ids, np.zeros((0, 0))
+
+    numValues = len(valueFields[0].split(separator))
+    values = np.fromstring((separator or " ").join(valueFields), dtype=np.float64,
+                           sep=separator or " ")
+
+    if values.size != len(ids) * numValues:
+        raise SimError("The lines starting from %s do not all have %d "
+                       "numeric values" % (" ".join(ids[0]), numValues))
+
+    return ids, values.reshape(len(ids), numValues)
+
+
+def iterChunks(fileName, numIdFields, separator=None, hasHeader=False,
+               linesPerChunk=LINES_PER_CHUNK):
+    """Read the file in chunks of linesPerChunk lines and return an
+    iterator to the parsed chunks. See parseLines"""
+
+    inputStream = open(fileName, 'r')
+    try:
+        if hasHeader:
+            inputStream.next()
+
+        while True:
+            lines = list(islice(inputStream, linesPerChunk))
+            if not lines:
+                break
+            yield parseLines(lines, numIdFields, separator)
+    finally:
+        inputStream.close()
+
+
+def getChunkOffsets(fileName, numChunks, hasHeader=False):
+    """Split the file in (at most) numChunks byte ranges of about
+    equal size that begin and end on line boundaries. Return the 
+    offsets delimiting the ranges"""
+
+    fileSize = os.path.getsize(fileName)
+    inputStream = open(fileName, 'rb')
+    try:
+        if hasHeader:
+            inputStream.readline()
+        offsets = [inputStream.tell()]
+
+        for i in range(1, numChunks):
+            position = offsets[0] + (fileSize - offsets[0]) * i // numChunks
+            if position <= offsets[-1]:
+                continue
+            inputStream.seek(position - 1)
+            inputStream.readline()
+            if inputStream.tell() >= fileSize:
+                break
+            if inputStream.tell() > offsets[-1]:
+                offsets.append(inputStream.tell())
+    finally:
+        inputStream.close()
+
+    offsets.append(fileSize)
+    return offsets
+
+
+def getLineOffsets(fileName, linesPerChunk, hasHeader=False):
+    """Return the byte offsets of every linesPerChunk-th line of the 
+    file so that the ranges between consecutive offsets hold 
+    linesPerChunk lines (the last one possibly fewer)"""
+
+    inputStream = open(fileName, 'rb')
+    try:
+        if hasHeader:
+            inputStream.readline()
+        offsets = [inputStream.tell()]
+        position = offsets[0]
+        numLines = 0
+        for line in inputStream:
+            position += len(line)
+            numLines += 1
+            if numLines == linesPerChunk:
+                offsets.append(position)
+                numLines = 0
+        if numLines:
+            offsets.append(position)
+    finally:
+        inputStream.close()
+
+    return offsets
+
+
+def _parseByteRange(args):
+    """Parse the lines in the input byte range of a file. Executed by
+    the worker processes of readIdsAndValues"""
+    fileName, startOffset, endOffset, numIdFields, separator = args
+
+    inputStream = open(fileName, 'rb')
+    try:
+        inputStream.seek(startOffset)
+        lines = inputStream.read(endOffset - startOffset).splitlines()
+    finally:
+        inputStream.close()
+
+    return parseLines(lines, numIdFields, separator)
+
+
+def readIdsAndValues(fileName, numIdFields, separator=None, hasHeader=False,
+                     numProcesses=1):
+    """Parse the whole file (see parseLines). If numProcesses is greater
+    than one the file is split on line boundaries and the pieces are 
+    parsed in parallel by a pool of numProcesses worker processes"""
+
+    if numProcesses > 1:
+        offsets = getChunkOffsets(fileName, numProcesses, hasHeader)
+        tasks = [(fileName, start, end, numIdFields, separator) 
+                 for start, end in zip(offsets[:-1], offsets[1:])]
+        pool = Pool(numProcesses)
+        try:
+            chunks = pool.map(_parseByteRange, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        chunks = list(iterChunks(fileName, numIdFields, separator, hasHeader))
+
+    chunks = [(ids, values) for ids, values in chunks if ids]
+    if not chunks:
+        return [], np.zeros((0, 0))
+
+    numValues = set(values.shape[1] for ids, values in chunks)
+    if len(numValues) > 1:
+        raise SimError("The lines of %s do not all have the same number of "
+                       "values" % fileName)
+
+    ids = []
+    for chunkIds, values in chunks:
+        ids.extend(chunkIds)
+    return ids, np.vstack([values for chunkIds, values in chunks])
+
+
+def iterParallelChunks(fileNames, numIdFields, separator=None, hasHeader=False,
+                       linesPerChunk=LINES_PER_CHUNK, numProcesses=2):
+    """Read the files in chunks of linesPerChunk lines parsed by a pool
+    of numProcesses worker processes. Return an iterator to tuples with
+    the parsed chunks (see parseLines) of the same lines of every file,
+    in the order of the lines. Only numProcesses chunks of every file 
+    are parsed ahead of the consumer so memory stays bounded by the 
+    chunk size"""
+
+    fileTaskLists = []
+    for fileName in fileNames:
+        offsets = getLineOffsets(fileName, linesPerChunk, hasHeader)
+        fileTaskLists.append([(fileName, start, end, numIdFields, separator)
+                              for start, end in zip(offsets[:-1], offsets[1:])])
+    tasks = izip(*fileTaskLists)
+
+    pool = Pool(numProcesses)
+    try:
+        pending = deque()
+        for fileTasks in islice(tasks, numProcesses):
+            pending.append([pool.apply_async(_parseByteRange, (task,)) for task in fileTasks])
+        while pending:
+            results = pending.popleft()
+            for fileTasks in islice(tasks, 1):
+                pending.append([pool.apply_async(_parseByteRange, (task,)) 
+                                for task in fileTasks])
+            yield tuple(result.get() for result in results)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def hashFiles(fileNames):
+    """Return the hex digest of the contents of the input files"""
+
+    digest = hashlib.sha1()
+    for fileName in fileNames:
+        inputStream = open(fileName, 'rb')
+        try:
+            for block in iter(lambda: inputStream.read(HASH_BLOCK_SIZE), ''):
+                digest.update(block)
+        finally:
+            inputStream.close()
+    return digest.hexdigest()
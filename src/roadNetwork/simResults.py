@@ -0,0 +1,425 @@
+__author__ = "Michail Xyntarakis"
+__company__ = "Parsons Brinckerhoff"
+__email__ = "xyntarakis@pbworld.com"
+__license__ = "GPL"
+
+import os
+
+import numpy as np
+
+from roadNetwork.errors import SimError
+
+
+class SimResults(object):
+    """Columnar store of the simulated volumes and mean travel times
+    of a set of network elements (movements or edges). Every element
+    owns a row and every simulation time step a column. Each quantity
+    is kept in one contiguous array so that network wide aggregations
+    are single array operations.
+
+    Cumulative (prefix sum) arrays of the volume, the volume times the
+    mean travel time and the number of time steps with a volume but no
+    travel time (or vice versa) are maintained lazily so that the totals
+    of any time window are computed with two lookups.
+
+    The volume and travel time arrays can be backed by memory mapped
+    .npy files (see mapToFiles) so that results larger than the
+    available memory are paged in only when accessed. Such stores do 
+    not keep the cumulative arrays: queries compute them block by block
+    for the rows they touch only"""
+
+    VOLUME_DTYPE = np.float32
+    TT_DTYPE = np.float64
+    INITIAL_CAPACITY = 64
+    CUMULATIVE_BLOCK_SIZE = 4096
+
+    def __init__(self, simStartTimeInMin, simEndTimeInMin, simTimeStepInMin,
+                 capacity=INITIAL_CAPACITY):
+
+        if simEndTimeInMin <= simStartTimeInMin:
+            raise SimError("The simulation end time %d must be greater than "
+                           "the simulation start time %d" %
+                           (simEndTimeInMin, simStartTimeInMin))
+
+        if (simEndTimeInMin - simStartTimeInMin) % simTimeStepInMin != 0:
+            raise SimError("The simulation period from %d to %d is not a "
+                           "multiple of the simulation time step %d" %
+                           (simStartTimeInMin, simEndTimeInMin,
+                            simTimeStepInMin))
+
+        self.simStartTimeInMin = simStartTimeInMin
+        self.simEndTimeInMin = simEndTimeInMin
+        self.simTimeStepInMin = simTimeStepInMin
+        self.numTimeSteps = (simEndTimeInMin - simStartTimeInMin) // simTimeStepInMin
+
+        self._directory = None      # the directory of the memory mapped files
+        self._volume = np.zeros((capacity, self.numTimeSteps), self.VOLUME_DTYPE)
+        self._meanTT = np.zeros((capacity, self.numTimeSteps), self.TT_DTYPE)
+        self._allocateCumulative(capacity)
+
+        self._numRows = 0
+        self._freeRows = []         # the released rows in the order they are reused
+        self._freeRowSet = set()
+
+    def __len__(self):
+
+        return self._numRows
+
+    def _allocateCumulative(self, capacity):
+        """Allocate the cumulative arrays. No row has valid cumulative
+        values after the allocation. Stores backed by files do not keep
+        cumulative arrays"""
+        self._hasCumulative = np.zeros(capacity, np.bool_)
+        if self.isMemoryMapped():
+            self._cumVolume = None
+            self._cumVolumeTT = None
+            self._cumInconsistent = None
+            return
+        self._cumVolume = np.zeros((capacity, self.numTimeSteps + 1), np.float64)
+        self._cumVolumeTT = np.zeros((capacity, self.numTimeSteps + 1), np.float64)
+        self._cumInconsistent = np.zeros((capacity, self.numTimeSteps + 1), np.int32)
+
+    def _getFileName(self, name):
+
+        return os.path.join(self._directory, name + '.npy')
+
+    def _newArray(self, name, shape, dtype):
+        """Return a new array filled with zeros. If the store is backed 
+        by files the array is mapped to a temporary file that replaces
+        the file of the array when _replaceFiles is called"""
+        if self._directory is None:
+            return np.zeros(shape, dtype)
+        return np.lib.format.open_memmap(self._getFileName(name) + '.tmp', 'w+',
+                                         dtype, shape)
+
+    def _replaceFiles(self):
+        """Move the temporary files created by _newArray in place"""
+        if self._directory is None:
+            return
+        for name in ('volume', 'meanTT'):
+            getattr(self, '_' + name).flush()
+            os.rename(self._getFileName(name) + '.tmp', self._getFileName(name))
+
+    def _grow(self):
+        """Double the number of rows the arrays can hold"""
+        capacity = max(2 * self._volume.shape[0], self.INITIAL_CAPACITY)
+
+        volume = self._newArray('volume', (capacity, self.numTimeSteps), self.VOLUME_DTYPE)
+        volume[:self._numRows] = self._volume[:self._numRows]
+        meanTT = self._newArray('meanTT', (capacity, self.numTimeSteps), self.TT_DTYPE)
+        meanTT[:self._numRows] = self._meanTT[:self._numRows]
+
+        self._volume = volume
+        self._meanTT = meanTT
+        self._replaceFiles()
+
+        hasCumulative = self._hasCumulative
+        cumulative = (self._cumVolume, self._cumVolumeTT, self._cumInconsistent)
+        self._allocateCumulative(capacity)
+        if self._cumVolume is None or cumulative[0] is None:
+            return
+        self._hasCumulative[:len(hasCumulative)] = hasCumulative
+        for old, new in zip(cumulative, (self._cumVolume, self._cumVolumeTT, 
+                                         self._cumInconsistent)):
+            new[:len(old)] = old
+
+    def _updateCumulative(self, rows=None):
+        """Recompute the cumulative arrays of the input rows that have
+        been modified. By default all the modified rows are updated"""
+        if rows is None:
+            rows = np.flatnonzero(~self._hasCumulative[:self._numRows])
+        else:
+            rows = np.asarray(rows, np.intp).reshape(-1)
+            rows = rows[~self._hasCumulative[rows]]
+
+        for i in range(0, len(rows), self.CUMULATIVE_BLOCK_SIZE):
+            block = rows[i:i + self.CUMULATIVE_BLOCK_SIZE]
+            cumVolume, cumVolumeTT, cumInconsistent = self._getCumulative(block)
+            self._cumVolume[block] = cumVolume
+            self._cumVolumeTT[block] = cumVolumeTT
+            self._cumInconsistent[block] = cumInconsistent
+            self._hasCumulative[block] = True
+
+    def _getCumulative(self, rows):
+        """Return the cumulative volume, volume times mean travel time
+        and number of inconsistent time steps of the input rows"""
+        volume = self._volume[rows].astype(np.float64)
+        meanTT = self._meanTT[rows]
+        shape = (len(rows), self.numTimeSteps + 1)
+
+        cumVolume = np.zeros(shape, np.float64)
+        cumVolumeTT = np.zeros(shape, np.float64)
+        cumInconsistent = np.zeros(shape, np.int32)
+        cumVolume[:, 1:] = np.cumsum(volume, axis=1)
+        cumVolumeTT[:, 1:] = np.cumsum(volume * meanTT, axis=1)
+        cumInconsistent[:, 1:] = np.cumsum((volume > 0) != (meanTT > 0), axis=1)
+        return cumVolume, cumVolumeTT, cumInconsistent
+
+    def _checkWritable(self):
+
+        if not self._volume.flags.writeable:
+            raise SimError("The results are mapped to read only files")
+
+    def mapToFiles(self, directory, mode='r'):
+        """Back the volume and travel time arrays by the memory mapped 
+        files volume.npy and meanTT.npy in the input directory. With 
+        mode 'w+' the files are created and the current results are 
+        written to them. With modes 'r' (read only), 'r+' (read and 
+        write) and 'c' (copy on write) the results of existing files 
+        replace the current ones and all their rows are in use. The 
+        number of rows is written to the files by flush"""
+
+        if mode == 'w+':
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self._directory = directory
+            capacity = max(self._numRows, 1)
+
+            volume = self._newArray('volume', (capacity, self.numTimeSteps), self.VOLUME_DTYPE)
+            volume[:self._numRows] = self._volume[:self._numRows]
+            meanTT = self._newArray('meanTT', (capacity, self.numTimeSteps), self.TT_DTYPE)
+            meanTT[:self._numRows] = self._meanTT[:self._numRows]
+
+            self._volume = volume
+            self._meanTT = meanTT
+            self._replaceFiles()
+            self._allocateCumulative(capacity)
+            self.flush()
+            return
+
+        self._directory = directory
+        volume = np.load(self._getFileName('volume'), mmap_mode=mode)
+        meanTT = np.load(self._getFileName('meanTT'), mmap_mode=mode)
+
+        if volume.shape != meanTT.shape or volume.shape[1] != self.numTimeSteps:
+            raise SimError("The results in %s do not have %d time steps" %
+                           (directory, self.numTimeSteps))
+
+        numRowsFileName = self._getFileName('numRows')
+        if os.path.isfile(numRowsFileName):
+            numRows = int(np.load(numRowsFileName))
+        else:
+            numRows = volume.shape[0]
+
+        #only files opened for writing grow in place
+        if mode != 'r+':
+            self._directory = None
+
+        self._volume = volume
+        self._meanTT = meanTT
+        self._numRows = numRows
+        self._freeRows = []
+        self._freeRowSet = set()
+        self._allocateCumulative(volume.shape[0])
+
+    def flush(self):
+        """Write the changes of memory mapped arrays to their files"""
+        for array in (self._volume, self._meanTT):
+            if isinstance(array, np.memmap):
+                array.flush()
+        if self._directory is not None:
+            np.save(self._getFileName('numRows'), np.array(self._numRows))
+
+    def isMemoryMapped(self):
+        """Return True if the arrays are backed by files"""
+        return isinstance(self._volume, np.memmap)
+
+    def releaseUnusedRows(self, usedRows):
+        """Mark all the rows of the store except the input ones as free.
+        The released rows are cleared before they are reused. The rows
+        of read only files cannot be cleared and are not reused"""
+        used = np.zeros(self._numRows, np.bool_)
+        used[np.asarray(usedRows, np.intp)] = True
+        unused = np.flatnonzero(~used)
+        if not self._volume.flags.writeable:
+            self._freeRows = []
+            self._freeRowSet = set()
+            return
+
+        self._volume[unused] = 0
+        self._meanTT[unused] = 0
+        self._hasCumulative[unused] = False
+        self._freeRows = unused.tolist()[::-1]
+        self._freeRowSet = set(self._freeRows)
+
+    def addRow(self):
+        """Reserve a row for a new network element and return its index.
+        Rows released by deleted elements are reused. Files opened with
+        mode 'r' or 'c' do not grow"""
+        if self._freeRows:
+            row = self._freeRows.pop()
+            self._freeRowSet.discard(row)
+            return row
+
+        if self._numRows == self._volume.shape[0]:
+            if self.isMemoryMapped() and self._directory is None:
+                raise SimError("Rows cannot be added to results mapped to "
+                               "files opened with mode 'r' or 'c'")
+            self._grow()
+        row = self._numRows
+        self._numRows += 1
+        return row
+
+    def deleteRow(self, row):
+        """Release the row of a deleted network element"""
+        if row >= self._numRows or row in self._freeRowSet:
+            raise SimError("Row %d is not in use" % row)
+        self._checkWritable()
+
+        self._volume[row] = 0
+        self._meanTT[row] = 0
+        self._hasCumulative[row] = False
+        self._freeRows.append(row)
+        self._freeRowSet.add(row)
+
+    def getTimeStepIndex(self, timeInMin):
+        """Return the column of the simulation time step starting at
+        the input time"""
+        return int((timeInMin - self.simStartTimeInMin) // self.simTimeStepInMin)
+
+    def getTimeStepRange(self, startTimeInMin, endTimeInMin):
+        """Return the first and one past the last column covering the
+        input time window"""
+        return (self.getTimeStepIndex(startTimeInMin),
+                self.getTimeStepIndex(endTimeInMin))
+
+    def getTimeStepRanges(self, timeWindows):
+        """Return two arrays with the first and one past the last column
+        of each of the input (startTimeInMin, endTimeInMin) time windows.
+        Raise a SimError if a window is not a valid multiple of the
+        simulation time step inside the simulation period"""
+        timeWindows = np.asarray(timeWindows).reshape(-1, 2)
+        startTimes = timeWindows[:, 0]
+        endTimes = timeWindows[:, 1]
+
+        invalid = ((startTimes >= endTimes) |
+                   (startTimes < self.simStartTimeInMin) |
+                   (endTimes > self.simEndTimeInMin) |
+                   ((endTimes - startTimes) % self.simTimeStepInMin != 0) |
+                   ((startTimes - self.simStartTimeInMin) % self.simTimeStepInMin != 0))
+        if invalid.any():
+            i = np.flatnonzero(invalid)[0]
+            raise SimError("Time period from %d to %d is not a multiple of the "
+                           "simulation time step %d inside the simulation "
+                           "period" % (startTimes[i], endTimes[i],
+                                       self.simTimeStepInMin))
+
+        return ((startTimes - self.simStartTimeInMin) // self.simTimeStepInMin,
+                (endTimes - self.simStartTimeInMin) // self.simTimeStepInMin)
+
+    def getVolumes(self, row, startTimeInMin=None, endTimeInMin=None):
+        """Return a view to the volumes of the row in the input time
+        window (by default the whole simulation period)"""
+        if startTimeInMin is None:
+            return self._volume[row, :]
+        start, end = self.getTimeStepRange(startTimeInMin, endTimeInMin)
+        return self._volume[row, start:end]
+
+    def getMeanTTs(self, row, startTimeInMin=None, endTimeInMin=None):
+        """Return a view to the mean travel times of the row in the
+        input time window (by default the whole simulation period)"""
+        if startTimeInMin is None:
+            return self._meanTT[row, :]
+        start, end = self.getTimeStepRange(startTimeInMin, endTimeInMin)
+        return self._meanTT[row, start:end]
+
+    def getVolume(self, row, startTimeInMin, endTimeInMin):
+        """Return the total volume of the row in the input time window"""
+        start, end = self.getTimeStepRange(startTimeInMin, endTimeInMin)
+        if self._cumVolume is None:
+            return float(self._volume[row, start:end].astype(np.float64).sum())
+        if not self._hasCumulative[row]:
+            self._updateCumulative((row,))
+        return float(self._cumVolume[row, end] - self._cumVolume[row, start])
+
+    def getTotals(self, row, startTimeInMin, endTimeInMin):
+        """Return the total volume, the total travel time (the sum of
+        the volume times the mean travel time) and the number of
+        time steps that have a volume without a travel time (or vice
+        versa) of the row in the input time window"""
+        start, end = self.getTimeStepRange(startTimeInMin, endTimeInMin)
+        if self._cumVolume is None:
+            volume = self._volume[row, start:end].astype(np.float64)
+            meanTT = self._meanTT[row, start:end]
+            return (float(volume.sum()), float((volume * meanTT).sum()),
+                    int(((volume > 0) != (meanTT > 0)).sum()))
+        if not self._hasCumulative[row]:
+            self._updateCumulative((row,))
+        return (float(self._cumVolume[row, end] - self._cumVolume[row, start]),
+                float(self._cumVolumeTT[row, end] - self._cumVolumeTT[row, start]),
+                int(self._cumInconsistent[row, end] - self._cumInconsistent[row, start]))
+
+    def getTotalsForWindows(self, rows, timeWindows):
+        """Return three arrays with the totals (see getTotals) of
+        the input rows (one row of the arrays per input row) in each
+        of the input (startTimeInMin, endTimeInMin) time windows (one
+        column of the arrays per time window). By default all the rows
+        of the store are used"""
+        if rows is None:
+            rows = np.arange(self._numRows)
+        else:
+            rows = np.asarray(rows, np.intp).reshape(-1)
+        start, end = self.getTimeStepRanges(timeWindows)
+
+        if self._cumVolume is None:
+            shape = (len(rows), len(start))
+            totals = (np.zeros(shape, np.float64), np.zeros(shape, np.float64),
+                      np.zeros(shape, np.int32))
+            for i in range(0, len(rows), self.CUMULATIVE_BLOCK_SIZE):
+                block = rows[i:i + self.CUMULATIVE_BLOCK_SIZE]
+                for total, cumulative in zip(totals, self._getCumulative(block)):
+                    total[i:i + len(block)] = cumulative[:, end] - cumulative[:, start]
+            return totals
+
+        self._updateCumulative(rows)
+        rows = rows[:, np.newaxis]
+
+        return (self._cumVolume[rows, end] - self._cumVolume[rows, start],
+                self._cumVolumeTT[rows, end] - self._cumVolumeTT[rows, start],
+                self._cumInconsistent[rows, end] - self._cumInconsistent[rows, start])
+
+    def setVolume(self, row, startTimeInMin, volume):
+        """Set the volume of the simulation time step starting at the
+        input time"""
+        self._checkWritable()
+        self._volume[row, self.getTimeStepIndex(startTimeInMin)] = volume
+        self._hasCumulative[row] = False
+
+    def setVolumesAndMeanTTs(self, rows, volumes, meanTTs):
+        """Set the volumes and the mean travel times of the input rows
+        starting from the first simulation time step. The input arrays
+        have one row per input row and at most one column per time step"""
+        self._checkWritable()
+        rows = np.asarray(rows, np.intp)
+        numColumns = volumes.shape[1]
+        if numColumns > self.numTimeSteps:
+            raise SimError("%d time steps do not fit in the %d simulation "
+                           "time steps" % (numColumns, self.numTimeSteps))
+
+        self._volume[rows, :numColumns] = volumes
+        self._meanTT[rows, :numColumns] = meanTTs
+        self._hasCumulative[rows] = False
+
+    def getMeanTT(self, row, startTimeInMin):
+        """Return the mean travel time of the simulation time step
+        starting at the input time"""
+        return float(self._meanTT[row, self.getTimeStepIndex(startTimeInMin)])
+
+    def setMeanTT(self, row, startTimeInMin, meanTT):
+        """Set the mean travel time of the simulation time step starting
+        at the input time"""
+        self._checkWritable()
+        self._meanTT[row, self.getTimeStepIndex(startTimeInMin)] = meanTT
+        self._hasCumulative[row] = False
+
+    @property
+    def volume(self):
+        """View to the volume array. One row per element one column per
+        simulation time step"""
+        return self._volume[:self._numRows]
+
+    @property
+    def meanTT(self):
+        """View to the mean travel time array. One row per element one
+        column per simulation time step"""
+        return self._meanTT[:self._numRows]
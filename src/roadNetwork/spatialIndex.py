@@ -0,0 +1,255 @@
+__author__ = "Michail Xyntarakis"
+__company__ = "Parsons Brinckerhoff"
+__email__ = "xyntarakis@pbworld.com"
+__license__ = "GPL"
+
+import heapq
+from math import sqrt
+
+from roadNetwork.errors import GraphError
+
+
+def getDistanceToSegment(x, y, x1, y1, x2, y2):
+    """Return the distance of point (x, y) from the line segment with
+    end points (x1, y1) and (x2, y2)"""
+    dx = x2 - x1
+    dy = y2 - y1
+    lengthSquared = dx * dx + dy * dy
+    if lengthSquared == 0:
+        return sqrt((x - x1) ** 2 + (y - y1) ** 2)
+    t = max(0.0, min(1.0, ((x - x1) * dx + (y - y1) * dy) / float(lengthSquared)))
+    return sqrt((x - x1 - t * dx) ** 2 + (y - y1 - t * dy) ** 2)
+
+
+class _QuadTreeNode(object):
+    """A square of the quad tree. Leaves hold their items and internal
+    nodes the items whose bounding box does not fit in one of their
+    four children"""
+
+    __slots__ = ('x', 'y', 'size', 'parent', 'children', 'items', 'count')
+
+    def __init__(self, x, y, size, parent=None):
+
+        self.x = x              # the lower left corner of the square
+        self.y = y
+        self.size = size
+        self.parent = parent
+        self.children = None    # the four quadrants or None for a leaf
+        self.items = set()
+        self.count = 0          # the number of items in the subtree
+
+    def contains(self, minX, minY, maxX, maxY):
+
+        return self.x <= minX and maxX <= self.x + self.size and \
+            self.y <= minY and maxY <= self.y + self.size
+
+    def intersects(self, minX, minY, maxX, maxY):
+
+        return self.x <= maxX and minX <= self.x + self.size and \
+            self.y <= maxY and minY <= self.y + self.size
+
+    def getDistance(self, x, y):
+        """Return the distance of point (x, y) from the square"""
+        dx = max(self.x - x, 0.0, x - self.x - self.size)
+        dy = max(self.y - y, 0.0, y - self.y - self.size)
+        return sqrt(dx * dx + dy * dy)
+
+    def split(self):
+
+        half = self.size / 2.0
+        self.children = [_QuadTreeNode(self.x + i * half, self.y + j * half, half, self)
+                         for i in (0, 1) for j in (0, 1)]
+
+    def getChild(self, minX, minY, maxX, maxY):
+        """Return the child that contains the input bounding box or None"""
+        for child in self.children:
+            if child.contains(minX, minY, maxX, maxY):
+                return child
+        return None
+
+    def iterSubtreeItems(self):
+
+        nodes = [self]
+        while nodes:
+            node = nodes.pop()
+            for item in node.items:
+                yield item
+            if node.children is not None:
+                nodes.extend(node.children)
+
+
+class QuadTreeIndex(object):
+    """A quad tree that indexes items by their bounding box. Squares are
+    split in four when they hold more than MAX_ITEMS_PER_NODE items so 
+    the tree is deeper where the network is denser. An item is kept in
+    the smallest square that contains its bounding box. The root grows
+    to cover new items and empty squares are merged back when items 
+    are deleted, so queries only visit the squares near the query 
+    location and take about logarithmic time in the number of items"""
+
+    MAX_ITEMS_PER_NODE = 8
+    MIN_NODE_SIZE = 1.0
+
+    def __init__(self):
+
+        self._root = None
+        self._items = {}        # item to its (bounding box, node)
+
+    def __len__(self):
+
+        return len(self._items)
+
+    def __contains__(self, item):
+
+        return item in self._items
+
+    def _growRoot(self, minX, minY, maxX, maxY):
+        """Double the root towards the bounding box until it contains it"""
+        if self._root is None:
+            self._root = _QuadTreeNode(minX, minY, max(maxX - minX, maxY - minY,
+                                                       self.MIN_NODE_SIZE))
+            return
+
+        while not self._root.contains(minX, minY, maxX, maxY):
+            old = self._root
+            x = old.x - old.size if minX < old.x else old.x
+            y = old.y - old.size if minY < old.y else old.y
+            root = _QuadTreeNode(x, y, 2 * old.size)
+            root.split()
+            i = 1 if x < old.x else 0
+            j = 1 if y < old.y else 0
+            old.parent = root
+            root.children[2 * i + j] = old
+            root.count = old.count
+            self._root = root
+
+    def insert(self, item, minX, minY, maxX, maxY):
+        """Index the item with the input bounding box"""
+        if item in self._items:
+            raise GraphError("Item %s is already in the spatial index" % str(item))
+
+        self._growRoot(minX, minY, maxX, maxY)
+        node = self._root
+        while True:
+            node.count += 1
+            if node.children is None:
+                break
+            child = node.getChild(minX, minY, maxX, maxY)
+            if child is None:
+                break
+            node = child
+
+        node.items.add(item)
+        self._items[item] = ((minX, minY, maxX, maxY), node)
+        if node.children is None and len(node.items) > self.MAX_ITEMS_PER_NODE and \
+                node.size > self.MIN_NODE_SIZE:
+            self._split(node)
+
+    def _split(self, node):
+        """Split the leaf and move its items down to the children that
+        contain them"""
+        node.split()
+        for item in list(node.items):
+            bbox = self._items[item][0]
+            child = node.getChild(*bbox)
+            if child is None:
+                continue
+            node.items.remove(item)
+            child.items.add(item)
+            child.count += 1
+            self._items[item] = (bbox, child)
+
+        for child in node.children:
+            if len(child.items) > self.MAX_ITEMS_PER_NODE and \
+                    child.size > self.MIN_NODE_SIZE:
+                self._split(child)
+
+    def delete(self, item):
+        """Remove the item from the index"""
+        try:
+            bbox, node = self._items.pop(item)
+        except KeyError, e:
+            raise GraphError("Item %s is not in the spatial index" % str(item))
+
+        node.items.remove(item)
+        merge = None
+        while node is not None:
+            node.count -= 1
+            if node.children is not None and node.count <= self.MAX_ITEMS_PER_NODE:
+                merge = node
+            node = node.parent
+
+        #the highest square with few items becomes a leaf again
+        if merge is not None:
+            merge.items = set(merge.iterSubtreeItems())
+            merge.children = None
+            for mergedItem in merge.items:
+                self._items[mergedItem] = (self._items[mergedItem][0], merge)
+        self._shrinkRoot()
+
+    def _shrinkRoot(self):
+        """Make the only non empty child the root while the root holds
+        no items itself"""
+        root = self._root
+        if root is not None and root.count == 0:
+            self._root = None
+            return
+        while root.children is not None and not root.items:
+            children = [child for child in root.children if child.count]
+            if len(children) != 1:
+                break
+            root = children[0]
+            root.parent = None
+        self._root = root
+
+    def iterItemsInBBox(self, minX, minY, maxX, maxY):
+        """Return an iterator to the items whose bounding box intersects
+        the input one"""
+        if self._root is None:
+            return
+        nodes = [self._root]
+        while nodes:
+            node = nodes.pop()
+            for item in node.items:
+                itemMinX, itemMinY, itemMaxX, itemMaxY = self._items[item][0]
+                if itemMinX <= maxX and minX <= itemMaxX and \
+                        itemMinY <= maxY and minY <= itemMaxY:
+                    yield item
+            if node.children is not None:
+                nodes.extend(child for child in node.children if child.count and
+                             child.intersects(minX, minY, maxX, maxY))
+
+    def getWithinDistance(self, x, y, radius, getDistance):
+        """Return the (distance, item) pairs of the items within the input
+        distance from point (x, y) sorted by distance. getDistance
+        returns the distance of an item from the point"""
+        result = []
+        for item in self.iterItemsInBBox(x - radius, y - radius, x + radius, y + radius):
+            distance = getDistance(item)
+            if distance <= radius:
+                result.append((distance, item))
+        result.sort(key=lambda pair: pair[0])
+        return result
+
+    def getNearest(self, x, y, k, getDistance):
+        """Return the (distance, item) pairs of the k items nearest to
+        point (x, y) sorted by distance. Squares and items are visited 
+        best first by their distance from the point. The distance of a 
+        square is a lower bound of the distances of its items"""
+        if self._root is None:
+            return []
+
+        result = []
+        heap = [(self._root.getDistance(x, y), 0, id(self._root), self._root)]
+        while heap and len(result) < k:
+            distance, isItem, objectId, obj = heapq.heappop(heap)
+            if isItem:
+                result.append((distance, obj))
+                continue
+            for item in obj.items:
+                heapq.heappush(heap, (getDistance(item), 1, id(item), item))
+            if obj.children is not None:
+                for child in obj.children:
+                    if child.count:
+                        heapq.heappush(heap, (child.getDistance(x, y), 0, id(child), child))
+        return result
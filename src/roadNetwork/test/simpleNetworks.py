@@ -0,0 +1,93 @@
+__author__ = "Michail Xyntarakis"
+__company__ = "Parsons Brinckerhoff"
+__email__ = "xyntarakis@pbworld.com"
+__license__ = "GPL"
+
+from roadNetwork.graph import Graph
+from roadNetwork.vertex import Vertex
+from roadNetwork.edge import Edge
+from roadNetwork.movement import Movement
+
+def constructIntersection(withMovements=False):
+    """Return vertex 5 connected to vertices 1 to 4 by edges in both
+    directions. With movements the edge from vertex 1 gets all its
+    movements except for the U-turn"""
+    v1 = Vertex("1", 0, 100)
+    v2 = Vertex("2", 100, 200)
+    v3 = Vertex("3", 100, 0)
+    v4 = Vertex("4", 200, 100)
+    v5 = Vertex("5", 100, 100)
+
+    outEdges = [Edge(v5, vertex, 2) for vertex in (v1, v2, v4, v3)]
+    inEdges = [Edge(vertex, v5, 2) for vertex in (v4, v2, v1, v3)]
+    for edge in outEdges:
+        v5.addOutEdge(edge)
+        edge.endVertex.addInEdge(edge)
+    for edge in inEdges:
+        v5.addInEdge(edge)
+        edge.startVertex.addOutEdge(edge)
+
+    if withMovements:
+        e15 = inEdges[2]
+        for edge in outEdges:
+            if edge.endVertex != e15.startVertex:
+                e15.addOutMovement(Movement(e15, edge, 1))
+    return v5
+
+#
+#                2         6
+#                |         |
+#                |         |
+#      1 ------- 5 ------- 4 -------- 7
+#                |         |
+#                |         |
+#                |         |
+#                3         8
+#
+
+def getSimpleNet():
+    """Return the network above with edges in both directions and all
+    the movements of vertices 5 and 4 except for the U-turns"""
+    net = Graph("test", 0, 60, 5)
+    for vertexId, x, y in [("1", -200, 100), ("2", 100, 200), ("3", 100, 0),
+                           ("4", 200, 100), ("5", 100, 100), ("6", 200, 200),
+                           ("7", 300, 100), ("8", 200, 0)]:
+        net.addVertex(Vertex(vertexId, x, y))
+
+    for startVertexId, endVertexId, numLanes in [
+        ("1", "5", 3), ("5", "1", 2), ("3", "5", 3), ("5", "3", 2), ("4", "5", 2),
+        ("5", "4", 3), ("5", "2", 2), ("2", "5", 3), ("4", "8", 2), ("8", "4", 3),
+        ("7", "4", 3), ("4", "7", 2), ("4", "6", 2), ("6", "4", 3)]:
+        net.addEdge(Edge(net.getVertex(startVertexId), net.getVertex(endVertexId),
+                         numLanes))
+
+    for vertexId in ("5", "4"):
+        vertex = net.getVertex(vertexId)
+        for inEdge in list(vertex.iterInEdges()):
+            for outEdge in list(vertex.iterOutEdges()):
+                if outEdge.endVertex != inEdge.startVertex:
+                    inEdge.addOutMovement(Movement(inEdge, outEdge, 1))
+    return net
+
+def getGridNet(size, rand, withMovements=False):
+    """Return a size by size grid of vertices 100 feet apart connected
+    by edges in both directions with random free flow speeds. With
+    movements every edge gets all its movements except for the U-turn"""
+    ids = ["%d" % i for i in range(size * size)]
+    x = [100 * (i % size) for i in range(size * size)]
+    y = [100 * (i // size) for i in range(size * size)]
+    edges = []
+    for i in range(size * size):
+        if i % size < size - 1:
+            edges.extend([(ids[i], ids[i + 1]), (ids[i + 1], ids[i])])
+        if i < size * (size - 1):
+            edges.extend([(ids[i], ids[i + size]), (ids[i + size], ids[i])])
+
+    movements = []
+    if withMovements:
+        movements = [(a, b, c) for a, b in edges for b2, c in edges if b2 == b and c != a]
+    net = Graph.fromArrays("grid", 0, 60, 5, ids, x, y, edges, [1] * len(edges),
+                           movements, [1] * len(movements))
+    for edge in net.iterEdges():
+        edge.freeFlowSpeedInMPH = rand.uniform(20, 60)
+    return net
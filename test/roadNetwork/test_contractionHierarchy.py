@@ -0,0 +1,68 @@
+__author__ = "Michail Xyntarakis"
+__company__ = "Parsons Brinckerhoff"
+__email__ = "xyntarakis@pbworld.com"
+__license__ = "GPL"
+
+import os
+import random
+import tempfile
+
+import nose.tools
+
+from roadNetwork.errors import GraphError
+from roadNetwork.contractionHierarchy import ContractionHierarchy
+from roadNetwork.path import getCHSPBetweenVertices
+from roadNetwork.shortestPaths import getMovementSearch
+from roadNetwork.test.simpleNetworks import getSimpleNet, getGridNet
+
+class TestContractionHierarchy:
+
+    def test_getPath(self):
+
+        rand = random.Random(0)
+        net = getGridNet(6, rand, withMovements=True)
+        #ban some turns
+        for edge in list(net.iterEdges())[::3]:
+            for mov in list(edge.iterOutMovements())[:1]:
+                edge.deleteOutMovement(mov)
+        csr = net.getCSR()
+        fftts = csr.getFreeFlowTTsInMin()
+        hierarchy = ContractionHierarchy.build(csr, fftts)
+        search = getMovementSearch(csr, fftts)
+
+        for i in range(40):
+            source = rand.randrange(csr.numEdges)
+            target = rand.randrange(csr.numEdges)
+            search.run(source)
+            if search.getLabel(target) == float('inf'):
+                nose.tools.assert_raises(GraphError, hierarchy.getPath, [source], [target])
+                continue
+            cost, edges = hierarchy.getPath([source], [target])
+            nose.tools.assert_almost_equal(cost, search.getLabel(target) + fftts[source])
+            nose.tools.assert_almost_equal(cost, fftts[edges].sum())
+            assert edges[0] == source and edges[-1] == target
+            for edge1, edge2 in zip(edges[:-1], edges[1:]):
+                assert csr.edges[edge1].hasOutMovement(csr.edges[edge2].endVertexId)
+
+    def test_save(self):
+
+        net = getSimpleNet()
+        csr = net.getCSR()
+        hierarchy = ContractionHierarchy.build(csr, csr.getFreeFlowTTsInMin())
+
+        fd, fileName = tempfile.mkstemp(suffix='.npz')
+        os.close(fd)
+        try:
+            hierarchy.save(fileName)
+            loaded = ContractionHierarchy.load(fileName)
+        finally:
+            os.remove(fileName)
+
+        assert loaded.edgeIds == hierarchy.edgeIds
+        assert (loaded.rank == hierarchy.rank).all()
+        path = getCHSPBetweenVertices(net, "test", loaded, "1", "7")
+        assert str(path) == "1 5 4 7"
+        assert str(getCHSPBetweenVertices(net, "test", loaded, "8", "3")) == "8 4 5 3"
+        #there are no U-turns
+        nose.tools.assert_raises(GraphError, getCHSPBetweenVertices, net, "test",
+                                 loaded, "1", "1")
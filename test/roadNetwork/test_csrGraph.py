@@ -0,0 +1,52 @@
+__author__ = "Michail Xyntarakis"
+__company__ = "Parsons Brinckerhoff"
+__email__ = "xyntarakis@pbworld.com"
+__license__ = "GPL"
+
+import nose.tools
+
+from roadNetwork.errors import GraphError
+from roadNetwork.test.simpleNetworks import getSimpleNet
+
+class TestCsrGraph:
+
+    def test_construction(self):
+
+        net = getSimpleNet()
+        csr = net.getCSR()
+
+        assert csr.numVertices == net.getNumVertices()
+        assert csr.numEdges == net.getNumEdges()
+        assert csr.numMovements == net.getNumMovements()
+        assert csr.outOffsets[-1] == csr.inOffsets[-1] == csr.numEdges
+        assert csr.movementOffsets[-1] == csr.numMovements
+
+        for vertex in net.iterVertices():
+            v = csr.getVertexIndex(vertex.id)
+            outEdges = set(csr.edges[e].iid for e in csr.getOutEdges(v))
+            inEdges = set(csr.edges[e].iid for e in csr.getInEdges(v))
+            assert outEdges == set(edge.iid for edge in vertex.iterOutEdges())
+            assert inEdges == set(edge.iid for edge in vertex.iterInEdges())
+
+        e15 = csr.getEdgeIndex("1", "5")
+        assert [csr.movements[m].iid_ for m in csr.getOutMovements(e15)] == \
+            [mov.iid_ for mov in net.getEdge("1", "5").iterOutMovements()]
+        for m in csr.getOutMovements(e15):
+            assert csr.movementInEdge[m] == e15
+            assert csr.edges[csr.movementOutEdge[m]] is csr.movements[m].outEdge
+            assert net.getMovementByDenseId(csr.movementDenseId[m]) is csr.movements[m]
+
+        assert csr.lengthInMiles[e15] == net.getEdge("1", "5").getLengthInMiles()
+        nose.tools.assert_raises(GraphError, csr.getEdgeIndex, "1", "2")
+
+    def test_getCSR(self):
+
+        net = getSimpleNet()
+        csr = net.getCSR()
+        assert net.getCSR() is csr
+
+        net.deleteEdge(net.getEdge("5", "4"))
+        csr2 = net.getCSR()
+        assert csr2 is not csr
+        assert csr2.numEdges == csr.numEdges - 1
+        assert csr2.numMovements == net.getNumMovements()
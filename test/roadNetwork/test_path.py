@@ -0,0 +1,159 @@
+__author__ = "Michail Xyntarakis"
+__company__ = "Parsons Brinckerhoff"
+__email__ = "xyntarakis@pbworld.com"
+__license__ = "GPL"
+
+from roadNetwork.test.simpleNetworks import getSimpleNet
+from roadNetwork.vertex import Vertex
+from roadNetwork.edge import Edge
+from roadNetwork.movement import Movement
+from roadNetwork.path import Path, PathSet
+from roadNetwork.errors import GraphError, SimError
+
+import numpy as np
+import nose.tools
+
+def addSimVolumeToPath(net):
+
+    mov1 = net.getVertex("5").getMovement("1", "4")
+    mov2 = net.getVertex("4").getMovement("5", "7")
+    for i, startTime in enumerate(range(0, 20, 5)):
+        mov1.setSimVolume(startTime, startTime + 5, i + 1)
+        mov1.setSimTTInMin(startTime, startTime + 5, i + 1)
+        mov2.setSimVolume(startTime, startTime + 5, 2)
+        mov2.setSimTTInMin(startTime, startTime + 5, 0.5 * (i + 1))
+    return mov1, mov2
+
+def getPaths(net):
+
+    paths = []
+    for vertexIds in [("1", "5", "4", "7"), ("1", "5", "4"), ("5", "4", "7"),
+                      ("1", "5"), ("2", "5", "4")]:
+        paths.append(Path(" ".join(vertexIds), 
+                          [net.getEdge(startVertexId, endVertexId) for
+                           startVertexId, endVertexId in 
+                           zip(vertexIds[:-1], vertexIds[1:])]))
+    return paths
+
+class TestPath:
+
+    def test_getSimTTsInMin(self):
+
+        net = getSimpleNet()
+        addSimVolumeToPath(net)
+        windows = [(0, 5), (0, 10), (5, 20), (0, 60), (30, 40)]
+
+        for vertexIds in [("1", "5", "4", "7"), ("1", "5", "4")]:
+            path = Path("test", [net.getEdge(startVertexId, endVertexId) for
+                                 startVertexId, endVertexId in
+                                 zip(vertexIds[:-1], vertexIds[1:])])
+
+            result = path.getSimTTsInMin(windows)
+            answer = [path.getAverageSimTTInMin(start, end) for start, end in windows]
+            nose.tools.assert_almost_equal(abs(result - answer).max(), 0)
+
+            speeds = path.getSimSpeedsInMPH(windows)
+            nose.tools.assert_almost_equal(
+                abs(speeds - path.getLengthInMiles() / (result / 60.0)).max(), 0)
+
+        nose.tools.assert_raises(SimError, path.getSimTTsInMin, [(0, 7)])
+
+    def test_getSimVolumes(self):
+
+        net = getSimpleNet()
+        addSimVolumeToPath(net)
+        path = Path("test", [net.getEdge("1", "5"), net.getEdge("5", "4"),
+                             net.getEdge("4", "7")])
+
+        volumes = path.getSimVolumes([(0, 10), (10, 20)])
+        assert volumes.shape == (3, 2)
+        assert volumes.tolist() == [[3, 7], [4, 4], [0, 0]]
+
+    def test_invalidation(self):
+
+        net = getSimpleNet()
+        mov1, mov2 = addSimVolumeToPath(net)
+        path = Path("test", [net.getEdge("1", "5"), net.getEdge("5", "4")])
+
+        before = path.getSimTTsInMin([(0, 10), (30, 40)])
+        mov1.setPenalty(1)
+        after = path.getSimTTsInMin([(0, 10), (30, 40)])
+        nose.tools.assert_almost_equal(abs(after - before - 1).max(), 0)
+
+        mov2.setSimVolume(30, 35, 1)
+        mov2.setSimTTInMin(30, 35, 4)
+        assert path.getSimTTsInMin([(30, 40)])[0] == \
+            path.getAverageSimTTInMin(30, 40)
+
+    def test_pathOutsideGraph(self):
+
+        v1 = Vertex("1", 0, 0)
+        v2 = Vertex("2", 300, 0)
+        v3 = Vertex("3", 600, 0)
+        e12 = Edge(v1, v2, 1)
+        e23 = Edge(v2, v3, 1)
+        for edge in (e12, e23):
+            edge.simStartTimeInMin = 0
+            edge.simEndTimeInMin = 60
+            edge.simTimeStepInMin = 5
+        mov123 = Movement(e12, e23, 1)
+        e12.addOutMovement(mov123)
+        mov123.setSimVolume(0, 5, 2)
+        mov123.setSimTTInMin(0, 5, 3)
+        e23.setSimVolume(0, 5, 2)
+        e23.setSimTTInMin(0, 5, 1)
+
+        path = Path("test", [e12, e23])
+        windows = [(0, 5), (0, 10), (30, 40)]
+        answer = [path.getAverageSimTTInMin(start, end) for start, end in windows]
+        nose.tools.assert_almost_equal(abs(path.getSimTTsInMin(windows) - answer).max(), 0)
+        assert path.getSimVolumes(windows).tolist() == [[2, 2, 0], [2, 2, 0]]
+
+        simTTs = PathSet([path]).getSimTTsInMin(windows)
+        nose.tools.assert_almost_equal(abs(simTTs[0] - answer).max(), 0)
+
+class TestPathSet:
+
+    def test_getSimTTsInMin(self):
+
+        net = getSimpleNet()
+        addSimVolumeToPath(net)
+        paths = getPaths(net)
+        pathSet = PathSet(paths)
+        windows = [(0, 5), (0, 10), (5, 20), (30, 40)]
+
+        assert len(pathSet) == 5
+        assert pathSet.getNumMovements() == 3
+        assert pathSet.getPathIndex("5 4 7") == 2
+        nose.tools.assert_raises(GraphError, pathSet.getPathIndex, "1 2")
+
+        simTTs = pathSet.getSimTTsInMin(windows)
+        answer = np.array([path.getSimTTsInMin(windows) for path in paths])
+        nose.tools.assert_almost_equal(abs(simTTs - answer).max(), 0)
+
+        speeds = pathSet.getSimSpeedsInMPH(windows)
+        answer = np.array([path.getSimSpeedsInMPH(windows) for path in paths])
+        nose.tools.assert_almost_equal(abs(speeds - answer).max(), 0)
+
+        nose.tools.assert_raises(GraphError, PathSet, [])
+
+    def test_getTTErrorsInMin(self):
+
+        net = getSimpleNet()
+        addSimVolumeToPath(net)
+        paths = getPaths(net)
+        paths[0].setObsTTInMin(0, 10, 5)
+        paths[3].setObsTTInMin(5, 20, 1)
+        pathSet = PathSet(paths)
+        windows = [(0, 10), (5, 20)]
+
+        simTTs = pathSet.getSimTTsInMin(windows)
+        errors = pathSet.getTTErrorsInMin(windows)
+        assert np.isnan(errors).sum() == 8
+        nose.tools.assert_almost_equal(errors[0, 0], simTTs[0, 0] - 5)
+        nose.tools.assert_almost_equal(errors[3, 1], simTTs[3, 1] - 1)
+
+        speedErrors = pathSet.getSpeedErrorsInMPH(windows)
+        obsSpeed = paths[0].getLengthInMiles() / (5 / 60.0)
+        nose.tools.assert_almost_equal(speedErrors[0, 0],
+                                       paths[0].getSimSpeedsInMPH(windows)[0] - obsSpeed)
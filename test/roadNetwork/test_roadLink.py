@@ -8,6 +8,7 @@ import nose.tools
 from roadNetwork.vertex import Vertex
 from roadNetwork.edge import Edge
 from roadNetwork.movement import Movement
+from roadNetwork.graph import Graph
 from roadNetwork.test.simpleNetworks import constructIntersection, getSimpleNet
 from roadNetwork.errors import GraphError, SimError
 
@@ -29,6 +30,25 @@ class TestEdge:
         assert not edge12.hasOutMovement("33")
         assert not edge12.hasInMovement("2345")
 
+    def test_attributeStore(self):
+
+        v1 = Vertex("1", 1.0, 1.0)
+        v2 = Vertex("2", 3.0, 1.0)
+        edge12 = Edge(v1, v2, 3)
+
+        assert not hasattr(edge12, "__dict__")
+        assert edge12.iid_ == "1 2"
+        assert (edge12.midpoint2.x, edge12.midpoint2.y) == (2.0, 1.0)
+
+        assert not hasattr(edge12, "capacity")
+        edge12.setAttribute("capacity", {(0, 15): 1800})
+        assert edge12.hasAttribute("capacity")
+        assert edge12.capacity[0, 15] == 1800
+        nose.tools.assert_raises(AttributeError, setattr, edge12, "capacity", {})
+
+        edge12.deleteAttribute("capacity")
+        assert not hasattr(edge12, "capacity")
+
     def NOtest_addOutMovementRaises(self):
 
         v5 = constructIntersection()
@@ -183,6 +203,17 @@ class TestEdge:
         assert not e52.hasInMovement("1")
         assert e15.getNumOutMovements() == 2
         assert e52.getNumInMovements() == 0
+        nose.tools.assert_raises(GraphError, e15.getOutMovement, "2")
+        assert [mov.iid_ for mov in e15.iterOutMovements()] == ["1 5 4", "1 5 3"]
+
+        e15.addOutMovement(mov152)
+        assert e15.getOutMovement("2") is mov152
+        assert e52.hasInMovement("1")
+        assert [mov.iid_ for mov in e15.iterOutMovements()] == ["1 5 2", "1 5 4", "1 5 3"]
+
+        e15.deleteOutMovement(mov154)
+        e15.addOutMovement(mov154)
+        assert [mov.iid_ for mov in e15.iterOutMovements()] == ["1 5 2", "1 5 4", "1 5 3"]
 
     def test_getAcuteAngle(self):
 
@@ -403,5 +434,32 @@ class TestEdge:
         assert link51.getSimFlow(0, 10) == 30 * 6 
         assert link51.getSimFlow(0, 20) == 30 * 3
         assert link51.getSimFlow(0, 30) == 60 * 2
-        
-        
+
+    def test_simVolumeOutsideGraph(self):
+
+        v1 = Vertex("1", 0, 0)
+        v2 = Vertex("2", 100, 0)
+        edge12 = Edge(v1, v2, 1)
+        nose.tools.assert_raises(SimError, edge12.setSimVolume, 0, 5, 5)
+
+        edge12.simStartTimeInMin = 0
+        edge12.simEndTimeInMin = 60
+        edge12.simTimeStepInMin = 5
+        edge12.setSimVolume(0, 5, 5)
+        edge12.setSimTTInMin(0, 5, 2)
+        assert edge12.getSimVolume(0, 10) == 5
+        assert edge12.getSimTTInMin(0, 5) == 2
+
+        net = Graph("test", 0, 30, 5)
+        net.addVertex(v1)
+        net.addVertex(v2)
+        nose.tools.assert_raises(SimError, net.addEdge, edge12)
+        assert not net.hasEdge("1", "2")
+
+        net = Graph("test", 0, 60, 5)
+        net.addVertex(v1)
+        net.addVertex(v2)
+        net.addEdge(edge12)
+        assert edge12.getSimVolume(0, 10) == 5
+        assert edge12.getSimTTInMin(0, 5) == 2
+        assert net.getEdgeResults().volume.sum() == 5
@@ -4,6 +4,10 @@ __email__ = "xyntarakis@pbworld.com"
 __license__ = "GPL"
 
 from roadNetwork.test.simpleNetworks import getSimpleNet
+from roadNetwork.graph import Graph
+from roadNetwork.vertex import Vertex
+from roadNetwork.edge import Edge
+from roadNetwork.movement import Movement, MovementType
 from roadNetwork.errors import SimError
 
 import nose.tools
@@ -119,3 +123,84 @@ class TestMovement:
         nose.tools.assert_raises(SimError, sMov.setObsCount, 0, 15, -1)
         
         
+    def test_getSimVolumes(self):
+
+        net = getSimpleNet()
+        addSimVolumeToNet(net)
+        sMov = net.getVertex("5").getMovement("1", "4")
+
+        result = sMov.getSimVolumes([(0, 5), (0, 10), (5, 20), (0, 60)])
+        assert list(result) == [1, 3, 9, 10]
+
+        nose.tools.assert_raises(SimError, sMov.getSimVolumes, [(0, 5), (5, 7)])
+        nose.tools.assert_raises(SimError, sMov.getSimVolumes, [(0, 65)])
+
+    def test_getSimTTsInMin(self):
+
+        net = getSimpleNet()
+        addSimVolumeToNet(net)
+        sMov = net.getVertex("5").getMovement("1", "4")
+
+        windows = [(0, 5), (0, 10), (5, 15), (30, 40)]
+        result = sMov.getSimTTsInMin(windows)
+        answer = [sMov.getSimTTInMin(start, end) for start, end in windows]
+        assert list(result) == answer
+
+        nose.tools.assert_raises(SimError, sMov.getSimTTsInMin, [(0, 30)])
+
+    def test_classifyTurnTypes(self):
+
+        net = getSimpleNet()
+        movements = [mov for edge in net.iterEdges() for mov in edge.iterOutMovements()]
+        answer = [mov.getTurnType() for mov in movements]
+
+        turnTypes = net.classifyTurnTypes()
+        csr = net.getCSR()
+        assert [mov.baseTurnType for mov in csr.movements] == turnTypes.tolist()
+        assert [mov.baseTurnType for mov in movements] == answer
+
+        mov152 = net.getMovement("1", "5", "2")
+        assert mov152.baseTurnType == MovementType.LT
+
+    def test_moveVertex(self):
+
+        net = getSimpleNet()
+        v2 = net.getVertex("2")
+        mov152 = net.getMovement("1", "5", "2")
+        e15 = net.getEdge("1", "5")
+        assert [mov.iid_ for mov in e15.iterOutMovements()] == ["1 5 2", "1 5 4", "1 5 3"]
+
+        #move vertex 2 south east of vertex 5 so that 1 5 2 becomes a right turn
+        v2.x = 150
+        v2.y = 0
+        assert mov152.baseTurnType == MovementType.RT
+        assert 153 < net.getEdge("5", "2").getOrientation() < 154
+        assert [mov.iid_ for mov in e15.iterOutMovements()] == ["1 5 4", "1 5 2", "1 5 3"]
+        assert [e.endVertexId for e in net.getVertex("5").iterOutEdges()] == \
+            ["1", "4", "2", "3"]
+
+    def test_simVolumeOutsideGraph(self):
+
+        v1 = Vertex("1", 0, 0)
+        v2 = Vertex("2", 100, 0)
+        v3 = Vertex("3", 200, 0)
+        e12 = Edge(v1, v2, 1)
+        e23 = Edge(v2, v3, 1)
+        mov123 = Movement(e12, e23, 1)
+        nose.tools.assert_raises(SimError, mov123.setSimVolume, 0, 5, 5)
+
+        for edge in (e12, e23):
+            edge.simStartTimeInMin = 0
+            edge.simEndTimeInMin = 60
+            edge.simTimeStepInMin = 5
+        e12.addOutMovement(mov123)
+        mov123.setSimVolume(0, 5, 5)
+        assert mov123.getSimVolume(0, 5) == 5
+
+        net = Graph("test", 0, 60, 5)
+        for vertex in (v1, v2, v3):
+            net.addVertex(vertex)
+        net.addEdge(e23)
+        net.addEdge(e12)
+        assert mov123.getSimVolume(0, 10) == 5
+        assert net.getMovementResults().volume.sum() == 5
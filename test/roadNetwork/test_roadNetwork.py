@@ -3,12 +3,16 @@ __company__ = "Parsons Brinckerhoff"
 __email__ = "xyntarakis@pbworld.com"
 __license__ = "GPL"
 
+import os
+import tempfile
+
 import nose.tools
 
 from roadNetwork.graph import Graph
 from roadNetwork.vertex import Vertex
 from roadNetwork.edge import Edge
-from roadNetwork.errors import GraphError
+from roadNetwork.errors import GraphError, SimError
+from roadNetwork.simReader import iterParallelChunks
 from roadNetwork.test.simpleNetworks import getSimpleNet
 
 def getSimpleGraph():
@@ -82,6 +86,17 @@ def getSimpleGraph():
     return graph
 
 
+def writeMovementResults(flowLines, timeLines):
+    """Write the input lines to a movement flow and a movement
+    time file and return their names"""
+    fileNames = []
+    for lines in (flowLines, timeLines):
+        fd, fileName = tempfile.mkstemp()
+        os.write(fd, "\n".join(lines) + "\n")
+        os.close(fd)
+        fileNames.append(fileName)
+    return fileNames
+
 class TestGraph:
 
     def test_construction(self):
@@ -191,4 +206,302 @@ class TestGraph:
         assert net.getNumEdges() == edgesBefore + 1
         assert net.getNumVertices() == verticesBefore + 1 
 
+        newVertexId = str(net.getNumVertices())
+        assert not net.hasMovement("1", "5", "4")
+        assert net.hasMovement("1", "5", newVertexId)
+        assert net.hasMovement("5", newVertexId, "4")
+
         #netViewer(net)
+
+    def test_fromArrays(self):
+
+        net = getSimpleNet()
+        vertices = list(net.iterVertices())
+        edges = list(net.iterEdges())
+        movements = [mov for edge in edges for mov in edge.iterOutMovements()]
+
+        net2 = Graph.fromArrays("test", 0, 60, 5, 
+                                [v.id for v in vertices], [v.x for v in vertices],
+                                [v.y for v in vertices], [e.iid for e in edges],
+                                [e.getNumLanes() for e in edges],
+                                [mov.iid for mov in movements], 
+                                [mov.numLanes for mov in movements])
+
+        assert net2.getNumVertices() == net.getNumVertices()
+        assert net2.getNumEdges() == net.getNumEdges()
+        assert net2.getNumMovements() == net.getNumMovements()
+
+        for vertex in vertices:
+            vertex2 = net2.getVertex(vertex.id)
+            for iterEdges in ('iterOutEdges', 'iterInEdges', 'iterEdgesClockwise'):
+                assert [e.iid for e in getattr(vertex, iterEdges)()] == \
+                    [e.iid for e in getattr(vertex2, iterEdges)()]
+
+        for edge in edges:
+            edge2 = net2.getEdge(*edge.iid)
+            assert [mov.iid for mov in edge.iterOutMovements()] == \
+                [mov.iid for mov in edge2.iterOutMovements()]
+            assert [mov.iid for mov in edge.iterInMovements()] == \
+                [mov.iid for mov in edge2.iterInMovements()]
+
+        mov154 = net2.getMovement("1", "5", "4")
+        mov154.setSimVolume(0, 5, 10)
+        assert mov154.getSimVolume(0, 5) == 10
+        assert net2.getNewVertexId() == net.getNewVertexId()
+
+    def test_fromArraysErrors(self):
+
+        ids = ["1", "2", "3"]
+        x = [0, 100, 200]
+        y = [0, 0, 0]
+        edges = [("1", "2"), ("2", "3")]
+
+        nose.tools.assert_raises(GraphError, Graph.fromArrays, "test", 0, 60, 5,
+                                 ["1", "2", "2"], x, y, edges, [1, 1])
+        nose.tools.assert_raises(GraphError, Graph.fromArrays, "test", 0, 60, 5,
+                                 ids, x, y, [("1", "2"), ("2", "4")], [1, 1])
+        nose.tools.assert_raises(GraphError, Graph.fromArrays, "test", 0, 60, 5,
+                                 ids, x, y, edges, [1, 0])
+        nose.tools.assert_raises(GraphError, Graph.fromArrays, "test", 0, 60, 5,
+                                 ids, x, y, edges, [1, 1], [("1", "2", "1")], [1])
+
+        net = Graph.fromArrays("test", 0, 60, 5, ids, x, y, edges, [1, 1], 
+                               [("1", "2", "3")], [1])
+        assert net.hasMovement("1", "2", "3")
+
+    def test_spatialQueries(self):
+
+        net = getSimpleNet()
+
+        assert [v.id for v in net.getNearestVertices(90, 95)] == ["5"]
+        assert [v.id for v in net.getNearestVertices(190, 95, k=3)] == ["4", "5", "8"]
+        assert len(net.getNearestVertices(0, 0, k=100)) == net.getNumVertices()
+        assert sorted(v.id for v in net.getVerticesWithinDistance(100, 100, 100)) == \
+            ["2", "3", "4", "5"]
+        assert sorted(v.id for v in net.getVerticesInBBox(150, 50, 350, 250)) == \
+            ["4", "6", "7"]
+
+        nearestEdges = [e.iid for e in net.getNearestEdges(250, 110, k=2)]
+        assert sorted(nearestEdges) == [("4", "7"), ("7", "4")]
+        assert sorted(e.iid for e in net.getEdgesWithinDistance(100, 150, 1)) == \
+            [("2", "5"), ("5", "2")]
+        assert len(net.getEdgesInBBox(-10, -10, 400, 400)) == net.getNumEdges()
+
+        net.splitEdge(net.getEdge("4", "7"))
+        middleVertex = net.getNearestVertices(250, 110)[0]
+        assert (middleVertex.x, middleVertex.y) == (250, 100)
+        assert sorted(e.iid for e in net.getEdgesWithinDistance(225, 100, 1)) == \
+            [("4", middleVertex.id), ("7", "4")]
+
+        net.getVertex("7").y = 5000
+        assert net.getNearestVertices(300, 4900)[0].id == "7"
+        assert not net.getVerticesInBBox(290, 90, 310, 110)
+
+        net.deleteVertex(net.getVertex("7"))
+        assert net.getNearestVertices(300, 4900)[0].id != "7"
+        assert net.getNearestEdges(300, 4900)[0].iid not in [("7", "4"), 
+                                                             (middleVertex.id, "7")]
+
+    def test_getMovement(self):
+
+        net = getSimpleNet()
+        numMovements = net.getNumMovements()
+        mov154 = net.getMovement("1", "5", "4")
+
+        assert mov154 is net.getEdge("1", "5").getOutMovement("4")
+        assert net.getMovementByDenseId(mov154.getDenseId()) is mov154
+        nose.tools.assert_raises(GraphError, net.getMovement, "1", "5", "1")
+
+        denseIds = [mov.getDenseId() for edge in net.iterEdges() 
+                    for mov in edge.iterOutMovements()]
+        assert sorted(denseIds) == range(numMovements)
+
+        denseId = mov154.getDenseId()
+        edge54 = net.getEdge("5", "4")
+        numDeleted = edge54.getNumInMovements() + edge54.getNumOutMovements()
+        net.deleteEdge(edge54)
+        assert not net.hasMovement("1", "5", "4")
+        assert net.getNumMovements() == numMovements - numDeleted
+        nose.tools.assert_raises(GraphError, net.getMovementByDenseId, denseId)
+        nose.tools.assert_raises(GraphError, mov154.getDenseId)
+
+    def test_readMovementVolumesAndTTsInBulk(self):
+
+        flowLines = ["1 5 4 1 2 0 4", 
+                     "2 5 4 3 0 0 0", 
+                     "1 5 1 1 1 1 1",
+                     "8 4 5 2 2 2 2"]
+        timeLines = ["1 5 4 1.5 2 0 3",
+                     "2 5 4 1 0 0 0",
+                     "1 5 1 1 1 1 1",
+                     "8 4 5 1 1 1 1"]
+        flowFile, timeFile = writeMovementResults(flowLines, timeLines)
+
+        net1 = getSimpleNet()
+        net1.readMovementVolumesAndTTs(flowFile, timeFile)
+        net2 = getSimpleNet()
+        net2.readMovementVolumesAndTTsInBulk(flowFile, timeFile, linesPerChunk=3)
+
+        for mov1, mov2 in [(net1.getVertex(v).getMovement(a, c), 
+                            net2.getVertex(v).getMovement(a, c))
+                           for a, v, c in [("1", "5", "4"), ("2", "5", "4"), 
+                                           ("8", "4", "5")]]:
+            for start, end in [(0, 5), (5, 10), (0, 20), (0, 60)]:
+                assert mov1.getSimVolume(start, end) == mov2.getSimVolume(start, end)
+                assert mov1.getSimTTInMin(start, end) == mov2.getSimTTInMin(start, end)
+
+        os.remove(flowFile)
+        os.remove(timeFile)
+
+    def test_readMovementVolumesAndTTsInParallel(self):
+
+        flowLines = ["1 5 4 1 2 0 4", "2 5 4 3 0 0 0", "8 4 5 2 2 2 2"] * 3
+        timeLines = ["1 5 4 1.5 2 0 3", "2 5 4 1 0 0 0", "8 4 5 1 1 1 1"] * 3
+        flowFile, timeFile = writeMovementResults(flowLines, timeLines)
+
+        net1 = getSimpleNet()
+        net1.readMovementVolumesAndTTsInBulk(flowFile, timeFile)
+        net2 = getSimpleNet()
+        net2.readMovementVolumesAndTTsInBulk(flowFile, timeFile, linesPerChunk=2,
+                                             numProcesses=2)
+
+        assert (net1.getMovementResults().volume == 
+                net2.getMovementResults().volume).all()
+        assert (net1.getMovementResults().meanTT == 
+                net2.getMovementResults().meanTT).all()
+
+        #the files are parsed chunk by chunk with the lines of each pair aligned
+        chunks = list(iterParallelChunks([flowFile, timeFile], 3, linesPerChunk=4,
+                                         numProcesses=2))
+        assert [len(flowIds) for (flowIds, flows), (timeIds, times) in chunks] == [4, 4, 1]
+        for (flowIds, flows), (timeIds, times) in chunks:
+            assert flowIds == timeIds
+
+        os.remove(flowFile)
+        os.remove(timeFile)
+
+    def test_readTimeVaryingAttributes(self):
+
+        edgeFile, movementFile = writeMovementResults(
+            ["header", "1,5,1,2,3", "5,1,4,5,6", "1,128,0,0,0"],
+            ["header", "1 5 4,1,2,3", "2 5 4,0,0,0", "1 5 1,1,1,1"])
+
+        for numProcesses in (1, 2):
+            net = getSimpleNet()
+            net.readTimeVaryingEdgeAttribute(edgeFile, "speed", 0, 15, 5, 
+                                             numProcesses=numProcesses)
+            net.readTimeVaryingMovementAttribute(movementFile, "delay", 0, 15, 5,
+                                                 numProcesses=numProcesses)
+
+            assert net.getEdge("1", "5").speed == {(0, 5): 1, (5, 10): 2, (10, 15): 3}
+            assert net.getEdge("5", "1").speed[10, 15] == 6
+            assert net.getEdge("5", "4").speed == {}
+
+            assert net.getVertex("5").getMovement("1", "4").delay[5, 10] == 2
+            assert net.getVertex("5").getMovement("2", "4").delay == {}
+
+        os.remove(edgeFile)
+        os.remove(movementFile)
+
+    def test_readTimeVaryingAttributesErrors(self):
+
+        edgeFile, movementFile = writeMovementResults(
+            ["header", "1,5,1,2,3", "5,1,4,5"], ["header", "1 5 4,1,2", "2 5 4,0,0"])
+
+        for numProcesses in (1, 2):
+            net = getSimpleNet()
+            nose.tools.assert_raises(GraphError, net.readTimeVaryingEdgeAttribute, 
+                                     edgeFile, "speed", 0, 15, 5, numProcesses=numProcesses)
+            nose.tools.assert_raises(GraphError, net.readTimeVaryingMovementAttribute, 
+                                     movementFile, "delay", 0, 15, 5, 
+                                     numProcesses=numProcesses)
+
+        os.remove(edgeFile)
+        os.remove(movementFile)
+
+    def test_saveAndLoadResults(self):
+
+        flowFile, timeFile = writeMovementResults(["1 5 4 1 2 0 4", "8 4 5 2 2 2 2"],
+                                                  ["1 5 4 1.5 2 0 3", "8 4 5 1 1 1 1"])
+        edgeFile, movementFile = writeMovementResults(["1,5,1,2,3"], ["1 5 4,1,2,3"])
+        fd, resultsFile = tempfile.mkstemp(suffix=".npz")
+        os.close(fd)
+
+        net1 = getSimpleNet()
+        net1.readMovementVolumesAndTTsInBulk(flowFile, timeFile)
+        net1.readTimeVaryingEdgeAttribute(edgeFile, "speed", 0, 15, 5, hasHeader=False)
+        net1.readTimeVaryingMovementAttribute(movementFile, "delay", 0, 15, 5, 
+                                              hasHeader=False)
+        net1.getEdge("5", "1").setSimVolume(0, 5, 10)
+        net1.saveResults(resultsFile)
+
+        net2 = getSimpleNet()
+        assert net2.loadResults(resultsFile, [flowFile, timeFile, edgeFile, movementFile])
+
+        mov1 = net1.getVertex("5").getMovement("1", "4")
+        mov2 = net2.getVertex("5").getMovement("1", "4")
+        for start, end in [(0, 5), (0, 10), (0, 20)]:
+            assert mov1.getSimVolume(start, end) == mov2.getSimVolume(start, end)
+            assert mov1.getSimTTInMin(start, end) == mov2.getSimTTInMin(start, end)
+
+        assert net2.getEdge("5", "1").getSimVolume(0, 5) == 10
+        assert net2.getEdge("1", "5").speed == {(0, 5): 1, (5, 10): 2, (10, 15): 3}
+        assert mov2.delay == mov1.delay
+
+        #a second load fails before any result is overwritten
+        net2.getEdge("5", "1").setSimVolume(0, 5, 3)
+        nose.tools.assert_raises(GraphError, net2.loadResults, resultsFile)
+        assert net2.getEdge("5", "1").getSimVolume(0, 5) == 3
+
+        net3 = getSimpleNet()
+        assert not net3.loadResults(resultsFile, [flowFile])
+        assert not net3.loadResults(resultsFile + ".missing")
+        assert net3.loadResults(resultsFile)
+
+        #the source files are rehashed by default
+        outputStream = open(edgeFile, "a")
+        outputStream.write("1,5,1,2,3\n")
+        outputStream.close()
+        assert not getSimpleNet().loadResults(resultsFile)
+        os.remove(edgeFile)
+        assert not getSimpleNet().loadResults(resultsFile)
+
+        for fileName in (flowFile, timeFile, movementFile, resultsFile):
+            os.remove(fileName)
+
+    def test_readMovementVolumesAndTTsInBulkErrors(self):
+
+        net = getSimpleNet()
+        flowFile, timeFile = writeMovementResults(["1 5 4 1 2", "2 5 4 3 0"],
+                                                  ["1 5 4 1 2", "2 5 3 1 0"])
+        nose.tools.assert_raises(SimError, net.readMovementVolumesAndTTsInBulk,
+                                 flowFile, timeFile)
+        os.remove(flowFile)
+        os.remove(timeFile)
+
+        flowFile, timeFile = writeMovementResults(["1 5 4 0 2"], ["1 5 4 1 2"])
+        nose.tools.assert_raises(SimError, net.readMovementVolumesAndTTsInBulk,
+                                 flowFile, timeFile)
+        os.remove(flowFile)
+        os.remove(timeFile)
+
+        #both loaders reject fractional flows and accept whole ones
+        #written as decimals
+        flowFile, timeFile = writeMovementResults(["1 5 4 3.7 2"], ["1 5 4 1 2"])
+        nose.tools.assert_raises(SimError, net.readMovementVolumesAndTTsInBulk,
+                                 flowFile, timeFile)
+        nose.tools.assert_raises(SimError, net.readMovementVolumesAndTTs,
+                                 flowFile, timeFile)
+        assert net.getVertex("5").getMovement("1", "4").getSimVolume(0, 5) == 0
+        os.remove(flowFile)
+        os.remove(timeFile)
+
+        flowFile, timeFile = writeMovementResults(["1 5 4 3.0 2"], ["1 5 4 1 2"])
+        net1 = getSimpleNet()
+        net1.readMovementVolumesAndTTs(flowFile, timeFile)
+        net2 = getSimpleNet()
+        net2.readMovementVolumesAndTTsInBulk(flowFile, timeFile)
+        for net in (net1, net2):
+            assert net.getVertex("5").getMovement("1", "4").getSimVolume(0, 10) == 5
+        os.remove(flowFile)
+        os.remove(timeFile)
@@ -55,6 +55,21 @@ class TestVertex:
         assert v5.hasInEdge("4")
         assert not v5.hasInEdge('100')
 
+        nose.tools.assert_raises(GraphError, v5.addInEdge, Edge(v4, v5, 1))
+        v5._deleteInEdge(e45)
+        assert not v5.hasInEdge("4")
+        assert not v5.isIncoming(e45)
+        nose.tools.assert_raises(GraphError, v5.getInEdge, "4")
+
+    def test_hasMovement(self):
+
+        v5 = constructIntersection(withMovements=True)
+
+        assert v5.hasMovement("1", "2")
+        assert not v5.hasMovement("1", "1")
+        assert not v5.hasMovement("2", "1")
+        assert not v5.hasMovement("10", "1")
+
     def test_addOutEdge(self):
 
         v4 = Vertex("4", 200, 100)
@@ -195,6 +210,32 @@ class TestVertex:
         
         assert result == answer 
         
+    def test_deleteEdgesClockwise(self):
+
+        center = Vertex("0", 0.0, 0.0)
+        others = [Vertex(str(i), x, y) for i, (x, y) in enumerate(
+                [(0, 10), (10, 10), (10, 0), (10, -10), (0, -10), (-10, -10), 
+                 (-10, 0), (-10, 10)], 1)]
+        order = [3, 7, 0, 5, 1, 6, 2, 4]
+        for i in order:
+            center.addOutEdge(Edge(center, others[i], 1))
+            center.addInEdge(Edge(others[i], center, 1))
+
+        result = [e.endVertexId for e in center.iterOutEdges()]
+        assert result == ["4", "5", "6", "7", "8", "1", "2", "3"]
+        result = [e.startVertexId for e in center.iterInEdges()]
+        assert result == ["4", "3", "2", "1", "8", "7", "6", "5"]
+
+        for i in (7, 3, 4):
+            center._deleteOutEdge(center.getOutEdge(others[i].id))
+            center._deleteInEdge(center.getInEdge(others[i].id))
+
+        result = [e.endVertexId for e in center.iterOutEdges()]
+        assert result == ["6", "7", "1", "2", "3"]
+        result = [e.iid_ for e in center.iterEdgesClockwise()]
+        assert result == ["1 0", "0 1", "2 0", "0 2", "3 0", "0 3", 
+                          "6 0", "0 6", "7 0", "0 7"]
+        
     def test_iterEdgePairs(self):
 
         net = getSimpleNet() 
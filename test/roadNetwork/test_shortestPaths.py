@@ -0,0 +1,422 @@
+__author__ = "Michail Xyntarakis"
+__company__ = "Parsons Brinckerhoff"
+__email__ = "xyntarakis@pbworld.com"
+__license__ = "GPL"
+
+import random
+
+import nose.tools
+
+from roadNetwork.errors import GraphError
+from roadNetwork.vertex import Vertex
+from roadNetwork.movement import Movement
+from roadNetwork.path import getSPBetweenEdges, getSPBetweenVertices, \
+    getTDSPBetweenEdges, getTDSPsBetweenEdges, getODTravelTimes, getSPsBetweenVertices, \
+    getSPFromDynamicTree, getPointToPointSP
+from roadNetwork.shortestPaths import DijkstraSearch, getVertexSearch, \
+    getMovementSearch, TimeDependentSearch, getManyToMany, ShortestPathTreeCache, \
+    getFreeFlowVertexSearch, getLengthMovementSearch, DynamicShortestPathTree, \
+    getFreeFlowDynamicTree, updateFreeFlowDynamicTree, PointToPointSearch, INFINITY
+from roadNetwork.test.simpleNetworks import getSimpleNet, getGridNet
+
+class TestShortestPaths:
+
+    def test_dijkstraSearch(self):
+
+        #0 -> 1 -> 3 is cheaper than 0 -> 3 and 0 -> 2 -> 3
+        offsets = [0, 3, 4, 5, 5, 5]
+        heads = [1, 2, 3, 3, 3]
+        costs = [1.0, 1.0, 5.0, 1.0, 2.0]
+        search = DijkstraSearch(offsets, heads, costs)
+
+        search.run(0)
+        assert search.getLabels().tolist() == [0, 1, 1, 2, INFINITY]
+        assert search.getNodePath(3) == [0, 1, 3]
+        assert search.getArcPath(3) == [0, 3]
+        nose.tools.assert_raises(GraphError, search.getArcPath, 4)
+
+        #the labels of the previous search are reset
+        search.run(2)
+        assert search.getLabels().tolist() == [INFINITY, INFINITY, 0, 2, INFINITY]
+        assert search.getNodePath(3) == [2, 3]
+
+        #the search stops once the target is settled
+        search.run(0, 1)
+        assert search.isSettled(1)
+        assert not search.isSettled(3)
+
+        nose.tools.assert_raises(GraphError, search.run, 5)
+        nose.tools.assert_raises(GraphError, DijkstraSearch, offsets, heads,
+                                 [1.0, -1.0, 1.0, 1.0, 1.0])
+
+    def test_getVertexSearch(self):
+
+        net = getSimpleNet()
+        csr = net.getCSR()
+        fftts = csr.getFreeFlowTTsInMin()
+        search = getVertexSearch(csr, fftts)
+
+        search.run(csr.getVertexIndex("1"))
+        path = search.getArcPath(csr.getVertexIndex("7"))
+        assert [csr.edges[e].iid for e in path] == [("1", "5"), ("5", "4"), ("4", "7")]
+        nose.tools.assert_almost_equal(search.getLabel(csr.getVertexIndex("7")),
+                                       fftts[path].sum())
+
+    def test_getMovementSearch(self):
+
+        net = getSimpleNet()
+        e54 = net.getEdge("5", "4")
+        e54.addOutMovement(Movement(e54, net.getEdge("4", "5"), 1))
+        net.getMovement("1", "5", "2").setPenalty(250)
+        csr = net.getCSR()
+        assert csr.movementIsUTurn.sum() == 1
+        assert csr.movementPenalty.max() == 250
+
+        lengths = [edge.lengthInFeet for edge in csr.edges]
+        e15 = csr.getEdgeIndex("1", "5")
+        e52 = csr.getEdgeIndex("5", "2")
+
+        search = getMovementSearch(csr, lengths)
+        search.run(e15)
+        assert search.getLabel(e52) == 100
+        assert search.getNodePath(e52) == [e15, e52]
+
+        #the penalty makes the U-turn at vertex 4 cheaper than the left turn
+        search = getMovementSearch(csr, lengths, csr.movementPenalty)
+        search.run(e15)
+        assert search.getLabel(e52) == 300
+        assert [csr.edges[e].iid_ for e in search.getNodePath(e52)] == \
+            ["1 5", "5 4", "4 5", "5 2"]
+        assert [csr.movements[m].iid_ for m in search.getArcPath(e52)] == \
+            ["1 5 4", "5 4 5", "4 5 2"]
+
+        search = getMovementSearch(csr, lengths, csr.movementPenalty, allowUTurns=False)
+        search.run(e15)
+        assert search.getLabel(e52) == 350
+        assert search.getLabel(csr.getEdgeIndex("4", "5")) == INFINITY
+
+    def test_shortestPathTreeCache(self):
+
+        net = getSimpleNet()
+        trees = ShortestPathTreeCache(net, maxTrees=2)
+        csr = net.getCSR()
+        v1, v3, v7 = [csr.getVertexIndex(vertexId) for vertexId in ("1", "3", "7")]
+
+        tree = trees.getTree(v1, getFreeFlowVertexSearch)
+        assert trees.getTree(v1, getFreeFlowVertexSearch) is tree
+        assert (trees.numHits, trees.numMisses) == (1, 1)
+        label = tree.getLabel(v7)
+
+        #the tree is not changed by later searches
+        trees.getTree(v3, getFreeFlowVertexSearch)
+        assert tree.getLabel(v7) == label
+        assert [csr.edges[e].iid_ for e in tree.getArcPath(v7)] == ["1 5", "5 4", "4 7"]
+        assert tree.getLabel(v1) == 0
+
+        #the least recently used tree is evicted
+        trees.getTree(v1, getLengthMovementSearch, False)
+        assert len(trees) == 2
+        trees.getTree(v3, getFreeFlowVertexSearch)
+        assert trees.numMisses == 3
+        trees.getTree(v1, getFreeFlowVertexSearch)
+        assert trees.numMisses == 4
+
+        #a cost change discards the trees
+        version = net.getCostVersion()
+        net.getEdge("5", "4").freeFlowSpeedInMPH = 25.0
+        assert net.getCostVersion() != version
+        assert net.getCSR() is csr
+        assert csr.freeFlowSpeedInMPH[csr.getEdgeIndex("5", "4")] == 25.0
+        newTree = trees.getTree(v1, getFreeFlowVertexSearch)
+        assert newTree is not tree
+        nose.tools.assert_almost_equal(newTree.getLabel(v7) - label,
+                                       100 / 5280.0 / 50.0 * 60)
+        assert len(trees) == 1
+
+        version = net.getCostVersion()
+        net.getMovement("1", "5", "4").setPenalty(1)
+        assert net.getCostVersion() != version
+        version = net.getCostVersion()
+        net.getMovement("1", "5", "4").setSimVolume(0, 5, 1)
+        assert net.getCostVersion() != version
+        version = net.getCostVersion()
+        net.getMovement("1", "5", "4").setSimTTInMin(0, 5, 2)
+        assert net.getCostVersion() != version
+        version = net.getCostVersion()
+        net.getEdge("4", "7").setSimVolume(0, 5, 1)
+        assert net.getCostVersion() != version
+        version = net.getCostVersion()
+        net.deleteEdge(net.getEdge("4", "7"))
+        assert net.getCostVersion() != version
+
+    def test_getSPBetweenVertices(self):
+
+        net = getSimpleNet()
+        path = getSPBetweenVertices(net, "test", "1", "7")
+        assert path.getName() == "test"
+        assert str(path) == "1 5 4 7"
+
+        path = getSPBetweenVertices(net, "test", "8", "3")
+        assert str(path) == "8 4 5 3"
+
+        net.addVertex(Vertex("9", 500, 500))
+        nose.tools.assert_raises(GraphError, getSPBetweenVertices, net, "test", "1", "9")
+        nose.tools.assert_raises(GraphError, getSPBetweenVertices, net, "test", "1", "10")
+
+    def test_getManyToMany(self):
+
+        offsets = [0, 3, 4, 5, 5, 5]
+        heads = [1, 2, 3, 3, 3]
+        costs = [1.0, 1.0, 5.0, 1.0, 2.0]
+        search = DijkstraSearch(offsets, heads, costs)
+
+        for numProcesses in (1, 2):
+            odCosts, paths = getManyToMany(search, [0, 2, 0], [3, 0], withPaths=True,
+                                           numProcesses=numProcesses)
+            assert odCosts.tolist() == [[2, 0], [2, INFINITY], [2, 0]]
+            assert paths == [[0, 3], [], [4], None, [0, 3], []]
+
+        search.run(0, targets=[1, 2])
+        assert search.isSettled(1) and search.isSettled(2)
+        assert not search.isSettled(3)
+
+    def test_getSPsBetweenVertices(self):
+
+        net = getSimpleNet()
+        origins = ["1", "3", "1"]
+        destinations = ["7", "1", "2"]
+
+        travelTimes = getODTravelTimes(net, origins, destinations)
+        assert travelTimes.shape == (3, 3)
+        assert (travelTimes[0] == travelTimes[2]).all()
+        assert travelTimes[0, 1] == 0
+        nose.tools.assert_almost_equal(travelTimes[0, 0],
+            getSPBetweenVertices(net, "test", "1", "7").getLengthInMiles() / 50.0 * 60)
+        assert (getODTravelTimes(net, origins, destinations, numProcesses=2) ==
+                travelTimes).all()
+
+        paths = getSPsBetweenVertices(net, origins, destinations, numProcesses=2)
+        assert sorted(paths.keys()) == [("1", "2"), ("1", "7"), ("3", "1"),
+                                         ("3", "2"), ("3", "7")]
+        assert str(paths["3", "7"]) == "3 5 4 7"
+        assert paths["3", "7"].getName() == "3 7"
+
+    def test_getSPBetweenEdges(self):
+
+        net = getSimpleNet()
+        path = getSPBetweenEdges(net, "test", [("1", "5"), "5 3"])
+        assert str(path) == "1 5 3"
+        path = getSPBetweenEdges(net, "test", [("1", "5"), "5 2"])
+        assert str(path) == "1 5 2"
+        assert net.getShortestPathTrees().numHits == 1
+
+        path = getSPBetweenEdges(net, "test", [("3", "5"), ("4", "8")])
+        assert str(path) == "3 5 4 8"
+
+        path = getSPBetweenEdges(net, "test", ["1 5", "5 4", "4 6"])
+        assert str(path) == "1 5 4 6"
+
+        e54 = net.getEdge("5", "4")
+        e54.addOutMovement(Movement(e54, net.getEdge("4", "5"), 1))
+        path = getSPBetweenEdges(net, "test", ["1 5", "5 4", "5 1"])
+        assert str(path) == "1 5 4 5 1"
+        nose.tools.assert_raises(GraphError, getSPBetweenEdges, net, "test",
+                                 ["1 5", "5 4", "5 1"], allowUTurns=False)
+
+        #there are no movements at vertex 6
+        nose.tools.assert_raises(GraphError, getSPBetweenEdges, net, "test",
+                                 ["1 5", "4 6", "6 4"])
+
+    def test_getSPBetweenEdgesWithPenalties(self):
+
+        net = getSimpleNet()
+        e54 = net.getEdge("5", "4")
+        e54.addOutMovement(Movement(e54, net.getEdge("4", "5"), 1))
+        net.getMovement("1", "5", "2").setPenalty(10)
+
+        #the penalised left turn is avoided by the U-turn at vertex 4
+        path = getSPBetweenEdges(net, "test", ["1 5", "5 2"])
+        assert str(path) == "1 5 2"
+        path = getSPBetweenEdges(net, "test", ["1 5", "5 2"], usePenalties=True)
+        assert str(path) == "1 5 4 5 2"
+        path = getSPBetweenEdges(net, "test", ["1 5", "5 2"], allowUTurns=False,
+                                 usePenalties=True)
+        assert str(path) == "1 5 2"
+
+        net.getMovement("1", "5", "2").setPenalty(0)
+        path = getSPBetweenEdges(net, "test", ["1 5", "5 2"], usePenalties=True)
+        assert str(path) == "1 5 2"
+
+    def test_timeDependentSearch(self):
+
+        net = getSimpleNet()
+        e54 = net.getEdge("5", "4")
+        e54.addOutMovement(Movement(e54, net.getEdge("4", "5"), 1))
+        for mov in net.getCSR().movements:
+            mov.setTimeVaryingCosts([1.0] * 12, 5)
+        #the left turn is congested for the first two intervals
+        net.getMovement("1", "5", "2").setTimeVaryingCosts([10.0] * 2 + [1.0] * 10, 5)
+
+        csr = net.getCSR()
+        costs, startTimeInMin, timeStepInMin = csr.getTimeVaryingCosts()
+        assert costs.shape == (csr.numMovements, 12)
+        assert (startTimeInMin, timeStepInMin) == (0, 5)
+
+        search = TimeDependentSearch(csr, costs, startTimeInMin, timeStepInMin)
+        e15 = csr.getEdgeIndex("1", "5")
+        e52 = csr.getEdgeIndex("5", "2")
+        search.run(e15, 0, e52)
+        assert search.getArrivalTimeInMin(e52) == 3
+        assert len(search.getNodePath(e52)) == 4
+
+        #waiting for the second interval to end is faster than turning at 9
+        search.run(e15, 9, e52)
+        assert search.getArrivalTimeInMin(e52) == 11
+        assert search.getNodePath(e52) == [e15, e52]
+
+        search.runAllDepartureTimes(e15, [0, 9, 20])
+        labels = search.getLabels().copy()
+        assert labels[e52].tolist() == [3, 11, 21]
+        assert search.getNodePath(e52, 1) == [e15, e52]
+        for departure, departureTime in enumerate([0, 9, 20]):
+            search.run(e15, departureTime)
+            assert search.getLabels()[:, 0].tolist() == labels[:, departure].tolist()
+
+        search = TimeDependentSearch(csr, costs, startTimeInMin, timeStepInMin,
+                                     allowUTurns=False)
+        search.run(e15, 0, e52)
+        assert search.getArrivalTimeInMin(e52) == 10
+
+    def test_getTDSPBetweenEdges(self):
+
+        net = getSimpleNet()
+        nose.tools.assert_raises(GraphError, getTDSPBetweenEdges, net, "test",
+                                 "1 5", "5 2", 0)
+
+        e54 = net.getEdge("5", "4")
+        e54.addOutMovement(Movement(e54, net.getEdge("4", "5"), 1))
+        for mov in net.getCSR().movements:
+            mov.setTimeVaryingCosts([1.0] * 12, 5)
+        net.getMovement("1", "5", "2").setTimeVaryingCosts([10.0] * 2 + [1.0] * 10, 5)
+
+        path = getTDSPBetweenEdges(net, "test", "1 5", "5 2", 0)
+        assert str(path) == "1 5 4 5 2"
+        paths = getTDSPsBetweenEdges(net, "test", "1 5", "5 2", [0, 9, 20])
+        assert [str(path) for path in paths] == ["1 5 4 5 2", "1 5 2", "1 5 2"]
+
+    def test_dynamicShortestPathTree(self):
+
+        #compare the repaired labels against a search from scratch
+        rand = random.Random(0)
+        numNodes = 30
+        arcs = {}
+        for i in range(120):
+            arcs[rand.randrange(numNodes), rand.randrange(numNodes)] = rand.uniform(1, 10)
+        tree = DynamicShortestPathTree(0, [(tail, head, cost) for (tail, head), cost
+                                           in arcs.iteritems()])
+
+        for step in range(30):
+            for i in range(3):
+                tail, head = rand.randrange(numNodes), rand.randrange(numNodes)
+                if (tail, head) in arcs and rand.random() < 0.5:
+                    del arcs[tail, head]
+                    tree.deleteArc(tail, head)
+                else:
+                    arcs[tail, head] = rand.uniform(1, 10)
+                    tree.setArcCost(tail, head, arcs[tail, head])
+            tree.update()
+
+            keys = sorted(arcs)
+            offsets = [0] * (numNodes + 1)
+            for tail, head in keys:
+                offsets[tail + 1] += 1
+            for i in range(numNodes):
+                offsets[i + 1] += offsets[i]
+            search = DijkstraSearch(offsets, [head for tail, head in keys],
+                                    [arcs[key] for key in keys])
+            search.run(0)
+            for node in range(numNodes):
+                nose.tools.assert_almost_equal(tree.getLabel(node), search.getLabel(node))
+                if tree.isReached(node):
+                    path = tree.getNodePath(node)
+                    nose.tools.assert_almost_equal(
+                        sum(arcs[arc] for arc in zip(path[:-1], path[1:])),
+                        search.getLabel(node))
+
+        nose.tools.assert_raises(GraphError, tree.deleteNode, 0)
+        tree.deleteNode(5)
+        assert not tree.isReached(5)
+        tree.update()
+        assert not tree.isReached(5)
+
+    def test_updateFreeFlowDynamicTree(self):
+
+        net = getSimpleNet()
+        tree = getFreeFlowDynamicTree(net, "1")
+        label = tree.getLabel("7")
+        assert str(getSPFromDynamicTree(net, "test", tree, "7")) == "1 5 4 7"
+
+        e54 = net.getEdge("5", "4")
+        e54.freeFlowSpeedInMPH = 25.0
+        changed = updateFreeFlowDynamicTree(tree, net, [e54.iid])
+        assert changed == set(["4", "6", "7", "8"])
+        nose.tools.assert_almost_equal(tree.getLabel("7") - label, 100 / 5280.0 / 50.0 * 60)
+
+        newEdge1, newEdge2 = net.splitEdge(e54)
+        updateFreeFlowDynamicTree(tree, net, [e54.iid, newEdge1.iid, newEdge2.iid])
+        nose.tools.assert_almost_equal(tree.getLabel("7"), label)
+        assert str(getSPFromDynamicTree(net, "test", tree, "7")) == \
+            "1 5 %s 4 7" % newEdge1.endVertexId
+
+        net.deleteEdge(net.getEdge("4", "7"))
+        updateFreeFlowDynamicTree(tree, net, [("4", "7")])
+        assert not tree.isReached("7")
+        nose.tools.assert_raises(GraphError, getSPFromDynamicTree, net, "test", tree, "7")
+
+    def test_pointToPointSearch(self):
+
+        rand = random.Random(0)
+        net = getGridNet(15, rand)
+        csr = net.getCSR()
+        fftts = csr.getFreeFlowTTsInMin()
+        search = PointToPointSearch(csr, fftts)
+        nose.tools.assert_almost_equal(search.costPerFoot, 60 / 5280.0 /
+                                       csr.freeFlowSpeedInMPH.max())
+        tree = getVertexSearch(csr, fftts)
+
+        for i in range(20):
+            source = rand.randrange(csr.numVertices)
+            target = rand.randrange(csr.numVertices)
+            tree.run(source)
+            for cost, edges in (search.getAStarPath(source, target),
+                                search.getBidirectionalPath(source, target)):
+                nose.tools.assert_almost_equal(cost, tree.getLabel(target))
+                nose.tools.assert_almost_equal(cost, fftts[edges].sum())
+                if edges:
+                    assert csr.edgeStart[edges[0]] == source
+                    assert csr.edgeEnd[edges[-1]] == target
+                    assert (csr.edgeEnd[edges[:-1]] == csr.edgeStart[edges[1:]]).all()
+
+        #a query between neighbours labels a small part of the grid
+        source = csr.getVertexIndex("112")
+        target = csr.getVertexIndex("113")
+        search.getAStarPath(source, target)
+        assert search.numSettled < csr.numVertices / 4
+        search.getBidirectionalPath(source, target)
+        assert search.numSettled < csr.numVertices / 4
+
+        cost, edges = search.getBidirectionalPath(source, source)
+        assert (cost, edges) == (0, [])
+
+    def test_getPointToPointSP(self):
+
+        net = getSimpleNet()
+        for bidirectional in (False, True):
+            path = getPointToPointSP(net, "test", "1", "7", bidirectional)
+            assert str(path) == "1 5 4 7"
+            assert str(getPointToPointSP(net, "test", "8", "3", bidirectional)) == "8 4 5 3"
+
+        net.addVertex(Vertex("9", 500, 500))
+        for bidirectional in (False, True):
+            nose.tools.assert_raises(GraphError, getPointToPointSP, net, "test", "1", "9",
+                                     bidirectional)
@@ -0,0 +1,197 @@
+__author__ = "Michail Xyntarakis"
+__company__ = "Parsons Brinckerhoff"
+__email__ = "xyntarakis@pbworld.com"
+__license__ = "GPL"
+
+import shutil
+import tempfile
+
+import nose.tools
+
+from roadNetwork.simResults import SimResults
+from roadNetwork.errors import SimError
+from roadNetwork.test.simpleNetworks import getSimpleNet
+
+class TestSimResults:
+
+    def test_construction(self):
+
+        results = SimResults(0, 60, 5)
+        assert results.numTimeSteps == 12
+        assert len(results) == 0
+
+        nose.tools.assert_raises(SimError, SimResults, 0, 62, 5)
+        nose.tools.assert_raises(SimError, SimResults, 60, 0, 5)
+
+    def test_addDeleteRow(self):
+
+        results = SimResults(0, 60, 5, capacity=1)
+
+        row1 = results.addRow()
+        row2 = results.addRow()
+        assert (row1, row2) == (0, 1)
+        assert len(results) == 2
+
+        results.setVolume(row1, 10, 4)
+        results.deleteRow(row1)
+        nose.tools.assert_raises(SimError, results.deleteRow, row1)
+
+        assert results.addRow() == row1
+        assert results.getVolume(row1, 0, 60) == 0
+
+    def test_getVolume(self):
+
+        results = SimResults(0, 60, 5)
+        row = results.addRow()
+
+        results.setVolume(row, 0, 1)
+        results.setVolume(row, 5, 2)
+        results.setVolume(row, 55, 3)
+
+        assert results.getVolume(row, 0, 5) == 1
+        assert results.getVolume(row, 0, 10) == 3
+        assert results.getVolume(row, 0, 60) == 6
+        assert list(results.getVolumes(row, 50, 60)) == [0, 3]
+
+    def test_getTotalsForWindows(self):
+
+        results = SimResults(0, 60, 5)
+        row1 = results.addRow()
+        row2 = results.addRow()
+
+        results.setVolume(row1, 0, 1)
+        results.setMeanTT(row1, 0, 2)
+        results.setVolume(row1, 5, 3)
+        results.setVolume(row2, 5, 4)
+        results.setMeanTT(row2, 5, 1)
+
+        volumes, totalTimes, numInconsistent = results.getTotalsForWindows(
+            None, [(0, 5), (0, 10), (5, 60)])
+
+        assert volumes.tolist() == [[1, 4, 3], [0, 4, 4]]
+        assert totalTimes.tolist() == [[2, 2, 0], [0, 4, 4]]
+        assert numInconsistent.tolist() == [[0, 1, 1], [0, 0, 0]]
+
+        results.setMeanTT(row1, 5, 1)
+        assert results.getTotals(row1, 0, 10) == (4, 5, 0)
+
+        nose.tools.assert_raises(SimError, results.getTotalsForWindows,
+                                 None, [(0, 7)])
+
+    def test_movementResults(self):
+
+        net = getSimpleNet()
+        mov154 = net.getVertex("5").getMovement("1", "4")
+        mov254 = net.getVertex("5").getMovement("2", "4")
+
+        mov154.setSimVolume(0, 5, 1)
+        mov254.setSimVolume(0, 5, 2)
+        mov254.setSimVolume(5, 10, 3)
+
+        totals = net.getMovementResults().volume.sum(axis=0)
+        assert totals[0] == 3
+        assert totals[1] == 3
+        assert totals[2:].sum() == 0
+
+        edge54 = net.getEdge("5", "4")
+        net.deleteEdge(edge54)
+        assert net.getMovementResults().volume.sum() == 0
+
+    def test_mapToFiles(self):
+
+        directory = tempfile.mkdtemp()
+        try:
+            results = SimResults(0, 60, 5, capacity=1)
+            row = results.addRow()
+            results.setVolume(row, 5, 2)
+
+            results.mapToFiles(directory, 'w+')
+            assert results.isMemoryMapped()
+            row2 = results.addRow()
+            results.setVolume(row2, 10, 3)
+            results.flush()
+
+            readResults = SimResults(0, 60, 5)
+            readResults.mapToFiles(directory, 'r')
+            assert len(readResults) == 2
+            assert readResults.getVolume(row, 0, 60) == 2
+            assert readResults.getVolume(row2, 0, 15) == 3
+            volumes, totalTimes, numInconsistent = readResults.getTotalsForWindows(
+                None, [(0, 10), (5, 60)])
+            assert volumes.tolist() == [[2, 2], [0, 3]]
+            assert readResults.getTotals(row2, 10, 15) == (3, 0, 1)
+            nose.tools.assert_raises(SimError, readResults.setVolume, row, 0, 1)
+            nose.tools.assert_raises(SimError, readResults.deleteRow, row)
+
+            nose.tools.assert_raises(SimError, SimResults(0, 60, 10).mapToFiles,
+                                     directory, 'r')
+        finally:
+            shutil.rmtree(directory)
+
+    def test_openResults(self):
+
+        directory = tempfile.mkdtemp()
+        try:
+            net = getSimpleNet()
+            mov154 = net.getVertex("5").getMovement("1", "4")
+            mov154.setSimVolume(0, 5, 1)
+            net.openResults(directory, 'w+')
+            mov154.setSimVolume(5, 10, 2)
+            net.getEdge("5", "1").setSimVolume(0, 5, 4)
+            net.flushResults()
+
+            net2 = getSimpleNet()
+            net2.openResults(directory, 'r')
+            assert net2.getVertex("5").getMovement("1", "4").getSimVolume(0, 10) == 3
+            assert net2.getEdge("5", "1").getSimVolume(0, 5) == 4
+            assert net2.getMovementResults().isMemoryMapped()
+
+            nose.tools.assert_raises(SimError, net2.deleteEdge, net2.getEdge("5", "1"))
+            assert net2.hasEdge("5", "1")
+            nose.tools.assert_raises(SimError, net2.getEdge("5", "1").setSimVolume, 0, 5, 1)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_openResultsWithMissingMovements(self):
+
+        directory = tempfile.mkdtemp()
+        try:
+            net = getSimpleNet()
+            edge15 = net.getEdge("1", "5")
+            edge15.deleteOutMovement(net.getVertex("5").getMovement("1", "2"))
+            net.getVertex("5").getMovement("1", "4").setSimVolume(0, 5, 7)
+            net.openResults(directory, 'w+')
+            net.flushResults()
+
+            #read only files do not grow, so the missing movement is an error
+            for mode in ('r', 'c'):
+                net2 = getSimpleNet()
+                net2.getVertex("5").getMovement("1", "4").setSimVolume(0, 5, 3)
+                nose.tools.assert_raises(SimError, net2.openResults, directory, mode)
+                assert not net2.getMovementResults().isMemoryMapped()
+                assert net2.getVertex("5").getMovement("1", "4").getSimVolume(0, 5) == 3
+
+            net2 = getSimpleNet()
+            edge15 = net2.getEdge("1", "5")
+            edge15.deleteOutMovement(net2.getVertex("5").getMovement("1", "4"))
+            net2.openResults(directory, 'r+')
+            assert net2.getMovementResults().isMemoryMapped()
+            mov152 = net2.getVertex("5").getMovement("1", "2")
+            assert mov152.getSimVolume(0, 15) == 0
+            assert mov152.getSimVolumes([(0, 5), (0, 60)]).tolist() == [0, 0]
+            mov152.setSimVolume(0, 5, 2)
+            net2.flushResults()
+
+            net3 = getSimpleNet()
+            edge15 = net3.getEdge("1", "5")
+            edge15.deleteOutMovement(net3.getVertex("5").getMovement("1", "4"))
+            net3.openResults(directory, 'r')
+            assert net3.getMovementResults().isMemoryMapped()
+            assert net3.getVertex("5").getMovement("1", "2").getSimVolume(0, 5) == 2
+
+            #an edge without a row cannot get one from read only files
+            edge = net3.getEdge("5", "1")
+            nose.tools.assert_raises(SimError, edge.setSimVolume, 0, 5, 1)
+            assert net3.getEdgeResults().isMemoryMapped()
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,70 @@
+__author__ = "Michail Xyntarakis"
+__company__ = "Parsons Brinckerhoff"
+__email__ = "xyntarakis@pbworld.com"
+__license__ = "GPL"
+
+import random
+from math import sqrt
+
+import nose.tools
+
+from roadNetwork.errors import GraphError
+from roadNetwork.spatialIndex import QuadTreeIndex
+
+def getPointDistance(points, x, y):
+
+    return lambda item: sqrt((points[item][0] - x) ** 2 + (points[item][1] - y) ** 2)
+
+class TestQuadTreeIndex:
+
+    def test_insertAndDelete(self):
+
+        index = QuadTreeIndex()
+        assert index.getNearest(0, 0, 1, lambda item: 0) == []
+        index.insert("a", 0, 0, 0, 0)
+        nose.tools.assert_raises(GraphError, index.insert, "a", 1, 1, 1, 1)
+        assert "a" in index and len(index) == 1
+        index.delete("a")
+        nose.tools.assert_raises(GraphError, index.delete, "a")
+        assert not list(index.iterItemsInBBox(-1, -1, 1, 1))
+
+    def test_queries(self):
+
+        rand = random.Random(3)
+        index = QuadTreeIndex()
+        points = {}
+        for i in range(500):
+            #a dense cluster and a sparse background
+            if i % 2:
+                points[i] = (rand.uniform(0, 100), rand.uniform(0, 100))
+            else:
+                points[i] = (rand.uniform(-10000, 10000), rand.uniform(-10000, 10000))
+            index.insert(i, points[i][0], points[i][1], points[i][0], points[i][1])
+        for i in range(0, 500, 3):
+            index.delete(i)
+            del points[i]
+
+        for x, y in [(50, 50), (5000, -3000), (1e6, 1e6)]:
+            getDistance = getPointDistance(points, x, y)
+            answer = sorted(getDistance(item) for item in points)[:5]
+            result = index.getNearest(x, y, 5, getDistance)
+            assert [distance for distance, item in result] == answer
+
+            result = index.getWithinDistance(x, y, 2000, getDistance)
+            assert sorted(item for distance, item in result) == \
+                sorted(item for item in points if getDistance(item) <= 2000)
+
+        assert sorted(index.iterItemsInBBox(0, 0, 100, 100)) == \
+            sorted(item for item, (x, y) in points.iteritems()
+                   if 0 <= x <= 100 and 0 <= y <= 100)
+
+    def test_boundsShrinkOnDelete(self):
+
+        index = QuadTreeIndex()
+        for i in range(20):
+            index.insert(i, i, i, i + 1, i + 1)
+        size = index._root.size
+        index.insert("far", 1e7, 1e7, 1e7, 1e7)
+        assert index._root.size > 1e7
+        index.delete("far")
+        assert index._root.size == size